@@ -10,11 +10,33 @@ SCHOOL_CATEGORIES = {
     "浦东新区重点": ["浦东中学", "建平中学浦东校区", "进才中学", "上海中学东校", "华东师大二附中紫竹校区", "上海市实验学校东校"]
 }
 
-# 查询模式
+# 学校别名：{标准名称: [其他写法]}，标准名称即学校ID。
+# 全称与简称（如 华东师范大学/华师大、附属中学/附中）、"上海/上海市"前缀和全角字符会自动规范化，这里只需列出无法自动识别的简称
+SCHOOL_ALIASES = {
+    "上海中学": ["上中"],
+    "华师大二附中": ["华二"],
+    "复旦附中": ["复附"],
+    "交大附中": ["交附"],
+    "南洋模范": ["南洋模范中学", "南模"],
+    "格致中学": ["格致"],
+    "七宝中学": ["七宝"],
+    "上海外国语大学附属中学": ["上外附中"],
+    "上海市曹杨第二中学": ["曹杨二中"],
+    "华东师大二附中紫竹校区": ["华二紫竹"],
+}
+
+# 查询模式：提示词要求按解析器识别的格式作答，不展开解释，以减少生成的token
 QUERY_MODES = {
-    "录取分数": "{year}年上海{school}录取分数及学生来源",
-    "升学率": "{year}年上海{school}C9、985、211入线率"
+    "录取分数": "{year}年{school}录取分数及学生来源。只按格式逐行作答，不要解释：最低分：N分 最高分：N分 平均分：N分 区县名：N%",
+    "升学率": "{year}年上海{school}C9、985、211入线率。只按格式逐行作答，不要解释：C9入线率：N% 985入线率：N% 211入线率：N%"
+}
+
+# 各查询模式的生成参数：较小的max_tokens和停止序列限制回答长度，temperature为0使同一查询的结果稳定（便于缓存）
+GENERATION_PROFILES = {
+    "录取分数": {"max_tokens": 200, "temperature": 0, "stop": ["注：", "说明："]},
+    "升学率": {"max_tokens": 60, "temperature": 0, "stop": ["注：", "说明："]},
 }
+DEFAULT_GENERATION_PROFILE = {"max_tokens": 2000, "temperature": 0.7}  # 其他查询使用的生成参数
 
 # 数据年份范围
 DATA_YEARS = list(range(2021, 2026))  # 2021-2025年
@@ -32,4 +54,147 @@ PREDICTION_FILE = f"{DATA_OUTPUT_DIR}/predictions_2026.csv"
 
 # 日志配置
 LOG_LEVEL = "INFO"
-LOG_FILE = "sh_high_school.log"
\ No newline at end of file
+LOG_FILE = "sh_high_school.log"
+
+# 日志轮转配置："size" 按文件大小轮转，"time" 按时间轮转
+LOG_ROTATION = "size"
+LOG_MAX_BYTES = 5 * 1024 * 1024  # 单个日志文件最大5MB
+LOG_ROTATION_WHEN = "midnight"  # 按时间轮转时的轮转周期
+LOG_BACKUP_COUNT = 5
+
+# 单请求日志采样比例（仅作用于INFO及以下级别），降低高并发时的日志开销
+LOG_REQUEST_SAMPLE_RATE = 0.1
+LOG_SAMPLED_LOGGERS = ["base_scraper.request"]
+
+# 指标统计配置
+METRICS_OUTPUT_DIR = f"{DATA_OUTPUT_DIR}/metrics"
+METRICS_LATENCY_BUCKETS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120]  # 请求耗时直方图的桶上界（秒）
+
+# 性能分析配置
+PROFILE_ENV_VAR = "SH_PROFILE"  # 环境变量，取值如 "cprofile,tracemalloc,timers" 或 "all"
+PROFILE_DIR = "data/profile"
+PROFILE_TOP_N = 30  # 输出的热点函数和内存分配条数
+PROFILE_TRACEMALLOC_FRAMES = 1
+
+# 响应缓存配置
+RESPONSE_CACHE_FILE = "data/cache/responses.jsonl"
+RESPONSE_CACHE_TTL = 7 * 24 * 3600  # 缓存有效期（秒），过期后重新查询，API不可用时仍可使用过期缓存
+
+# 熔断器配置（所有爬虫共享）
+CIRCUIT_FAILURE_THRESHOLD = 5  # 连续失败多少次后打开熔断器
+CIRCUIT_RECOVERY_TIMEOUT = 60  # 熔断器打开后多少秒进入半开状态
+CIRCUIT_HALF_OPEN_MAX_CALLS = 1  # 半开状态下允许的探测请求数
+
+# API不可用且没有缓存时，是否使用模拟数据
+FALLBACK_TO_MOCK = True
+
+# 请求超时配置（秒）：连接超时和读取超时分开设置
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 30
+MIN_ATTEMPT_SECONDS = 3  # 截止时间前剩余时间少于该值时不再发起请求
+
+# 批量收集的整体截止时间（秒），None表示不限时
+BATCH_DEADLINE_SECONDS = None
+
+# 增量刷新配置
+REFRESH_STATE_FILE = f"{DATA_OUTPUT_DIR}/refresh_state.json"  # 记录每条数据最近一次获取的时间
+REFRESH_CALL_BUDGET = 20  # 单次刷新最多调用API的次数
+REFRESH_STALE_DAYS = 30  # 超过该天数未获取的数据视为完全陈旧
+REFRESH_YEAR_DECAY = 0.25  # 每早一年，陈旧分乘以该系数（历史年份数据基本不变）
+REFRESH_WEIGHT_MISSING = 2.0  # 缺失记录的优先级加分
+REFRESH_WEIGHT_BROKEN = 3.0  # 字段为0或异常的记录的优先级加分
+REFRESH_MIN_PRIORITY = 0.5  # 低于该优先级的记录不刷新
+
+# 数据质量检查配置
+QUALITY_SOURCE_TOLERANCE = 2  # 学生来源比例之和允许偏离100%的百分点
+QUALITY_MAX_SCORE_JUMP = 30  # 相邻年份分数允许的最大变化（分）
+QUALITY_MAX_RATE_JUMP = 20  # 相邻年份升学率允许的最大变化（百分点）
+
+# 预测时按需查询配置
+LAZY_FETCH_TARGET_YEARS = 3  # 可用历史数据少于该年数时，按需查询最近的缺失年份
+LAZY_FETCH_WORKERS = 3  # 按需查询的并发数
+
+# 交互查询后台预取配置
+PREFETCH_WORKERS = 2  # 后台预取线程数
+PREFETCH_BUDGET = 10  # 每次选择分类后最多预取的查询数（0表示关闭预取）
+
+# 交互查询的缓存优先配置（stale-while-revalidate）
+SWR_FRESH_SECONDS = 24 * 3600  # 超过该时长的缓存在返回后于后台刷新
+SWR_REFRESH_WORKERS = 2  # 后台刷新线程数
+
+# 本地HTTP查询服务配置
+HTTP_HOST = "127.0.0.1"  # 只监听本机；局域网共享时改为0.0.0.0
+HTTP_PORT = 8765
+HTTP_CACHE_MAX_ENTRIES = 1024  # 按数据版本缓存的响应条数上限
+HTTP_VERSION_CHECK_INTERVAL = 1.0  # 检查数据文件是否变化的最小间隔（秒）
+HTTP_KEEPALIVE_TIMEOUT = 15  # 空闲连接的保持时间（秒）
+
+# 物化汇总表配置
+AGGREGATES_FILE = f"{DATA_OUTPUT_DIR}/aggregates.json"  # 分类-年份统计、学校趋势和区县平均生源占比
+AGGREGATE_TOLERANCE = 1e-6  # 一致性检查允许的相对误差
+
+# 流式导出配置
+EXPORT_DIR = "data/export"
+EXPORT_CHUNK_ROWS = 5000  # 每次读取和写出的行数，决定导出和整体保存数据时的内存上限
+
+# 内存映射快照配置
+SNAPSHOT_DIR = "data/snapshot"  # 每次发布一个版本目录，CURRENT文件指向当前版本
+SNAPSHOT_KEEP_VERSIONS = 2  # 保留的快照版本数
+
+# 对冲请求配置：请求超过近期延迟的百分位仍未返回时，再发送一份相同的请求
+HEDGE_ENABLED = False  # 默认关闭，可用 --hedge 开启
+HEDGE_PERCENTILE = 95  # 对冲等待时间取最近成功请求延迟的百分位
+HEDGE_BUDGET_RATIO = 0.1  # 对冲请求最多占主请求数的比例
+HEDGE_WINDOW = 200  # 参与延迟统计的最近成功请求数
+HEDGE_MIN_SAMPLES = 20  # 样本少于该数量时不对冲
+HEDGE_MAX_WORKERS = 16  # 发送对冲请求的线程数
+
+# 大模型后端：可注册多个兼容chat completions接口的服务和模型，按近期延迟、错误率和成本路由，失败时自动切换
+# url为None表示使用DOUBAN_API_URL，api_key为None表示使用DOUBAN_API_KEY；
+# max_concurrency为该后端同时进行的请求数上限（对应其并发配额），None表示不限
+LLM_BACKENDS = [
+    {"name": "doubao", "url": None, "model": "doubao-pro", "api_key": None,
+     "cost_per_1k_tokens": 1.0, "max_concurrency": None},
+]
+ROUTER_LATENCY_ALPHA = 0.2  # 延迟和错误率移动平均的系数
+ROUTER_ERROR_PENALTY = 5.0  # 错误率为100%时的惩罚秒数（按错误率折算后加到延迟上）
+ROUTER_COST_WEIGHT = 0.5  # 每千token相对成本折算为秒的系数
+ROUTER_EXPLORE_RATE = 0.05  # 随机尝试非最优后端的概率，使各后端的统计保持更新
+
+# 批量任务配置：整批查询写入作业文件一次提交，适合全量历史数据收集
+BATCH_API_BASE = None  # 批量推理接口根地址（兼容 /files + /batches 协议），None表示使用本地替代执行器
+BATCH_ENDPOINT = "/v1/chat/completions"  # 作业中每条请求调用的接口
+BATCH_COMPLETION_WINDOW = "24h"
+BATCH_JOB_DIR = f"{DATA_OUTPUT_DIR}/batch_jobs"  # 任务目录：作业文件、结果文件和任务状态
+BATCH_POLL_INTERVAL = 30  # 轮询批次状态的间隔（秒）
+BATCH_MAX_SUBMISSIONS = 3  # 每个条目最多提交的次数（失败的条目会重新提交）
+BATCH_MAX_API_ERRORS = 5  # 批量接口连续请求失败的次数上限，超过后停止（任务状态保留，可再次运行继续）
+BATCH_UPSERT_ROWS = 200  # 每解析多少条结果写入一次数据存储
+BATCH_LOCAL_WORKERS = 4  # 本地替代执行器的并发查询数
+
+# token预算：本次运行累计的token用量上限，达到后不再发送新的查询（None表示不限，可用 --token-budget 设置）
+TOKEN_BUDGET_PER_RUN = None
+
+# 预测模型配置：每所学校按留出最后一年的回测误差自动选择模型
+PREDICTION_DAMPING = 0.8  # 阻尼趋势模型中斜率每年的衰减系数
+PREDICTION_CONFIDENCE_MAE = 20  # 回测平均绝对误差达到该分数时置信度为0
+PREDICTION_WORKERS = None  # 批量预测的进程数，None表示CPU核数
+PREDICTION_PARALLEL_MIN_TASKS = 200  # 学校数少于该值时在当前进程中计算（进程启动开销大于计算本身）
+
+# 预测区间：对历史残差做自助法重抽样
+PREDICTION_BOOTSTRAP_RESAMPLES = 1000  # 每所学校每个分数序列的重抽样次数，0表示不计算区间
+PREDICTION_INTERVAL_LEVEL = 0.8  # 区间的覆盖概率（0.8即10%到90%分位数）
+PREDICTION_INTERVAL_MIN_YEARS = 3  # 历史年份少于该值时不给出区间（两年数据的直线没有残差）
+PREDICTION_BOOTSTRAP_SEED = 2026  # 随机种子，相同数据得到相同区间
+
+# 预测矩阵：一次预测多所学校的多个年份
+PREDICTION_MATRIX_YEARS = 3  # 默认从PREDICTION_YEAR起预测的年数
+
+# 多写入方存储：写入方在文件锁下把记录追加到预写日志（数据文件名加 .wal），日志达到阈值后合并进数据文件
+STORAGE_WAL_FSYNC = True  # 每次追加后fsync，已返回的写入在断电后也不丢失
+STORAGE_COMPACT_BYTES = 1024 * 1024  # 未合并的日志达到该字节数时，由写入方合并进数据文件
+STORAGE_READ_RETRIES = 3  # 读取期间遇到合并时的重试次数，之后等待合并完成再读取
+
+# 变更数据捕获：录取分数和升学率的每次插入、更新、删除连同旧值和新值按序号追加到变更日志，下游任务从保存的位置增量处理
+CHANGE_FEED_FILE = f"{DATA_OUTPUT_DIR}/changes.jsonl"
+CHANGE_FEED_OFFSETS_DIR = f"{DATA_OUTPUT_DIR}/change_offsets"  # 各订阅方（汇总表之外的下游任务）保存的读取位置
\ No newline at end of file
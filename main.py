@@ -3,30 +3,199 @@
 上海高中数据收集系统
 主程序入口
 """
+import argparse
 import os
 import sys
 import logging
 from ui.simple_ui import SimpleUI
+from models.school import SchoolCategory
+from utils.logger import setup_logging
+from utils.profiler import enable_profiling
+from utils.exporter import DataExporter, DATASETS, FORMATS
 import config
 
-# 配置日志
-logging.basicConfig(
-    level=getattr(logging, config.LOG_LEVEL),
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    filename=config.LOG_FILE,
-    filemode='a'
-)
 logger = logging.getLogger('main')
 
+def parse_args():
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description="上海高中数据收集系统")
+    parser.add_argument(
+        "--profile",
+        metavar="MODES",
+        help="开启性能分析，可选 cprofile、tracemalloc、timers 或 all（逗号分隔），"
+             f"也可通过环境变量 {config.PROFILE_ENV_VAR} 设置"
+    )
+    parser.add_argument(
+        "--collect",
+        metavar="CATEGORY",
+        choices=[category.value for category in SchoolCategory],
+        help="不进入交互界面，直接批量收集指定分类（如 上海四校）的数据"
+    )
+    parser.add_argument(
+        "--deadline",
+        type=float,
+        default=config.BATCH_DEADLINE_SECONDS,
+        metavar="SECONDS",
+        help="批量收集的整体截止时间（秒），到时未完成的查询会被跳过并报告"
+    )
+    parser.add_argument(
+        "--bulk",
+        action="store_true",
+        help="与 --collect 一起使用，以批量任务方式提交全部查询并轮询结果；中断或部分失败后再次运行同一命令即可继续"
+    )
+    parser.add_argument(
+        "--token-budget",
+        type=int,
+        metavar="TOKENS",
+        help="本次运行累计的token用量上限，达到后不再发送新的查询（已缓存的结果仍可使用）"
+    )
+    parser.add_argument(
+        "--hedge",
+        action="store_true",
+        help=f"开启对冲请求：查询超过近期延迟的 p{config.HEDGE_PERCENTILE} 仍未返回时再发送一份，"
+             f"额外调用不超过主请求数的 {config.HEDGE_BUDGET_RATIO:.0%}%"
+    )
+    parser.add_argument(
+        "--refresh",
+        type=int,
+        nargs="?",
+        const=config.REFRESH_CALL_BUDGET,
+        metavar="BUDGET",
+        help=f"不进入交互界面，按优先级增量刷新缺失、异常或陈旧的数据，最多调用 BUDGET 次（默认 {config.REFRESH_CALL_BUDGET}）"
+    )
+    parser.add_argument(
+        "--check-quality",
+        action="store_true",
+        help="不进入交互界面，检查已存储数据中的零值、矛盾值和异常变化"
+    )
+    parser.add_argument(
+        "--repair",
+        action="store_true",
+        help="与 --check-quality 一起使用，只重新查询有问题的记录"
+    )
+    parser.add_argument(
+        "--export",
+        choices=list(DATASETS),
+        metavar="DATASET",
+        help="不进入交互界面，分块流式导出数据集：scores、rates、predictions 或 sources（学生来源按区县展开）"
+    )
+    parser.add_argument(
+        "--format",
+        choices=FORMATS,
+        default="csv",
+        help="导出格式（默认 csv，parquet 需要安装 pyarrow）"
+    )
+    parser.add_argument(
+        "--compression",
+        help="导出压缩方式：csv/jsonl 可选 gzip、bz2、xz；parquet 可选 snappy、gzip、zstd 等"
+    )
+    parser.add_argument(
+        "--columns",
+        help="只导出的列（逗号分隔）"
+    )
+    parser.add_argument(
+        "--output",
+        metavar="FILE",
+        help=f"导出文件路径（默认写入 {config.EXPORT_DIR}/）"
+    )
+    parser.add_argument(
+        "--predict-matrix",
+        nargs="*",
+        metavar="CATEGORY",
+        choices=[category.value for category in SchoolCategory],
+        help="不进入交互界面，一次预测指定分类（不指定则为全部学校）多个年份的分数，导出为宽表（可用 --format、--output）"
+    )
+    parser.add_argument(
+        "--years",
+        metavar="START-END",
+        help=f"与 --predict-matrix 一起使用的预测年份范围，如 2026-2028（默认从 {config.PREDICTION_YEAR} 起 {config.PREDICTION_MATRIX_YEARS} 年）"
+    )
+    parser.add_argument(
+        "--update-predictions",
+        action="store_true",
+        help=f"不进入交互界面，按变更日志只重新预测上次更新后录取分数有变化的学校，更新 {config.PREDICTION_FILE}（可用 --output）"
+    )
+    parser.add_argument(
+        "--publish-snapshot",
+        action="store_true",
+        help="不进入交互界面，把录取分数和升学率发布为只读的内存映射快照，供统计、预测和查询服务直接使用"
+    )
+    parser.add_argument(
+        "--serve",
+        type=int,
+        nargs="?",
+        const=config.HTTP_PORT,
+        metavar="PORT",
+        help=f"不进入交互界面，启动本地HTTP查询服务（默认端口 {config.HTTP_PORT}）"
+    )
+    return parser.parse_args()
+
 def main():
     """主程序入口"""
+    args = parse_args()
+    
+    # 配置日志（整个进程只配置一次）
+    setup_logging()
+    
+    if args.profile:
+        enable_profiling(args.profile)
+    
+    if args.hedge:
+        from scrapers.hedging import shared_hedger
+        shared_hedger.enable()
+    
+    if args.token_budget is not None:
+        from scrapers.token_budget import shared_budget
+        shared_budget.reset(args.token_budget)
+    
     # 确保数据输出目录存在
     os.makedirs(config.DATA_OUTPUT_DIR, exist_ok=True)
     
     # 启动用户界面
     try:
+        if args.export:
+            columns = [column.strip() for column in args.columns.split(",")] if args.columns else None
+            result = DataExporter.export(args.export, args.output, args.format, args.compression, columns)
+            print(f"已导出 {result['rows']} 行到 {result['output_file']}")
+            return
+        
+        if args.predict_matrix is not None:
+            from utils.predictor import ScorePredictor
+            target_years = None
+            if args.years:
+                start, _, end = args.years.partition("-")
+                target_years = range(int(start), int(end or start) + 1)
+            matrix = ScorePredictor.predict_matrix(categories=args.predict_matrix, target_years=target_years)
+            output_file = matrix.save(args.output, args.format, args.compression)
+            print(f"已导出 {len(matrix.schools)} 所学校 {matrix.years[0]}-{matrix.years[-1]} 年的预测到 {output_file}")
+            return
+        
+        if args.update_predictions:
+            from utils.predictor import ScorePredictor
+            result = ScorePredictor.update_predictions(output_file=args.output)
+            mode = "全量" if result["full"] else "增量"
+            print(f"已{mode}更新 {result['schools']} 所学校的预测: {result['output_file']}")
+            return
+        
+        if args.publish_snapshot:
+            from models.data_model import DataStorage
+            print(f"已发布数据快照: {DataStorage.publish_snapshot()}")
+            return
+        
+        if args.serve is not None:
+            from ui.http_service import run_service
+            run_service(port=args.serve)
+            return
+        
         ui = SimpleUI()
-        ui.run()
+        if args.collect:
+            ui.collect_category_data(SchoolCategory(args.collect), deadline=args.deadline, bulk=args.bulk)
+        elif args.refresh is not None:
+            ui.refresh_data(budget=args.refresh, deadline=args.deadline)
+        elif args.check_quality:
+            ui.check_data_quality(repair=args.repair, deadline=args.deadline)
+        else:
+            ui.run()
     except KeyboardInterrupt:
         print("\n程序被用户中断")
         sys.exit(0)
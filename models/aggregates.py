@@ -0,0 +1,318 @@
+"""
+物化汇总表
+维护各(分类, 年份)的分数统计、各学校的分数趋势拟合和各(年份, 区县)的平均生源占比，
+按变更日志只更新发生变化的学校所影响的部分，读取汇总结果只需查表
+"""
+import json
+import logging
+import os
+import sys
+import threading
+import numpy as np
+
+# 添加项目根目录到系统路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import config
+from models.storage_log import data_version
+
+logger = logging.getLogger('aggregates')
+
+class AggregateStore:
+    """
+    录取分数的物化汇总表
+    
+    category_year: "分类|年份" -> 平均分的min/max/avg/median/std/count（口径与DataProcessor.calculate_score_statistics一致）
+    school_trends: 学校 -> 平均分随年份的线性拟合（slope/intercept/r2/count/latest_year，只使用分数非零的记录）
+    district_share_sums: "年份|区县" -> 各学校该区县生源占比（%）之和
+    source_counts: "年份" -> 有学生来源数据的学校数，与district_share_sums相除即各学校的平均占比
+    """
+    
+    TABLES = ("category_year", "school_trends", "district_share_sums", "source_counts")
+    
+    def __init__(self, aggregates_file=None):
+        """
+        初始化汇总表
+        
+        Args:
+            aggregates_file (str, optional): 汇总表文件路径，默认使用config.AGGREGATES_FILE
+        """
+        self.aggregates_file = aggregates_file or config.AGGREGATES_FILE
+        self.tables = None
+        self.source_version = None
+        self.feed_offset = None  # 汇总表已包含的变更日志位置(序号, 字节位置)
+        self._lock = threading.RLock()
+    
+    @staticmethod
+    def _key(*parts):
+        return "|".join(str(part) for part in parts)
+    
+    @staticmethod
+    def _categories_of(school_name):
+        """学校所属的所有分类"""
+        return [category for category, schools in config.SCHOOL_CATEGORIES.items() if school_name in schools]
+    
+    def _load(self):
+        """加载汇总表文件（调用方需持有锁）"""
+        if self.tables is not None:
+            return
+        self.tables = {name: {} for name in self.TABLES}
+        self.source_version = self.feed_offset = None
+        if os.path.exists(self.aggregates_file):
+            try:
+                with open(self.aggregates_file, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                tables = data.get("tables", {})
+                # 旧版本的汇总表缺少部分表时不使用，下次读取时全量重建
+                if all(name in tables for name in self.TABLES):
+                    self.tables = {name: tables[name] for name in self.TABLES}
+                    self.source_version = data.get("source_version")
+                    self.feed_offset = tuple(data["feed_offset"]) if data.get("feed_offset") else None
+            except (OSError, ValueError) as e:
+                logger.error(f"读取汇总表失败: {str(e)}")
+    
+    def _save(self):
+        """原子写入汇总表文件（调用方需持有锁）"""
+        os.makedirs(os.path.dirname(self.aggregates_file) or ".", exist_ok=True)
+        tmp_file = f"{self.aggregates_file}.tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump({"source_version": self.source_version, "feed_offset": self.feed_offset, "tables": self.tables}, f,
+                      ensure_ascii=False)
+        os.replace(tmp_file, self.aggregates_file)
+    
+    @staticmethod
+    def _score_stats(values):
+        """计算一组平均分的统计量"""
+        values = np.asarray(values, dtype=float)
+        return {
+            "min": float(values.min()),
+            "max": float(values.max()),
+            "avg": float(values.mean()),
+            "median": float(np.median(values)),
+            "std": float(values.std()),
+            "count": int(len(values)),
+        }
+    
+    @staticmethod
+    def _trend(scores):
+        """
+        拟合一所学校平均分随年份的变化趋势
+        
+        Returns:
+            dict: 拟合结果，可用记录少于2条时返回None
+        """
+        valid = [score for score in scores if score.min_score and score.max_score and score.avg_score]
+        if len(valid) < 2:
+            return None
+        
+        years = np.array([int(score.year) for score in valid], dtype=float)
+        values = np.array([score.avg_score for score in valid], dtype=float)
+        if np.ptp(years) == 0:
+            return None
+        
+        slope, intercept = np.polyfit(years, values, 1)
+        residual = values - (slope * years + intercept)
+        total = ((values - values.mean()) ** 2).sum()
+        r2 = 1.0 - (residual ** 2).sum() / total if total > 0 else 1.0
+        return {
+            "slope": float(slope),
+            "intercept": float(intercept),
+            "r2": float(r2),
+            "count": len(valid),
+            "latest_year": int(years.max()),
+        }
+    
+    def _update_category_year(self, category, year, merged):
+        """从合并后的记录重新计算一个(分类, 年份)的统计"""
+        key = self._key(category, year)
+        values = [merged[(school, year)].avg_score for school in config.SCHOOL_CATEGORIES[category] if (school, year) in merged]
+        if values:
+            self.tables["category_year"][key] = self._score_stats(values)
+        else:
+            self.tables["category_year"].pop(key, None)
+    
+    def _update_trend(self, school_name, school_scores):
+        """重新拟合一所学校的趋势"""
+        trend = self._trend(school_scores)
+        if trend is None:
+            self.tables["school_trends"].pop(school_name, None)
+        else:
+            self.tables["school_trends"][school_name] = trend
+    
+    @staticmethod
+    def _add_to(table, key, value):
+        total = table.get(key, 0) + value
+        if abs(total) < 1e-9:
+            table.pop(key, None)
+        else:
+            table[key] = total
+    
+    def _add_sources(self, score, sign):
+        """把一条记录的学生来源占比加到（sign=-1时从）区县占比之和及学校数中"""
+        if not score.student_sources:
+            return
+        for district, share in score.student_sources.items():
+            self._add_to(self.tables["district_share_sums"], self._key(int(score.year), district), sign * share)
+        self._add_to(self.tables["source_counts"], str(int(score.year)), sign)
+    
+    def is_current(self, source_file=None):
+        """汇总表是否与录取分数数据文件的当前内容对应"""
+        with self._lock:
+            self._load()
+            return self.source_version == data_version(source_file or config.SCORE_DATA_FILE)
+    
+    def rebuild(self, scores, source_file=None, source_version=None, feed_offset=None):
+        """
+        从全部录取分数重新计算汇总表
+        
+        Args:
+            scores (list): 全部AdmissionScore对象
+            source_file (str, optional): 录取分数数据文件路径
+            source_version (list, optional): 读取scores之前的数据版本，默认取当前版本
+            feed_offset (tuple, optional): scores对应的变更日志位置，None表示之后不能按变更增量更新
+        """
+        merged = {(score.school_name, int(score.year)): score for score in scores}
+        with self._lock:
+            self.tables = {name: {} for name in self.TABLES}
+            for category, year in {(category, year) for school, year in merged for category in self._categories_of(school)}:
+                self._update_category_year(category, year, merged)
+            
+            by_school = {}
+            for score in merged.values():
+                by_school.setdefault(score.school_name, []).append(score)
+                self._add_sources(score, 1)
+            for school_name, school_scores in by_school.items():
+                self._update_trend(school_name, school_scores)
+            
+            self.source_version = source_version or data_version(source_file or config.SCORE_DATA_FILE)
+            self.feed_offset = feed_offset
+            self._save()
+        logger.info(f"已重建汇总表: {len(merged)} 条录取分数")
+    
+    def apply_upsert(self, previous, updated, merged, source_file=None, source_version=None, removed=(),
+                     feed_offset=None):
+        """
+        录取分数变化后，只更新受影响的汇总
+        
+        previous、updated和removed须恰好是汇总表当前内容与merged之间的差别（如变更日志中
+        feed_offset之后的变更），否则应调用rebuild。
+        
+        Args:
+            previous (dict): {(学校, 年份): 被替换或删除的旧记录}，新增的记录不在其中
+            updated (list): 新增或替换后的AdmissionScore对象
+            merged (dict): 变化后的全部记录 {(学校, 年份): AdmissionScore}
+            source_file (str, optional): 录取分数数据文件路径
+            source_version (list, optional): 变化后的数据版本，默认取当前版本
+            removed (list): 被删除的旧记录
+            feed_offset (tuple, optional): 已包含的变更日志位置
+        """
+        with self._lock:
+            self._load()
+            
+            for old in previous.values():
+                self._add_sources(old, -1)
+            for score in updated:
+                self._add_sources(score, 1)
+            
+            changed = list(updated) + list(removed)
+            touched_schools = {score.school_name for score in changed}
+            touched_groups = {
+                (category, int(score.year)) for score in changed for category in self._categories_of(score.school_name)
+            }
+            for category, year in touched_groups:
+                self._update_category_year(category, year, merged)
+            by_school = {school_name: [] for school_name in touched_schools}
+            for (school_name, _), score in merged.items():
+                if school_name in by_school:
+                    by_school[school_name].append(score)
+            for school_name, school_scores in by_school.items():
+                self._update_trend(school_name, school_scores)
+            
+            self.source_version = source_version or data_version(source_file or config.SCORE_DATA_FILE)
+            self.feed_offset = feed_offset
+            self._save()
+    
+    def get(self, table, key):
+        """
+        读取一项汇总结果
+        
+        Args:
+            table (str): 汇总表名称（category_year/school_trends/district_share_sums/source_counts）
+            key (str): 汇总键
+        
+        Returns:
+            汇总结果，不存在时返回None
+        """
+        with self._lock:
+            self._load()
+            return self.tables[table].get(key)
+    
+    def items(self, table):
+        """读取整张汇总表的副本"""
+        with self._lock:
+            self._load()
+            return dict(self.tables[table])
+    
+    def verify(self, scores, tolerance=None):
+        """
+        与完整重新计算的结果比较，检查汇总表是否一致
+        
+        (分类, 年份)统计使用DataProcessor的向量化统计独立计算。
+        
+        Args:
+            scores (list): 全部AdmissionScore对象
+            tolerance (float, optional): 数值允许的误差，默认使用config.AGGREGATE_TOLERANCE
+        
+        Returns:
+            list: 不一致项的说明，全部一致时为空列表
+        """
+        from utils.data_processor import DataProcessor
+        
+        tolerance = config.AGGREGATE_TOLERANCE if tolerance is None else tolerance
+        expected = {name: {} for name in self.TABLES}
+        # 与rebuild相同，同一(学校, 年份)只保留最后一条
+        scores = list({(score.school_name, int(score.year)): score for score in scores}.values())
+        
+        if scores:
+            table = DataProcessor.bulk_score_statistics(scores, percentiles=())["category_year"]
+            for (category, year), row in table.iterrows():
+                expected["category_year"][self._key(category, int(year))] = {
+                    stat: float(row[stat]) for stat in ("min", "max", "avg", "median", "std", "count")
+                }
+        
+        by_school = {}
+        for score in scores:
+            by_school.setdefault(score.school_name, []).append(score)
+            if score.student_sources:
+                for district, share in score.student_sources.items():
+                    key = self._key(int(score.year), district)
+                    expected["district_share_sums"][key] = expected["district_share_sums"].get(key, 0) + share
+                year = str(int(score.year))
+                expected["source_counts"][year] = expected["source_counts"].get(year, 0) + 1
+        for name in ("district_share_sums", "source_counts"):
+            expected[name] = {key: total for key, total in expected[name].items() if abs(total) >= 1e-9}
+        for school_name, school_scores in by_school.items():
+            trend = self._trend(school_scores)
+            if trend is not None:
+                expected["school_trends"][school_name] = trend
+        
+        def close(a, b):
+            if isinstance(a, dict) and isinstance(b, dict):
+                return a.keys() == b.keys() and all(close(a[k], b[k]) for k in a)
+            return abs(float(a) - float(b)) <= tolerance * max(1.0, abs(float(b)))
+        
+        mismatches = []
+        with self._lock:
+            self._load()
+            for name in self.TABLES:
+                actual = self.tables[name]
+                for key in sorted(set(actual) | set(expected[name])):
+                    if key not in actual:
+                        mismatches.append(f"{name}[{key}] 缺失")
+                    elif key not in expected[name]:
+                        mismatches.append(f"{name}[{key}] 多余")
+                    elif not close(actual[key], expected[name][key]):
+                        mismatches.append(f"{name}[{key}] 不一致: {actual[key]} != {expected[name][key]}")
+        return mismatches
+
+# 全局汇总表
+aggregates = AggregateStore()
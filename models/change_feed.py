@@ -0,0 +1,272 @@
+"""
+变更数据捕获
+DataStorage每次写入录取分数或升学率时，把实际插入、更新（整体替换时还有删除）的记录连同旧值和新值
+追加到变更日志，每条变更有单调递增的序号；下游任务（导出、预测、汇总表）从保存的位置订阅，只处理变化的部分
+"""
+import json
+import logging
+import os
+import sys
+import time
+
+# 添加项目根目录到系统路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import config
+from models.storage_log import FileLock
+
+logger = logging.getLogger('change_feed')
+
+# 查找最后一条变更时从文件末尾读取的字节数（一条变更只包含一行记录，远小于该值）
+TAIL_BYTES = 64 * 1024
+
+class ChangeFeed:
+    """
+    变更日志
+    
+    每行一条变更（JSON）：seq/time/table/op/key/old/new，op为insert、update或delete。
+    序号在变更日志锁内分配；写入方在数据文件的追加锁内计算并发布变更，同一数据文件的变更顺序与写入顺序一致。
+    读取位置为(序号, 字节位置)，从字节位置开始读取，不必扫描之前的变更。
+    """
+    
+    def __init__(self, feed_file=None, offsets_dir=None):
+        """
+        初始化变更日志
+        
+        Args:
+            feed_file (str, optional): 变更日志文件路径，默认使用config.CHANGE_FEED_FILE
+            offsets_dir (str, optional): 订阅位置目录，默认使用config.CHANGE_FEED_OFFSETS_DIR
+        """
+        self.feed_file = feed_file or config.CHANGE_FEED_FILE
+        self.offsets_dir = offsets_dir or config.CHANGE_FEED_OFFSETS_DIR
+        self.lock = FileLock(f"{self.feed_file}.lock")
+        self._tail = None  # 最近一次得到的(文件大小, 末尾位置)
+    
+    @staticmethod
+    def _last_seq_in(data):
+        """一段数据中最后一条完整变更的序号，没有时返回None"""
+        for line in reversed(data.split(b"\n")[:-1]):
+            try:
+                return int(json.loads(line)["seq"])
+            except (ValueError, KeyError, TypeError):
+                continue
+        return None
+    
+    def tail(self):
+        """
+        变更日志的末尾位置
+        
+        Returns:
+            tuple: (最后一条变更的序号, 最后一个完整行之后的字节位置)，没有变更时为(0, 0)
+        """
+        try:
+            size = os.path.getsize(self.feed_file)
+        except OSError:
+            size = 0
+        cached = self._tail
+        if cached is not None and cached[0] == size:
+            return cached[1]
+        
+        seq, position = 0, 0
+        if size:
+            with open(self.feed_file, "rb") as f:
+                start = max(0, size - TAIL_BYTES)
+                f.seek(start)
+                data = f.read(size - start)
+                if start > 0 and self._last_seq_in(data) is None:
+                    start = 0
+                    f.seek(0)
+                    data = f.read(size)
+            # 其他写入方可能正在写入最后一行
+            position = start + data.rfind(b"\n") + 1
+            seq = self._last_seq_in(data) or 0
+        self._tail = (size, (seq, position))
+        return seq, position
+    
+    def last_seq(self):
+        """最后一条变更的序号，没有变更时为0"""
+        return self.tail()[0]
+    
+    def publish(self, table, changes):
+        """
+        追加变更
+        
+        Args:
+            table (str): 数据表名称（scores/rates）
+            changes (list): StorageLog给出的变更 [{"op", "key", "old", "new"}]
+        
+        Returns:
+            int: 最后一条变更的序号，没有变更时返回None
+        """
+        if not changes:
+            return None
+        
+        os.makedirs(os.path.dirname(self.feed_file) or ".", exist_ok=True)
+        with self.lock:
+            seq = self.last_seq()
+            now = time.time()
+            lines = []
+            for change in changes:
+                seq += 1
+                lines.append(json.dumps({"seq": seq, "time": now, "table": table, **change}, ensure_ascii=False, default=str))
+            data = ("\n".join(lines) + "\n").encode("utf-8")
+            
+            with open(self.feed_file, "a+b") as f:
+                size = f.seek(0, os.SEEK_END)
+                if size > 0:
+                    # 上一个写入方在写入中途退出时，先结束它留下的不完整行
+                    f.seek(size - 1)
+                    if f.read(1) != b"\n":
+                        data = b"\n" + data
+                f.write(data)
+                f.flush()
+                if config.STORAGE_WAL_FSYNC:
+                    os.fsync(f.fileno())
+                self._tail = (f.tell(), (seq, f.tell()))
+        return seq
+    
+    def read(self, since=0, position=0, tables=None, until=None, limit=None):
+        """
+        读取序号大于since的变更
+        
+        Args:
+            since (int): 已处理的最后序号
+            position (int): 已处理的最后一条变更之后的字节位置
+            tables (list, optional): 只返回这些数据表的变更（其他表的变更同样计入返回的位置）
+            until (int, optional): 只读取到该序号
+            limit (int, optional): 最多返回的条数
+        
+        Returns:
+            tuple: (变更列表, 读取后的位置(序号, 字节位置))
+        """
+        try:
+            with open(self.feed_file, "rb") as f:
+                f.seek(position)
+                data = f.read()
+        except FileNotFoundError:
+            return [], (since, position)
+        
+        changes = []
+        # 最后一段没有换行符，是正在写入或写入中途退出的不完整行
+        for line in data.split(b"\n")[:-1]:
+            if line.strip():
+                try:
+                    change = json.loads(line)
+                except ValueError:
+                    logger.warning(f"跳过变更日志 {self.feed_file} 中无法解析的一行")
+                    change = None
+                if change is not None:
+                    if until is not None and change["seq"] > until:
+                        break
+                    if change["seq"] > since:
+                        since = change["seq"]
+                        if tables is None or change["table"] in tables:
+                            changes.append(change)
+            position += len(line) + 1
+            if limit is not None and len(changes) >= limit:
+                break
+        return changes, (since, position)
+    
+    def contains(self, offset):
+        """
+        读取位置是否仍然有效（变更日志被删除或替换后，之前保存的位置不再有效）
+        
+        Args:
+            offset (tuple): (序号, 字节位置)
+        
+        Returns:
+            bool: 是否有效
+        """
+        seq, position = offset
+        if position == 0:
+            return seq == 0
+        try:
+            with open(self.feed_file, "rb") as f:
+                start = max(0, position - TAIL_BYTES)
+                f.seek(start)
+                data = f.read(position - start)
+        except FileNotFoundError:
+            return False
+        if not data.endswith(b"\n"):
+            return False
+        return self._last_seq_in(data) == seq
+    
+    def subscribe(self, consumer, tables=None):
+        """
+        以保存的位置订阅变更
+        
+        Args:
+            consumer (str): 订阅方名称，各订阅方的位置分别保存
+            tables (list, optional): 只关心的数据表
+        
+        Returns:
+            Subscription: 订阅
+        """
+        return Subscription(self, consumer, tables)
+
+class Subscription:
+    """
+    一个订阅方在变更日志中的位置
+    
+    poll读取上次提交之后的变更，处理完成后调用commit保存位置；
+    处理中途退出时位置不变，下次重新读取这些变更（至少一次）。
+    """
+    
+    def __init__(self, feed, consumer, tables=None):
+        """
+        初始化订阅
+        
+        Args:
+            feed (ChangeFeed): 变更日志
+            consumer (str): 订阅方名称
+            tables (list, optional): 只关心的数据表
+        """
+        self.feed = feed
+        self.consumer = consumer
+        self.tables = tables
+        self.offset_file = os.path.join(feed.offsets_dir, f"{consumer}.json")
+        self.offset = self._load_offset()
+        self._pending = None
+    
+    def _load_offset(self):
+        try:
+            with open(self.offset_file, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            return int(data["seq"]), int(data["position"])
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.error(f"读取订阅位置失败: {str(e)}")
+            return None
+    
+    def poll(self, limit=None):
+        """
+        读取上次提交之后的变更（不移动保存的位置）
+        
+        Args:
+            limit (int, optional): 最多返回的条数
+        
+        Returns:
+            list: 变更列表；没有保存的位置或变更日志已被重置时返回None，调用方应全量处理，
+                commit后从读取时的末尾继续
+        """
+        if self.offset is None or not self.feed.contains(self.offset):
+            if self.offset is not None:
+                logger.warning(f"订阅方 {self.consumer} 保存的位置已失效（变更日志被重置），需要全量处理")
+            self._pending = self.feed.tail()
+            return None
+        changes, self._pending = self.feed.read(*self.offset, tables=self.tables, limit=limit)
+        return changes
+    
+    def commit(self):
+        """保存最近一次poll读取到的位置"""
+        if self._pending is None:
+            return
+        os.makedirs(self.feed.offsets_dir, exist_ok=True)
+        tmp_file = f"{self.offset_file}.tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump({"seq": self._pending[0], "position": self._pending[1], "time": time.time()}, f)
+        os.replace(tmp_file, self.offset_file)
+        self.offset, self._pending = self._pending, None
+
+# 全局变更日志
+change_feed = ChangeFeed()
@@ -2,13 +2,26 @@
 数据模型
 定义数据结构和处理方法
 """
+import ast
+import json
 import os
 import pandas as pd
 import sys
+import threading
+from functools import partial
 
 # 添加项目根目录到系统路径
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 import config
+from utils.profiler import profiled
+from models.aggregates import aggregates
+from models.change_feed import change_feed
+from models.snapshot import HistorySnapshot
+from models.school_index import school_index
+from models.storage_log import open_log
+
+# 同一进程内只允许一个线程按变更日志更新汇总表（同一变更不能应用两次）
+_aggregates_lock = threading.Lock()
 
 class AdmissionScore:
     """录取分数数据模型"""
@@ -18,19 +31,21 @@ class AdmissionScore:
         初始化录取分数对象
         
         Args:
-            school_name (str): 学校名称
+            school_name (str): 学校名称（任意写法，统一为学校ID）
             year (int): 年份
             min_score (float): 最低分数
             max_score (float): 最高分数
             avg_score (float): 平均分数
             student_sources (dict): 学生来源分布 {区县名: 人数}
         """
-        self.school_name = school_name
+        self.school_name = school_index.canonical(school_name)
         self.year = year
         self.min_score = min_score
         self.max_score = max_score
         self.avg_score = avg_score
         self.student_sources = student_sources or {}
+        self.cache_age = None  # 来自缓存时的数据时长（秒），不参与存储
+        self.is_mock = False  # 查询失败时由模拟数据得到，不参与存储
     
     def to_dict(self):
         """转换为字典格式"""
@@ -63,17 +78,19 @@ class AdmissionRate:
         初始化升学率对象
         
         Args:
-            school_name (str): 学校名称
+            school_name (str): 学校名称（任意写法，统一为学校ID）
             year (int): 年份
             c9_rate (float): C9入线率
             rate_985 (float): 985入线率
             rate_211 (float): 211入线率
         """
-        self.school_name = school_name
+        self.school_name = school_index.canonical(school_name)
         self.year = year
         self.c9_rate = c9_rate
         self.rate_985 = rate_985
         self.rate_211 = rate_211
+        self.cache_age = None  # 来自缓存时的数据时长（秒），不参与存储
+        self.is_mock = False  # 查询失败时由模拟数据得到，不参与存储
     
     def to_dict(self):
         """转换为字典格式"""
@@ -97,87 +114,327 @@ class AdmissionRate:
         )
 
 class DataStorage:
-    """数据存储类，负责数据的保存和加载"""
+    """
+    数据存储类，负责数据的保存和加载
+    
+    多个进程可以同时写入：合并写入只在文件锁下向预写日志追加一行，日志达到config.STORAGE_COMPACT_BYTES时
+    合并进CSV数据文件；加载时读取数据文件加尚未合并的日志，得到一致的快照。
+    每次写入实际插入、更新或删除的记录连同旧值和新值发布到变更日志（models.change_feed），
+    物化汇总表和下游任务按变更增量处理。
+    """
     
     @staticmethod
-    def save_admission_scores(scores):
-        """
-        保存录取分数数据
-        
-        Args:
-            scores (list): AdmissionScore对象列表
-        """
-        os.makedirs(os.path.dirname(config.SCORE_DATA_FILE), exist_ok=True)
-        
-        data = [score.to_dict() for score in scores]
-        df = pd.DataFrame(data)
+    def _score_frame(scores):
+        """录取分数对象转换为CSV格式的DataFrame"""
+        df = pd.DataFrame([score.to_dict() for score in scores])
         
         # 处理嵌套的student_sources字典
         if 'student_sources' in df.columns:
             # 将student_sources列转换为字符串
             df['student_sources'] = df['student_sources'].apply(str)
+        return df
+    
+    @staticmethod
+    def _score_from_row(data):
+        """CSV格式的记录字典转换为录取分数对象"""
+        data = dict(data)
+        
+        # 处理student_sources字符串转回字典
+        if 'student_sources' in data:
+            try:
+                # 尝试将字符串转换回字典
+                data['student_sources'] = ast.literal_eval(data['student_sources'])
+            except:
+                data['student_sources'] = {}
+        
+        return AdmissionScore.from_dict(data)
+    
+    @staticmethod
+    def _chunks(records, to_frame):
+        """
+        按(学校, 年份)去重后，每config.EXPORT_CHUNK_ROWS条转换为一个DataFrame分块
+        
+        Args:
+            records (list): AdmissionScore或AdmissionRate对象列表
+            to_frame (callable): 一批对象转换为DataFrame
+        
+        Yields:
+            pd.DataFrame: CSV格式的分块
+        """
+        records = list({(record.school_name, int(record.year)): record for record in records}.values())
+        for start in range(0, len(records), config.EXPORT_CHUNK_ROWS):
+            yield to_frame(records[start:start + config.EXPORT_CHUNK_ROWS])
+    
+    @staticmethod
+    def _rate_frame(rates):
+        """升学率对象转换为CSV格式的DataFrame"""
+        return pd.DataFrame([rate.to_dict() for rate in rates])
+    
+    @staticmethod
+    def _log_rows(df):
+        """DataFrame转换为可写入预写日志的记录（NumPy类型转换为JSON原生类型）"""
+        return json.loads(df.to_json(orient="records", force_ascii=False))
+    
+    @staticmethod
+    @profiled("save_admission_scores", phase_name="storage")
+    def save_admission_scores(scores):
+        """
+        保存录取分数数据（替换全部数据，并丢弃尚未合并的日志）
         
-        df.to_csv(config.SCORE_DATA_FILE, index=False)
+        按config.EXPORT_CHUNK_ROWS条分块转换并写出，不先合并为一个DataFrame。
+        
+        Args:
+            scores (list): AdmissionScore对象列表
+        """
+        open_log(config.SCORE_DATA_FILE).replace(DataStorage._chunks(scores, DataStorage._score_frame),
+                                                 partial(change_feed.publish, "scores"))
     
     @staticmethod
+    @profiled("load_admission_scores", phase_name="storage")
     def load_admission_scores():
         """
         加载录取分数数据
         
+        学校名称统一为学校ID，同一(学校, 年份)的重复行只保留最后一行。
+        
         Returns:
             list: AdmissionScore对象列表
         """
-        if not os.path.exists(config.SCORE_DATA_FILE):
+        log = open_log(config.SCORE_DATA_FILE)
+        if not log.exists():
             return []
         
-        df = pd.read_csv(config.SCORE_DATA_FILE)
-        scores = []
+        # 数据文件的记录在前、尚未合并的日志记录在后，同一(学校, 年份)保留最后一行即为最新值
+        df = log.read_frame()
+        scores = {}
         
         for _, row in df.iterrows():
-            data = row.to_dict()
-            
-            # 处理student_sources字符串转回字典
-            if 'student_sources' in data:
-                try:
-                    # 尝试将字符串转换回字典
-                    import ast
-                    data['student_sources'] = ast.literal_eval(data['student_sources'])
-                except:
-                    data['student_sources'] = {}
-            
-            scores.append(AdmissionScore.from_dict(data))
-        
-        return scores
+            score = DataStorage._score_from_row(row.to_dict())
+            scores[(score.school_name, int(score.year))] = score
+        
+        return list(scores.values())
     
     @staticmethod
+    @profiled("save_admission_rates", phase_name="storage")
     def save_admission_rates(rates):
         """
-        保存升学率数据
+        保存升学率数据（替换全部数据，并丢弃尚未合并的日志）
+        
+        按config.EXPORT_CHUNK_ROWS条分块转换并写出，不先合并为一个DataFrame。
         
         Args:
             rates (list): AdmissionRate对象列表
         """
-        os.makedirs(os.path.dirname(config.RATE_DATA_FILE), exist_ok=True)
-        
-        data = [rate.to_dict() for rate in rates]
-        df = pd.DataFrame(data)
-        df.to_csv(config.RATE_DATA_FILE, index=False)
+        open_log(config.RATE_DATA_FILE).replace(DataStorage._chunks(rates, DataStorage._rate_frame),
+                                                partial(change_feed.publish, "rates"))
     
     @staticmethod
+    @profiled("load_admission_rates", phase_name="storage")
     def load_admission_rates():
         """
         加载升学率数据
         
+        学校名称统一为学校ID，同一(学校, 年份)的重复行只保留最后一行。
+        
         Returns:
             list: AdmissionRate对象列表
         """
-        if not os.path.exists(config.RATE_DATA_FILE):
+        log = open_log(config.RATE_DATA_FILE)
+        if not log.exists():
             return []
         
-        df = pd.read_csv(config.RATE_DATA_FILE)
-        rates = []
+        df = log.read_frame()
+        rates = {}
         
         for _, row in df.iterrows():
-            rates.append(AdmissionRate.from_dict(row.to_dict()))
+            rate = AdmissionRate.from_dict(row.to_dict())
+            rates[(rate.school_name, int(rate.year))] = rate
+        
+        return list(rates.values())
+    
+    @staticmethod
+    def upsert_admission_scores(scores):
+        """
+        按(学校, 年份)合并保存录取分数数据，已有记录被替换，其余记录保持不变
+        
+        只向预写日志追加本次的记录，不重写数据文件；与已有记录不同的行发布到变更日志，
+        汇总表在下次读取时按变更增量更新。
+        
+        Args:
+            scores (list): AdmissionScore对象列表
+        """
+        updated = {(score.school_name, int(score.year)): score for score in scores}
+        if not updated:
+            return
+        log = open_log(config.SCORE_DATA_FILE)
+        log.append(DataStorage._log_rows(DataStorage._score_frame(updated.values())),
+                   on_changes=partial(change_feed.publish, "scores"))
+        log.maybe_compact()
+    
+    @staticmethod
+    def upsert_admission_rates(rates):
+        """
+        按(学校, 年份)合并保存升学率数据，已有记录被替换，其余记录保持不变
+        
+        Args:
+            rates (list): AdmissionRate对象列表
+        """
+        updated = {(rate.school_name, int(rate.year)): rate for rate in rates}
+        if not updated:
+            return
+        log = open_log(config.RATE_DATA_FILE)
+        log.append(DataStorage._log_rows(DataStorage._rate_frame(updated.values())),
+                   on_changes=partial(change_feed.publish, "rates"))
+        log.maybe_compact()
+    
+    @staticmethod
+    def _feed_cut(log):
+        """
+        同一时刻的数据版本和变更日志位置（写入方在追加锁内写入日志并发布变更，锁内读取两者即对应同一时刻）
         
-        return rates
\ No newline at end of file
+        Returns:
+            tuple: (数据版本, 变更日志位置)
+        """
+        with log.append_lock:
+            return log.version(), change_feed.tail()
+    
+    @staticmethod
+    def _refresh_aggregates(full=False):
+        """
+        让汇总表跟上录取分数数据
+        
+        汇总表记录了变更日志位置时，只读取之后的录取分数变更，重新计算变化的学校及其(分类, 年份)的汇总；
+        没有记录位置、变更日志已被重置或full为True时全量重建。
+        
+        Args:
+            full (bool): 是否全量重建
+        """
+        log = open_log(config.SCORE_DATA_FILE)
+        version, cut = DataStorage._feed_cut(log)
+        offset = aggregates.feed_offset
+        
+        if full or offset is None or not change_feed.contains(offset):
+            # 重建所用的数据须恰好对应cut：读取期间有新的变更时重新读取，多次失败后在追加锁内读取
+            for _ in range(config.STORAGE_READ_RETRIES):
+                scores = DataStorage.load_admission_scores()
+                with log.append_lock:
+                    if change_feed.last_seq() == cut[0]:
+                        break
+                version, cut = DataStorage._feed_cut(log)
+            else:
+                # 与合并相同的加锁顺序，锁内读取不会再等待合并
+                with log.compact_lock, log.append_lock:
+                    version, cut = log.version(), change_feed.tail()
+                    scores = DataStorage.load_admission_scores()
+            aggregates.rebuild(scores, source_version=version, feed_offset=cut)
+            return
+        
+        changes, offset = change_feed.read(*offset, tables=["scores"], until=cut[0])
+        previous, latest = {}, {}
+        for change in changes:
+            old = change["old"] and DataStorage._score_from_row(change["old"])
+            new = change["new"] and DataStorage._score_from_row(change["new"])
+            key = (old or new).school_name, int((old or new).year)
+            previous.setdefault(key, old)
+            latest[key] = new
+        
+        # 没有变更（如只是日志被合并）时不必加载数据，只记录新的数据版本；
+        # merged中cut之后的写入在下次更新时按变更再处理
+        merged = {}
+        if latest:
+            merged = {(score.school_name, int(score.year)): score for score in DataStorage.load_admission_scores()}
+        aggregates.apply_upsert(
+            {key: old for key, old in previous.items() if old is not None},
+            [new for new in latest.values() if new is not None],
+            merged,
+            source_version=version,
+            removed=[previous[key] for key, new in latest.items() if new is None and previous[key] is not None],
+            feed_offset=offset,
+        )
+    
+    @staticmethod
+    def _current_aggregates():
+        """返回与数据文件一致的汇总表，数据文件变化后先按变更日志更新"""
+        if not aggregates.is_current():
+            with _aggregates_lock:
+                if not aggregates.is_current():
+                    DataStorage._refresh_aggregates()
+        return aggregates
+    
+    @staticmethod
+    def get_category_score_stats(category, year):
+        """
+        读取(分类, 年份)的平均分统计（物化汇总表查表）
+        
+        Returns:
+            dict: min/max/avg/median/std/count，没有数据时返回None
+        """
+        return DataStorage._current_aggregates().get("category_year", f"{category}|{int(year)}")
+    
+    @staticmethod
+    def get_school_trend(school_name):
+        """
+        读取学校平均分的线性趋势（物化汇总表查表）
+        
+        Returns:
+            dict: slope/intercept/r2/count/latest_year，可用数据不足时返回None
+        """
+        return DataStorage._current_aggregates().get("school_trends", school_index.canonical(school_name))
+    
+    @staticmethod
+    def get_district_shares(year):
+        """
+        读取指定年份各区县的平均生源占比（物化汇总表查表）
+        
+        student_sources中是各区县学生占该校的百分比，不能跨学校相加；这里按有学生来源数据的学校取平均，
+        没有列出某区县的学校按0%计。
+        
+        Returns:
+            dict: {区县名: 平均占比（%）}，该年份没有学生来源数据时为空字典
+        """
+        store = DataStorage._current_aggregates()
+        schools = store.get("source_counts", str(int(year)))
+        if not schools:
+            return {}
+        prefix = f"{int(year)}|"
+        sums = store.items("district_share_sums")
+        return {key[len(prefix):]: total / schools for key, total in sums.items() if key.startswith(prefix)}
+    
+    @staticmethod
+    def verify_aggregates():
+        """
+        与完整重新计算的结果比较，检查物化汇总表是否一致
+        
+        Returns:
+            list: 不一致项的说明，全部一致时为空列表
+        """
+        return DataStorage._current_aggregates().verify(DataStorage.load_admission_scores())
+    
+    @staticmethod
+    def rebuild_aggregates():
+        """从全部录取分数重建物化汇总表"""
+        with _aggregates_lock:
+            DataStorage._refresh_aggregates(full=True)
+    
+    @staticmethod
+    def publish_snapshot(snapshot_dir=None):
+        """
+        把当前的录取分数和升学率发布为只读的内存映射快照
+        
+        Args:
+            snapshot_dir (str, optional): 快照根目录，默认使用config.SNAPSHOT_DIR
+        
+        Returns:
+            str: 新版本目录
+        """
+        return HistorySnapshot.publish(snapshot_dir)
+    
+    @staticmethod
+    def open_snapshot(snapshot_dir=None):
+        """
+        打开与数据文件一致的快照
+        
+        Returns:
+            HistorySnapshot: 快照对象，未发布或已过期时返回None
+        """
+        return HistorySnapshot.open_current(snapshot_dir)
\ No newline at end of file
@@ -0,0 +1,146 @@
+"""
+学校名称规范化
+把同一所学校的不同写法（全称、简称、带"上海/上海市"前缀、全角字符等）映射到唯一的学校ID，
+学校ID即config.SCHOOL_CATEGORIES中的标准名称；爬虫、响应缓存、数据存储和数据处理都以学校ID为键
+"""
+import logging
+import os
+import re
+import sys
+import threading
+import unicodedata
+
+# 添加项目根目录到系统路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import config
+
+logger = logging.getLogger('school_index')
+
+# 规范化时依次替换的常见全称和简称（对标准名称和查询名称做同样的替换，保证两边一致）
+NAME_REWRITES = [
+    ("华东师范大学", "华东师大"),
+    ("华东师大", "华师大"),
+    ("复旦大学", "复旦"),
+    ("上海交通大学", "交大"),
+    ("交通大学", "交大"),
+    ("上海外国语大学", "上外"),
+    ("第一附属中学", "一附中"),
+    ("第二附属中学", "二附中"),
+    ("附属中学", "附中"),
+    ("高级中学", "中学"),
+]
+# 查不到时依次尝试去掉的前缀
+OPTIONAL_PREFIXES = ("上海市", "上海")
+# canonical缓存的名称数上限（同一学校的写法可以有任意多种，如首尾空白不同）
+CANONICAL_CACHE_SIZE = 10000
+_IGNORED_CHARS = re.compile(r"[\s·•()（）\[\]【】\"'“”‘’]")
+
+class SchoolIndex:
+    """
+    学校名称索引
+    
+    构建时为每个标准名称及其别名计算规范化键，查询时对名称做同样的规范化后查哈希表，
+    查不到时再去掉"上海市"/"上海"前缀重试。
+    """
+    
+    def __init__(self, categories=None, aliases=None):
+        """
+        初始化索引
+        
+        Args:
+            categories (dict, optional): 学校分类，默认使用config.SCHOOL_CATEGORIES
+            aliases (dict, optional): {标准名称: [别名]}，默认使用config.SCHOOL_ALIASES
+        """
+        categories = config.SCHOOL_CATEGORIES if categories is None else categories
+        aliases = config.SCHOOL_ALIASES if aliases is None else aliases
+        self._index = {}
+        self._cache = {}
+        self._lock = threading.Lock()
+        
+        for schools in categories.values():
+            for school in schools:
+                self._add(self.normalize(school), school)
+        for school, names in aliases.items():
+            for name in [school] + list(names):
+                self._add(self.normalize(name), school)
+    
+    def _add(self, key, school_id):
+        existing = self._index.get(key)
+        if existing is not None and existing != school_id:
+            raise ValueError(f"学校名称冲突: {key} 同时对应 {existing} 和 {school_id}，请检查SCHOOL_ALIASES")
+        self._index[key] = school_id
+    
+    @staticmethod
+    def normalize(name):
+        """
+        名称的规范化键：统一全角/半角，去掉空白和括号等符号，替换常见全称为简称
+        
+        Args:
+            name (str): 学校名称
+        
+        Returns:
+            str: 规范化键
+        """
+        key = _IGNORED_CHARS.sub("", unicodedata.normalize("NFKC", str(name)))
+        for full, short in NAME_REWRITES:
+            key = key.replace(full, short)
+        return key
+    
+    def lookup(self, name):
+        """
+        查找学校ID
+        
+        Args:
+            name (str): 任意写法的学校名称
+        
+        Returns:
+            str: 学校ID，未知学校返回None
+        """
+        key = self.normalize(name)
+        school_id = self._index.get(key)
+        if school_id is None:
+            for prefix in OPTIONAL_PREFIXES:
+                if key.startswith(prefix) and len(key) > len(prefix):
+                    school_id = self._index.get(key[len(prefix):])
+                    if school_id is not None:
+                        break
+        return school_id
+    
+    def canonical(self, name):
+        """
+        学校ID，未知学校返回去掉首尾空白后的原名称
+        
+        查到的学校ID按原名称缓存（最多CANONICAL_CACHE_SIZE个名称），重复查询只需一次字典查找；
+        未知名称不缓存，避免查询服务收到的任意名称使缓存无限增长。
+        
+        Args:
+            name (str): 任意写法的学校名称
+        
+        Returns:
+            str: 学校ID
+        """
+        school_id = self._cache.get(name)
+        if school_id is None:
+            school_id = self.lookup(name)
+            if school_id is None:
+                return unicodedata.normalize("NFKC", str(name)).strip()
+            with self._lock:
+                if len(self._cache) < CANONICAL_CACHE_SIZE:
+                    self._cache[name] = school_id
+        return school_id
+    
+    def unique(self, names):
+        """
+        规范化并去重（保持原有顺序）
+        
+        Args:
+            names (list): 学校名称列表
+        
+        Returns:
+            list: 学校ID列表
+        """
+        return list(dict.fromkeys(self.canonical(name) for name in names))
+
+
+# 全局学校名称索引
+school_index = SchoolIndex()
@@ -0,0 +1,217 @@
+"""
+历史数据快照
+把录取分数和升学率的数值列发布为只读的NumPy数组文件（.npy）并附带一个小的JSON索引，
+读取时以内存映射方式打开，多个进程共享同一份页缓存，无需解析CSV或创建对象
+"""
+import json
+import logging
+import os
+import shutil
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+# 添加项目根目录到系统路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import config
+from models.school_index import school_index
+from models.storage_log import data_version, open_log
+
+logger = logging.getLogger('snapshot')
+
+# 数据集 -> (数据文件配置项, 数值列)
+SNAPSHOT_TABLES = {
+    "scores": ("SCORE_DATA_FILE", ["min_score", "max_score", "avg_score"]),
+    "rates": ("RATE_DATA_FILE", ["c9_rate", "rate_985", "rate_211"]),
+}
+INDEX_FILE = "index.json"
+CURRENT_FILE = "CURRENT"
+
+class HistorySnapshot:
+    """
+    以内存映射方式打开的历史数据快照
+    
+    每个数据集按(学校, 年份)排序，school列为学校编号（对应索引中的schools），
+    索引中记录每所学校的行范围，按学校取数据只是数组切片。
+    """
+    
+    def __init__(self, path, index, arrays):
+        """
+        初始化快照（请使用open或open_current打开）
+        
+        Args:
+            path (str): 快照版本目录
+            index (dict): 索引
+            arrays (dict): {数据集: {列名: np.memmap}}
+        """
+        self.path = path
+        self.index = index
+        self.arrays = arrays
+        self.schools = index["schools"]
+    
+    @staticmethod
+    def _base_dir(snapshot_dir=None):
+        return snapshot_dir or config.SNAPSHOT_DIR
+    
+    @staticmethod
+    def publish(snapshot_dir=None, keep=None):
+        """
+        从数据文件发布新的快照版本
+        
+        先写入新的版本目录，再原子地切换CURRENT指针，已打开旧版本的进程不受影响。
+        
+        Args:
+            snapshot_dir (str, optional): 快照根目录，默认使用config.SNAPSHOT_DIR
+            keep (int, optional): 保留的版本数，默认使用config.SNAPSHOT_KEEP_VERSIONS
+        
+        Returns:
+            str: 新版本目录
+        """
+        base_dir = HistorySnapshot._base_dir(snapshot_dir)
+        keep = keep or config.SNAPSHOT_KEEP_VERSIONS
+        
+        frames = {}
+        source_versions = {}
+        for table, (file_key, columns) in SNAPSHOT_TABLES.items():
+            data_file = getattr(config, file_key)
+            source_versions[table] = data_version(data_file)
+            if source_versions[table] is None:
+                frames[table] = pd.DataFrame(columns=["school_name", "year"] + columns)
+            else:
+                # 包含预写日志中尚未合并的记录
+                frame = open_log(data_file).read_frame(usecols=["school_name", "year"] + columns)
+                # 学校名称统一为学校ID，重复的(学校, 年份)保留最后一行
+                frame["school_name"] = frame["school_name"].map(school_index.canonical)
+                frames[table] = frame.drop_duplicates(["school_name", "year"], keep="last")
+        
+        schools = sorted(set().union(*(frame["school_name"].astype(str) for frame in frames.values())))
+        codes = {name: code for code, name in enumerate(schools)}
+        
+        # 版本名按时间排序，且每次发布都写入新目录，不覆盖其他进程正在映射的文件
+        now = time.time_ns()
+        version = time.strftime("%Y%m%d%H%M%S", time.localtime(now / 1e9)) + f"-{now % 10**9:09d}-{os.getpid()}"
+        version_dir = os.path.join(base_dir, version)
+        os.makedirs(version_dir)
+        
+        index = {"version": version, "schools": schools, "source_versions": source_versions, "tables": {}}
+        for table, (_, columns) in SNAPSHOT_TABLES.items():
+            frame = frames[table].assign(school=frames[table]["school_name"].astype(str).map(codes))
+            frame = frame.sort_values(["school", "year"], kind="stable").reset_index(drop=True)
+            
+            arrays = {
+                "school": frame["school"].to_numpy(dtype=np.int32),
+                "year": frame["year"].to_numpy(dtype=np.int16),
+            }
+            for column in columns:
+                arrays[column] = pd.to_numeric(frame[column], errors="coerce").fillna(0).to_numpy(dtype=np.float64)
+            for column, values in arrays.items():
+                np.save(os.path.join(version_dir, f"{table}.{column}.npy"), values)
+            
+            # 每所学校的行范围 [start, end)
+            starts = np.searchsorted(arrays["school"], np.arange(len(schools)), side="left")
+            ends = np.searchsorted(arrays["school"], np.arange(len(schools)), side="right")
+            index["tables"][table] = {
+                "rows": int(len(frame)),
+                "columns": list(arrays),
+                "offsets": {name: [int(starts[code]), int(ends[code])] for code, name in enumerate(schools) if ends[code] > starts[code]},
+            }
+        
+        with open(os.path.join(version_dir, INDEX_FILE), "w", encoding="utf-8") as f:
+            json.dump(index, f, ensure_ascii=False)
+        
+        current_file = os.path.join(base_dir, CURRENT_FILE)
+        with open(f"{current_file}.tmp", "w", encoding="utf-8") as f:
+            f.write(version)
+        os.replace(f"{current_file}.tmp", current_file)
+        logger.info(f"已发布数据快照 {version}: 录取分数 {index['tables']['scores']['rows']} 行，升学率 {index['tables']['rates']['rows']} 行")
+        
+        # 清理旧版本（已映射旧文件的进程在Linux上仍可继续读取）
+        versions = sorted(name for name in os.listdir(base_dir) if os.path.isdir(os.path.join(base_dir, name)))
+        for old in versions[:-keep]:
+            shutil.rmtree(os.path.join(base_dir, old), ignore_errors=True)
+        
+        return version_dir
+    
+    @classmethod
+    def open(cls, snapshot_dir=None):
+        """
+        以内存映射方式打开当前快照
+        
+        Args:
+            snapshot_dir (str, optional): 快照根目录
+        
+        Returns:
+            HistorySnapshot: 快照对象，尚未发布时返回None
+        """
+        base_dir = cls._base_dir(snapshot_dir)
+        try:
+            with open(os.path.join(base_dir, CURRENT_FILE), "r", encoding="utf-8") as f:
+                version_dir = os.path.join(base_dir, f.read().strip())
+            with open(os.path.join(version_dir, INDEX_FILE), "r", encoding="utf-8") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return None
+        
+        arrays = {
+            table: {
+                column: np.load(os.path.join(version_dir, f"{table}.{column}.npy"), mmap_mode="r")
+                for column in meta["columns"]
+            }
+            for table, meta in index["tables"].items()
+        }
+        return cls(version_dir, index, arrays)
+    
+    @classmethod
+    def open_current(cls, snapshot_dir=None):
+        """
+        打开快照，快照不存在或与数据文件不一致时返回None
+        
+        Returns:
+            HistorySnapshot: 快照对象或None
+        """
+        snapshot = cls.open(snapshot_dir)
+        if snapshot is None or not snapshot.is_current():
+            return None
+        return snapshot
+    
+    def is_current(self):
+        """快照是否与数据文件的当前内容一致"""
+        return all(
+            self.index["source_versions"].get(table) == data_version(getattr(config, file_key))
+            for table, (file_key, _) in SNAPSHOT_TABLES.items()
+        )
+    
+    def school_rows(self, table, school_name):
+        """
+        一所学校在数据集中的全部行（数组切片，不复制数据）
+        
+        Args:
+            table (str): 数据集（scores/rates）
+            school_name (str): 学校名称
+        
+        Returns:
+            dict: {列名: 数组视图}，没有数据时各列为空数组
+        """
+        start, end = self.index["tables"][table]["offsets"].get(school_index.canonical(school_name), (0, 0))
+        return {column: values[start:end] for column, values in self.arrays[table].items()}
+    
+    def frame(self, table, columns=None):
+        """
+        数据集的列式视图，school_name为分类类型（编号直接引用映射数组）
+        
+        Args:
+            table (str): 数据集（scores/rates）
+            columns (list, optional): 需要的数值列，默认全部
+        
+        Returns:
+            pd.DataFrame: 列为school_name、year及数值列
+        """
+        arrays = self.arrays[table]
+        columns = columns or [column for column in arrays if column not in ("school", "year")]
+        data = {
+            "school_name": pd.Categorical.from_codes(arrays["school"], categories=self.schools),
+            "year": arrays["year"],
+        }
+        data.update({column: arrays[column] for column in columns})
+        return pd.DataFrame(data, copy=False)
@@ -0,0 +1,442 @@
+"""
+多写入方安全的数据文件
+写入方在咨询锁下把记录追加到预写日志（write-ahead log），日志达到阈值后合并进主数据文件；
+读取方读取主数据文件加日志中尚未合并的记录，得到一致的快照，且不阻塞写入方
+"""
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# 添加项目根目录到系统路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import config
+
+logger = logging.getLogger('storage_log')
+
+class FileLock:
+    """
+    基于锁文件的跨进程咨询锁
+    
+    每次加锁都重新打开锁文件，同一进程内的多个线程之间同样互斥。
+    """
+    
+    def __init__(self, path):
+        """
+        初始化锁
+        
+        Args:
+            path (str): 锁文件路径
+        """
+        self.path = path
+        self._local = threading.local()
+    
+    def __enter__(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        handle = open(self.path, "a+b")
+        try:
+            if fcntl is not None:
+                fcntl.flock(handle.fileno(), fcntl.LOCK_EX)
+            else:
+                handle.seek(0)
+                while True:
+                    try:
+                        msvcrt.locking(handle.fileno(), msvcrt.LK_LOCK, 1)
+                        break
+                    except OSError:
+                        # LK_LOCK重试约10秒后仍未获得锁时抛出异常，继续等待
+                        continue
+        except BaseException:
+            handle.close()
+            raise
+        self._local.handle = handle
+        return self
+    
+    def __exit__(self, exc_type, exc, traceback):
+        handle = self._local.handle
+        self._local.handle = None
+        try:
+            if fcntl is not None:
+                fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+            else:
+                handle.seek(0)
+                msvcrt.locking(handle.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            handle.close()
+
+def _stat(path):
+    """文件的[inode, 修改时间, 大小]，不存在时返回None"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_ino, stat.st_mtime_ns, stat.st_size]
+
+class StorageLog:
+    """
+    一个CSV数据文件及其预写日志
+    
+    日志每行是一次追加的全部记录（JSON），一次追加要么完整可见、要么不可见。
+    合并时先在锁内把日志改名为合并中文件（写入方随即开始新的日志），再把主数据文件与其合并后原子替换，
+    读取方发现主数据文件或合并中文件在读取期间发生变化时重新读取。
+    """
+    
+    def __init__(self, data_file, key_columns=("school_name", "year")):
+        """
+        初始化
+        
+        Args:
+            data_file (str): 主数据文件路径
+            key_columns (tuple): 记录的唯一键，合并时相同键保留最后写入的一行
+        """
+        self.data_file = data_file
+        self.wal_file = f"{data_file}.wal"
+        self.compacting_file = f"{data_file}.wal.compacting"
+        self.key_columns = list(key_columns)
+        # 追加锁只在写入一行日志和日志改名时持有；合并锁在整个合并期间持有，不阻塞追加
+        self.append_lock = FileLock(f"{data_file}.lock")
+        self.compact_lock = FileLock(f"{data_file}.compact.lock")
+        # 每个键的最新记录，只在调用方需要变更时维护（见_latest_rows）
+        self._latest = None
+    
+    def version(self):
+        """
+        数据版本：主数据文件、合并中文件和日志的[inode, 修改时间, 大小]，任一写入或合并都会改变
+        
+        Returns:
+            list: 版本，三个文件都不存在时返回None
+        """
+        stats = [_stat(self.data_file), _stat(self.compacting_file), _stat(self.wal_file)]
+        return None if stats == [None, None, None] else stats
+    
+    def exists(self):
+        """是否有任何数据"""
+        return self.version() is not None
+    
+    def append(self, rows, expected_version=None, on_changes=None):
+        """
+        追加记录（一次追加作为日志中的一行，原子可见）
+        
+        Args:
+            rows (list): 记录字典列表，键为CSV列名，值为JSON原生类型
+            expected_version (list, optional): 调用方此前读取到的数据版本
+            on_changes (callable, optional): 写入后仍在追加锁内调用，参数为实际插入或更新的记录列表
+                [{"op", "key", "old", "new"}]（与已有记录完全相同的行不算变更），同一数据文件的变更按写入顺序到达
+        
+        Returns:
+            tuple: (追加后的数据版本, 追加前的版本是否仍等于expected_version，即期间没有其他写入)
+        """
+        line = json.dumps({"time": time.time(), "pid": os.getpid(), "rows": rows}, ensure_ascii=False, default=str)
+        data = (line + "\n").encode("utf-8")
+        
+        os.makedirs(os.path.dirname(self.wal_file) or ".", exist_ok=True)
+        with self.append_lock:
+            intact = expected_version is not None and self.version() == expected_version
+            if on_changes is not None:
+                changes, latest = self._diff(self._latest_rows(), rows)
+            with open(self.wal_file, "ab") as f:
+                # 上一个写入方在写入中途退出时，先结束它留下的不完整行
+                if f.tell() > 0 and not self._ends_with_newline(self.wal_file):
+                    f.write(b"\n")
+                f.write(data)
+                f.flush()
+                if config.STORAGE_WAL_FSYNC:
+                    os.fsync(f.fileno())
+            if on_changes is not None:
+                self._latest["rows"].update(latest)
+                self._latest["layout"], self._latest["offset"] = self._layout()
+                if changes:
+                    on_changes(changes)
+            version = self.version()
+        return version, intact
+    
+    @staticmethod
+    def _ends_with_newline(path):
+        with open(path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+    
+    def _read_log(self, path, limit=None, start=0):
+        """
+        读取一个日志文件中的记录
+        
+        Args:
+            path (str): 日志文件
+            limit (int, optional): 只读取到第limit字节（读取开始时的大小，之后追加的记录不读）
+            start (int): 从第start字节（某一行的开头）开始读取
+        
+        Returns:
+            list: 记录字典列表（按写入顺序）
+        """
+        try:
+            with open(path, "rb") as f:
+                f.seek(start)
+                data = f.read() if limit is None else f.read(limit - start)
+        except FileNotFoundError:
+            return []
+        
+        rows = []
+        lines = data.split(b"\n")
+        # 最后一段没有换行符，是正在写入或写入中途退出的不完整行
+        for line in lines[:-1]:
+            if not line.strip():
+                continue
+            try:
+                rows.extend(json.loads(line)["rows"])
+            except (ValueError, KeyError, TypeError):
+                logger.warning(f"跳过日志 {path} 中无法解析的一行")
+        return rows
+    
+    def _layout(self):
+        """
+        读取一致性所依赖的文件布局：主数据文件和合并中文件的状态，以及日志的inode
+        
+        日志只会被追加（读取时只读到开始时的大小）或被改名（inode改变），因此不比较其大小。
+        """
+        main, compacting, wal = self.version() or [None, None, None]
+        return (main, compacting, wal and wal[0]), (wal[2] if wal else 0)
+    
+    def _read_once(self, usecols):
+        """读取一次主数据文件和日志，返回(读取前的文件布局, DataFrame列表)"""
+        layout, wal_size = self._layout()
+        frames = []
+        if layout[0] is not None:
+            try:
+                frames.append(pd.read_csv(self.data_file, usecols=usecols))
+            except FileNotFoundError:
+                # 读取前刚被合并替换，重新读取
+                return None, []
+        
+        rows = self._read_log(self.compacting_file) + self._read_log(self.wal_file, wal_size)
+        if rows:
+            pending = pd.DataFrame(rows)
+            if usecols is not None:
+                pending = pending.reindex(columns=usecols)
+            frames.append(pending)
+        return layout, frames
+    
+    def read_frame(self, usecols=None):
+        """
+        读取一致的数据快照：主数据文件的记录在前，尚未合并的日志记录按写入顺序在后
+        
+        不去重，调用方按键保留最后一行即得到最新值。读取期间发生合并时重新读取，
+        重试config.STORAGE_READ_RETRIES次后在合并锁内读取（只等待合并，不阻塞追加）。
+        
+        Args:
+            usecols (list, optional): 只读取的列
+        
+        Returns:
+            pd.DataFrame: 数据，没有数据时为空表
+        """
+        for _ in range(config.STORAGE_READ_RETRIES):
+            layout, frames = self._read_once(usecols)
+            if layout is not None and layout == self._layout()[0]:
+                return self._concat(frames, usecols)
+        
+        with self.compact_lock:
+            _, frames = self._read_once(usecols)
+            return self._concat(frames, usecols)
+    
+    def _key_of(self, row):
+        return tuple(row.get(column) for column in self.key_columns)
+    
+    def _latest_rows(self):
+        """
+        每个键的最新记录（调用方需持有追加锁）
+        
+        上次之后只有日志增长时，从上次读到的位置读取新增的行；主数据文件或合并中文件发生变化、
+        日志被改名时完整读取一次。持有追加锁时不能再等待合并锁（合并方先持有合并锁再等待追加锁），
+        读取期间遇到合并时直接重试。
+        
+        Returns:
+            dict: {键: 记录字典}
+        """
+        layout, wal_size = self._layout()
+        latest = self._latest
+        if latest is None or latest["layout"] != layout:
+            while True:
+                layout, frames = self._read_once(None)
+                if layout is not None and layout == self._layout()[0]:
+                    break
+                time.sleep(0.01)
+            frame = self._concat(frames, None)
+            rows = {}
+            for row in json.loads(frame.to_json(orient="records", force_ascii=False)):
+                rows[self._key_of(row)] = row
+            # 持有追加锁时日志不会增长
+            latest = self._latest = {"layout": layout, "offset": self._layout()[1], "rows": rows}
+        elif wal_size > latest["offset"]:
+            for row in self._read_log(self.wal_file, wal_size, latest["offset"]):
+                latest["rows"][self._key_of(row)] = row
+            latest["offset"] = wal_size
+        return latest["rows"]
+    
+    def _diff(self, current, rows):
+        """
+        计算写入rows相对current的变更
+        
+        Returns:
+            tuple: (变更列表, {键: 写入后的记录})
+        """
+        changes = []
+        latest = {}
+        for row in rows:
+            key = self._key_of(row)
+            old = latest.get(key, current.get(key))
+            latest[key] = row
+            if old is not None and all(old.get(column) == value for column, value in row.items()):
+                continue
+            changes.append({"op": "insert" if old is None else "update", "key": list(key), "old": old, "new": row})
+        return changes, latest
+    
+    @staticmethod
+    def _concat(frames, usecols):
+        frames = [frame for frame in frames if len(frame.columns)]
+        if not frames:
+            return pd.DataFrame(columns=usecols or [])
+        if len(frames) == 1:
+            return frames[0]
+        return pd.concat(frames, ignore_index=True)
+    
+    def pending_bytes(self):
+        """尚未合并的日志字节数"""
+        return sum(stat[2] for stat in (_stat(self.compacting_file), _stat(self.wal_file)) if stat)
+    
+    def maybe_compact(self):
+        """日志达到config.STORAGE_COMPACT_BYTES时合并"""
+        if self.pending_bytes() >= config.STORAGE_COMPACT_BYTES:
+            self.compact()
+    
+    def compact(self):
+        """
+        把日志合并进主数据文件
+        
+        Returns:
+            int: 合并的记录数
+        """
+        with self.compact_lock:
+            with self.append_lock:
+                if os.path.exists(self.wal_file):
+                    if os.path.exists(self.compacting_file):
+                        # 上次合并中途退出，把新日志接在其后一起合并
+                        with open(self.wal_file, "rb") as src, open(self.compacting_file, "ab") as dst:
+                            dst.write(src.read())
+                            dst.flush()
+                            os.fsync(dst.fileno())
+                        os.remove(self.wal_file)
+                    else:
+                        os.replace(self.wal_file, self.compacting_file)
+            
+            rows = self._read_log(self.compacting_file)
+            if rows:
+                frames = [pd.read_csv(self.data_file)] if os.path.exists(self.data_file) else []
+                frames.append(pd.DataFrame(rows))
+                self._write_main([self._dedupe(pd.concat(frames, ignore_index=True))])
+            if os.path.exists(self.compacting_file):
+                os.remove(self.compacting_file)
+        
+        if rows:
+            logger.info(f"已把 {len(rows)} 条日志记录合并进 {self.data_file}")
+        return len(rows)
+    
+    def _dedupe(self, frame):
+        """相同键只保留最后一行"""
+        keys = [column for column in self.key_columns if column in frame.columns]
+        return frame.drop_duplicates(keys, keep="last") if keys else frame
+    
+    def _write_main(self, chunks):
+        """
+        逐块写出并原子替换主数据文件（调用方需持有合并锁）
+        
+        Args:
+            chunks (iterable): 键互不重复的DataFrame分块，列以第一块为准
+        """
+        os.makedirs(os.path.dirname(self.data_file) or ".", exist_ok=True)
+        tmp_file = f"{self.data_file}.tmp.{os.getpid()}"
+        columns = None
+        with open(tmp_file, "w", encoding="utf-8", newline="") as f:
+            for chunk in chunks:
+                chunk.reindex(columns=columns).to_csv(f, index=False, header=columns is None)
+                columns = columns or list(chunk.columns)
+            if columns is None:
+                pd.DataFrame(columns=self.key_columns).to_csv(f, index=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.data_file)
+    
+    def _track_chunks(self, chunks, current, changes, latest):
+        """写出分块的同时计算相对current的变更，累积到changes和latest中"""
+        for chunk in chunks:
+            chunk_changes, chunk_latest = self._diff(current, json.loads(chunk.to_json(orient="records", force_ascii=False)))
+            changes.extend(chunk_changes)
+            latest.update(chunk_latest)
+            yield chunk
+    
+    def replace(self, frame, on_changes=None):
+        """
+        用给定的全部记录替换主数据文件，并丢弃尚未合并的日志
+        
+        Args:
+            frame (pd.DataFrame | iterable): 全部记录，或键互不重复的DataFrame分块（逐块写出，不合并为一个DataFrame）
+            on_changes (callable, optional): 同append，不再存在的记录作为op为delete、new为None的变更
+        """
+        chunks = [self._dedupe(frame)] if isinstance(frame, pd.DataFrame) else frame
+        with self.compact_lock:
+            with self.append_lock:
+                if on_changes is not None:
+                    current = self._latest_rows()
+                    changes, latest = [], {}
+                    chunks = self._track_chunks(chunks, current, changes, latest)
+                self._write_main(chunks)
+                for path in (self.wal_file, self.compacting_file):
+                    if os.path.exists(path):
+                        os.remove(path)
+                if on_changes is not None:
+                    changes.extend(
+                        {"op": "delete", "key": list(key), "old": old, "new": None}
+                        for key, old in current.items() if key not in latest
+                    )
+                    self._latest = {"layout": self._layout()[0], "offset": 0, "rows": latest}
+                    if changes:
+                        on_changes(changes)
+
+_logs = {}
+_logs_lock = threading.Lock()
+
+def open_log(data_file, **options):
+    """
+    数据文件对应的StorageLog（同一路径在进程内共享一个实例）
+    
+    Args:
+        data_file (str): 主数据文件路径
+        **options: 首次创建时传给StorageLog的参数
+    
+    Returns:
+        StorageLog: 实例
+    """
+    path = os.path.abspath(data_file)
+    with _logs_lock:
+        if path not in _logs:
+            _logs[path] = StorageLog(data_file, **options)
+        return _logs[path]
+
+def data_version(data_file):
+    """
+    数据文件连同其日志的版本，用于判断缓存、汇总表和快照是否过期
+    
+    Args:
+        data_file (str): 主数据文件路径
+    
+    Returns:
+        list: 版本，没有数据时返回None
+    """
+    return open_log(data_file).version()
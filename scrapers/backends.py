@@ -0,0 +1,197 @@
+"""
+大模型后端路由
+可以注册多个兼容chat completions接口的服务和模型，按近期延迟、错误率和成本为每次查询选择后端，
+失败时自动切换到下一个后端
+"""
+import logging
+import os
+import random
+import sys
+import threading
+
+# 添加项目根目录到系统路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import config
+from scrapers.circuit_breaker import CircuitBreaker, shared_breaker
+
+logger = logging.getLogger('backends')
+
+class Backend:
+    """一个chat completions后端（服务地址 + 模型 + 密钥）"""
+    
+    def __init__(self, name, url=None, model="doubao-pro", api_key=None, cost_per_1k_tokens=1.0,
+                 max_concurrency=None, breaker=None):
+        """
+        初始化后端
+        
+        Args:
+            name (str): 后端名称（用于日志和指标）
+            url (str, optional): 接口地址，None表示使用config.DOUBAN_API_URL
+            model (str): 模型名称
+            api_key (str, optional): API密钥，None表示使用爬虫的密钥
+            cost_per_1k_tokens (float): 每千token的相对成本
+            max_concurrency (int, optional): 同时进行的请求数上限（对应服务的并发配额），None表示不限
+            breaker (CircuitBreaker, optional): 该后端的熔断器
+        """
+        self.name = name
+        self._url = url
+        self.model = model
+        self.api_key = api_key
+        self.cost_per_1k_tokens = cost_per_1k_tokens
+        self.max_concurrency = max_concurrency
+        self.breaker = breaker or CircuitBreaker(
+            failure_threshold=config.CIRCUIT_FAILURE_THRESHOLD,
+            recovery_timeout=config.CIRCUIT_RECOVERY_TIMEOUT,
+            half_open_max_calls=config.CIRCUIT_HALF_OPEN_MAX_CALLS
+        )
+        
+        self.latency = None  # 成功请求延迟的指数移动平均（秒）
+        self.error_rate = 0.0  # 失败率的指数移动平均
+        self.inflight = 0
+        self._lock = threading.Lock()
+    
+    @property
+    def url(self):
+        """接口地址"""
+        return self._url or config.DOUBAN_API_URL
+    
+    def key(self, default_key):
+        """该后端使用的API密钥"""
+        return self.api_key or default_key
+    
+    def headers(self, default_key):
+        """请求头"""
+        return {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {self.key(default_key)}"
+        }
+    
+    def at_capacity(self):
+        """是否已达到并发上限"""
+        return self.max_concurrency is not None and self.inflight >= self.max_concurrency
+    
+    def acquire(self):
+        """开始一个请求"""
+        with self._lock:
+            self.inflight += 1
+    
+    def release(self):
+        """结束一个请求"""
+        with self._lock:
+            self.inflight -= 1
+    
+    def record(self, latency, ok, alpha):
+        """
+        记录一次请求结果
+        
+        Args:
+            latency (float): 请求耗时（秒）
+            ok (bool): 是否成功
+            alpha (float): 指数移动平均的系数
+        """
+        with self._lock:
+            self.error_rate = (1 - alpha) * self.error_rate + alpha * (0.0 if ok else 1.0)
+            if ok:
+                self.latency = latency if self.latency is None else (1 - alpha) * self.latency + alpha * latency
+    
+    def score(self, error_penalty, cost_weight):
+        """
+        路由评分，越小越优先
+        
+        近期延迟加上按错误率折算的惩罚秒数和折算为秒的成本；还没有延迟数据的后端延迟按0计，以便尽快被尝试。
+        """
+        latency = self.latency or 0.0
+        return latency + error_penalty * self.error_rate + cost_weight * self.cost_per_1k_tokens
+
+class BackendRouter:
+    """按延迟、错误率和成本选择后端的路由器"""
+    
+    def __init__(self, backends, latency_alpha=0.2, error_penalty=5.0, cost_weight=0.5, explore_rate=0.05):
+        """
+        初始化路由器
+        
+        Args:
+            backends (list): Backend列表
+            latency_alpha (float): 延迟和错误率移动平均的系数
+            error_penalty (float): 错误率为100%时的惩罚秒数
+            cost_weight (float): 每千token成本折算为秒的系数
+            explore_rate (float): 随机把一个非最优后端排到最前的概率，使各后端的统计保持更新
+        """
+        if not backends:
+            raise ValueError("至少需要注册一个后端")
+        self.backends = list(backends)
+        self.latency_alpha = latency_alpha
+        self.error_penalty = error_penalty
+        self.cost_weight = cost_weight
+        self.explore_rate = explore_rate
+    
+    @classmethod
+    def from_config(cls, backend_configs=None):
+        """
+        按配置创建路由器，第一个后端使用所有爬虫共享的熔断器
+        
+        Args:
+            backend_configs (list, optional): 后端配置列表，默认使用config.LLM_BACKENDS
+        
+        Returns:
+            BackendRouter: 路由器
+        """
+        backend_configs = backend_configs or config.LLM_BACKENDS
+        backends = []
+        for i, options in enumerate(backend_configs):
+            options = dict(options)
+            if i == 0:
+                options.setdefault("breaker", shared_breaker)
+            backends.append(Backend(**options))
+        
+        return cls(
+            backends,
+            latency_alpha=config.ROUTER_LATENCY_ALPHA,
+            error_penalty=config.ROUTER_ERROR_PENALTY,
+            cost_weight=config.ROUTER_COST_WEIGHT,
+            explore_rate=config.ROUTER_EXPLORE_RATE
+        )
+    
+    def ranked(self, default_key):
+        """
+        按优先级排列有密钥的后端，已达到并发上限的排在最后
+        
+        Args:
+            default_key (str): 爬虫的API密钥
+        
+        Returns:
+            list: Backend列表
+        """
+        candidates = [backend for backend in self.backends if backend.key(default_key)]
+        candidates.sort(key=lambda backend: (backend.at_capacity(), backend.score(self.error_penalty, self.cost_weight)))
+        
+        if len(candidates) > 1 and random.random() < self.explore_rate:
+            explored = candidates.pop(random.randrange(1, len(candidates)))
+            candidates.insert(0, explored)
+        return candidates
+    
+    def record(self, backend, latency, ok):
+        """记录一次请求结果"""
+        backend.record(latency, ok, self.latency_alpha)
+    
+    def status(self):
+        """
+        各后端的当前状态
+        
+        Returns:
+            list: [{"name", "model", "latency", "error_rate", "inflight", "breaker"}]
+        """
+        return [
+            {
+                "name": backend.name,
+                "model": backend.model,
+                "latency": backend.latency,
+                "error_rate": round(backend.error_rate, 3),
+                "inflight": backend.inflight,
+                "breaker": backend.breaker.state,
+            }
+            for backend in self.backends
+        ]
+
+# 所有爬虫共享的后端路由器
+shared_router = BackendRouter.from_config()
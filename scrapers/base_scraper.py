@@ -10,23 +10,36 @@ import sys
 import os
 import re
 import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 # 添加项目根目录到系统路径
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 import config
+from models.school_index import school_index
+from scrapers.backends import shared_router
+from scrapers.deadline import Deadline
+from scrapers.hedging import shared_hedger
+from scrapers.response_cache import response_cache
+from scrapers.token_budget import shared_budget, TokenBudget
+from utils.metrics import (REQUEST_LATENCY, REQUESTS_TOTAL, RETRIES_TOTAL, ERRORS_TOTAL, TOKENS_TOTAL,
+                           CACHE_REQUESTS_TOTAL, CIRCUIT_REJECTIONS_TOTAL, BACKEND_REQUESTS_TOTAL,
+                           BUDGET_REJECTIONS_TOTAL)
+from utils.profiler import phase
 
-# 配置日志
-logging.basicConfig(
-    level=getattr(logging, config.LOG_LEVEL),
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    filename=config.LOG_FILE,
-    filemode='a'
-)
+# 日志由程序入口统一配置，这里只获取记录器
 logger = logging.getLogger('base_scraper')
+# 单请求日志使用独立的记录器，以便按比例采样
+request_logger = logging.getLogger('base_scraper.request')
 
 class BaseScraper:
     """豆包爬虫基础类"""
     
+    # 后台刷新缓存的线程池和正在刷新的查询，在所有爬虫之间共享
+    _revalidate_executor = None
+    _revalidating = set()
+    _revalidate_lock = threading.Lock()
+    
     def __init__(self, api_key=None):
         """
         初始化爬虫
@@ -35,68 +48,376 @@ class BaseScraper:
             api_key (str, optional): 豆包API密钥，如果不提供则使用配置文件中的密钥
         """
         self.api_key = api_key or config.DOUBAN_API_KEY
-        self.api_url = config.DOUBAN_API_URL
-        self.headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {self.api_key}"
-        }
+        # 后端路由（含各后端的熔断器）、响应缓存、对冲控制器和token预算在所有爬虫之间共享
+        self.router = shared_router
+        self.cache = response_cache
+        self.hedger = shared_hedger
+        self.budget = shared_budget
+    
+    @staticmethod
+    def get_school_category(school_name):
+        """
+        获取学校所属的分类（用于指标标签）
+        
+        Args:
+            school_name (str): 学校名称
+            
+        Returns:
+            str: 学校分类名称，未找到时返回"未分类"
+        """
+        school_name = school_index.canonical(school_name)
+        for category, schools in config.SCHOOL_CATEGORIES.items():
+            if school_name in schools:
+                return category
+        return "未分类"
     
-    def query(self, prompt, max_retries=3, retry_delay=2):
+    def query(self, prompt, max_retries=3, retry_delay=2, mode=None, category=None, use_cache=True, deadline=None):
         """
         向豆包API发送查询
         
+        优先返回未过期的缓存结果；API失败、熔断器打开或token预算已用完时，
+        返回该查询的历史缓存（不论是否过期），没有缓存时返回错误。
+        
+        Args:
+            prompt (str): 查询提示词
+            max_retries (int): 最大重试次数
+            retry_delay (int): 重试延迟（秒）
+            mode (str, optional): 查询模式（用于指标标签）
+            category (str, optional): 学校分类（用于指标标签）
+            use_cache (bool): 是否使用未过期的缓存结果
+            deadline (float | Deadline, optional): 截止时间（剩余秒数或Deadline对象）
+            
+        Returns:
+            dict: API响应结果
+        """
+        deadline = Deadline.from_value(deadline)
+        labels = {"mode": mode or "未知", "category": category or "未分类"}
+        cache_key = prompt
+        
+        if use_cache:
+            cached = self.cache.get(cache_key, max_age=config.RESPONSE_CACHE_TTL)
+            if cached is not None:
+                CACHE_REQUESTS_TOTAL.inc(result="hit", **labels)
+                return cached["response"]
+            CACHE_REQUESTS_TOTAL.inc(result="miss", **labels)
+        
+        # 按提示词和该模式的max_tokens预留预算，响应返回后按usage结算
+        reservation = self.budget.reserve(TokenBudget.estimate(prompt, self.generation_profile(mode)["max_tokens"]))
+        if reservation is None:
+            BUDGET_REJECTIONS_TOTAL.inc(**labels)
+            result = {"error": "本次运行的token预算已用完", "budget_exhausted": True}
+        else:
+            start_time = time.perf_counter()
+            result = self._query_with_retries(prompt, max_retries, retry_delay, labels, deadline)
+            # 失败的查询不计费
+            self.budget.settle(reservation, (result.get("usage") or {}).get("total_tokens") if "error" not in result else 0)
+            self._record_metrics(result, time.perf_counter() - start_time, labels)
+        
+        if "error" in result:
+            return self._fallback_response(cache_key, result, labels)
+        
+        self.cache.set(cache_key, result)
+        return result
+    
+    def query_stale_while_revalidate(self, prompt, on_refresh=None, mode=None, category=None):
+        """
+        立即返回缓存中的结果（不论是否过期），过期时在后台重新查询
+        
+        Args:
+            prompt (str): 查询提示词
+            on_refresh (callable, optional): 后台查询成功后的回调，参数为新的API响应
+            mode (str, optional): 查询模式（用于指标标签）
+            category (str, optional): 学校分类（用于指标标签）
+            
+        Returns:
+            tuple: (API响应, 缓存时长（秒）)，没有缓存时返回(None, None)
+        """
+        cached = self.cache.get(prompt)
+        if cached is None:
+            return None, None
+        
+        age = time.time() - cached["timestamp"]
+        CACHE_REQUESTS_TOTAL.inc(result="hit" if age <= config.SWR_FRESH_SECONDS else "stale",
+                                 mode=mode or "未知", category=category or "未分类")
+        if age > config.SWR_FRESH_SECONDS:
+            self._revalidate(prompt, on_refresh, mode, category)
+        
+        return cached["response"], age
+    
+    def _revalidate(self, prompt, on_refresh, mode, category):
+        """
+        在后台重新查询并更新缓存，同一查询同时只刷新一次
+        
+        Args:
+            prompt (str): 查询提示词
+            on_refresh (callable): 查询成功后的回调
+            mode (str): 查询模式
+            category (str): 学校分类
+        """
+        with BaseScraper._revalidate_lock:
+            if prompt in BaseScraper._revalidating:
+                return
+            BaseScraper._revalidating.add(prompt)
+            if BaseScraper._revalidate_executor is None:
+                BaseScraper._revalidate_executor = ThreadPoolExecutor(
+                    max_workers=config.SWR_REFRESH_WORKERS,
+                    thread_name_prefix="revalidate"
+                )
+        
+        def task():
+            try:
+                started = time.time()
+                result = self.query(prompt, mode=mode, category=category, use_cache=False)
+                # 失败时query返回的是旧缓存或错误，只有缓存确实被更新才回调
+                cached = self.cache.get(prompt)
+                if cached is not None and cached["timestamp"] >= started and on_refresh:
+                    on_refresh(result)
+            except Exception as e:
+                logger.error(f"后台刷新失败: {str(e)}")
+            finally:
+                with BaseScraper._revalidate_lock:
+                    BaseScraper._revalidating.discard(prompt)
+        
+        BaseScraper._revalidate_executor.submit(task)
+    
+    def _fallback_response(self, cache_key, error_result, labels):
+        """
+        查询失败时的降级处理：返回历史缓存，没有缓存时返回原错误
+        
+        Args:
+            cache_key (str): 缓存键
+            error_result (dict): 查询失败的结果
+            labels (dict): 指标标签
+            
+        Returns:
+            dict: 历史缓存的响应或错误结果
+        """
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            logger.warning(f"查询失败，使用历史缓存: {error_result.get('error')}")
+            CACHE_REQUESTS_TOTAL.inc(result="stale", **labels)
+            return cached["response"]
+        return error_result
+    
+    def _query_with_retries(self, prompt, max_retries, retry_delay, labels, deadline):
+        """
+        发送查询并在失败时重试
+        
+        连接超时和读取超时分别设置，并按截止时间的剩余时间裁剪；
+        剩余时间不足以再完成一次请求时不再重试。
+        
         Args:
             prompt (str): 查询提示词
             max_retries (int): 最大重试次数
             retry_delay (int): 重试延迟（秒）
+            labels (dict): 指标标签
+            deadline (Deadline): 截止时间
             
         Returns:
             dict: API响应结果
         """
-        if not self.api_key:
-            logger.error("API密钥未设置，请在config.py中设置DOUBAN_API_KEY或初始化时提供")
+        backends = self.router.ranked(self.api_key)
+        if not backends:
+            logger.error("API密钥未设置，请在config.py中设置DOUBAN_API_KEY（或LLM_BACKENDS中的api_key）或初始化时提供")
+            ERRORS_TOTAL.inc(code="no_api_key", **labels)
             return {"error": "API密钥未设置"}
         
-        payload = {
-            "model": "doubao-pro",
-            "messages": [{"role": "user", "content": prompt}],
-            "temperature": 0.7,
-            "max_tokens": 2000
-        }
+        if not deadline.has_time_for(config.MIN_ATTEMPT_SECONDS):
+            return {"error": "已到达截止时间，未发送查询", "deadline_exceeded": True}
         
+        error_result = None
         for attempt in range(max_retries):
-            try:
-                logger.info(f"发送查询: {prompt[:50]}...")
-                response = requests.post(
-                    self.api_url,
-                    headers=self.headers,
-                    data=json.dumps(payload),
-                    timeout=30
-                )
+            if attempt > 0:
+                # 剩余时间不够等待并完成一次请求时，放弃剩余的重试
+                if not deadline.has_time_for(retry_delay + config.MIN_ATTEMPT_SECONDS):
+                    logger.warning("截止时间临近，放弃剩余重试")
+                    error_result["deadline_exceeded"] = True
+                    return error_result
                 
-                if response.status_code == 200:
-                    result = response.json()
-                    logger.info("查询成功")
-                    return result
-                else:
-                    logger.warning(f"查询失败，状态码: {response.status_code}, 响应: {response.text}")
-                    
-                    if attempt < max_retries - 1:
-                        logger.info(f"等待 {retry_delay} 秒后重试...")
-                        time.sleep(retry_delay)
-                    else:
-                        logger.error(f"达到最大重试次数 {max_retries}")
-                        return {"error": f"API请求失败: {response.status_code}", "details": response.text}
+                logger.info(f"等待 {retry_delay} 秒后重试...")
+                time.sleep(retry_delay)
+                RETRIES_TOTAL.inc(**labels)
+                backends = self.router.ranked(self.api_key)
             
-            except Exception as e:
-                logger.error(f"查询异常: {str(e)}")
+            # 按路由顺序尝试各后端，失败时切换到下一个
+            tried = 0
+            for backend in backends:
+                # 熔断器打开的后端直接跳过，不再等待超时
+                if not backend.breaker.allow_request():
+                    continue
+                
+                if tried > 0:
+                    if not deadline.has_time_for(config.MIN_ATTEMPT_SECONDS):
+                        error_result["deadline_exceeded"] = True
+                        return error_result
+                    logger.warning(f"切换到后端 {backend.name}")
+                tried += 1
                 
-                if attempt < max_retries - 1:
-                    logger.info(f"等待 {retry_delay} 秒后重试...")
-                    time.sleep(retry_delay)
-                else:
-                    logger.error(f"达到最大重试次数 {max_retries}")
-                    return {"error": f"查询异常: {str(e)}"}
+                result = self._send_to_backend(backend, prompt, labels, deadline)
+                if "error" not in result or result.get("deadline_exceeded"):
+                    return result
+                error_result = result
+            
+            # 所有后端的熔断器都已打开时直接失败
+            if tried == 0:
+                CIRCUIT_REJECTIONS_TOTAL.inc(**labels)
+                error_result = error_result or {"error": "API连续失败，熔断器已打开"}
+                error_result["circuit_open"] = True
+                return error_result
+            if all(backend.breaker.state == backend.breaker.OPEN for backend in backends):
+                error_result["circuit_open"] = True
+                return error_result
+        
+        logger.error(f"达到最大重试次数 {max_retries}")
+        return error_result
+    
+    @staticmethod
+    def generation_profile(mode):
+        """
+        查询模式对应的生成参数
+        
+        Args:
+            mode (str): 查询模式
+            
+        Returns:
+            dict: {"max_tokens", "temperature", 可选"stop"}
+        """
+        return config.GENERATION_PROFILES.get(mode, config.DEFAULT_GENERATION_PROFILE)
+    
+    @staticmethod
+    def build_payload(prompt, model, mode=None):
+        """
+        构建chat completions请求体（单次查询和批量任务共用）
+        
+        Args:
+            prompt (str): 查询提示词
+            model (str): 模型名称
+            mode (str, optional): 查询模式，决定max_tokens、temperature和停止序列
+            
+        Returns:
+            dict: 请求体
+        """
+        profile = BaseScraper.generation_profile(mode)
+        payload = {
+            "model": model,
+            "messages": [{"role": "user", "content": prompt}],
+            "temperature": profile["temperature"],
+            "max_tokens": profile["max_tokens"]
+        }
+        if profile.get("stop"):
+            payload["stop"] = profile["stop"]
+        return payload
+    
+    def _send_to_backend(self, backend, prompt, labels, deadline):
+        """
+        向一个后端发送一次查询，并更新该后端的熔断器和路由统计
+        
+        Args:
+            backend (Backend): 后端
+            prompt (str): 查询提示词
+            labels (dict): 指标标签
+            deadline (Deadline): 截止时间
+            
+        Returns:
+            dict: 成功时为API响应；失败时为带error的结果，截止时间造成的超时带deadline_exceeded
+        """
+        payload = self.build_payload(prompt, backend.model, labels["mode"])
+        headers = backend.headers(self.api_key)
+        
+        _, _, clipped = deadline.clip_timeout(config.CONNECT_TIMEOUT, config.READ_TIMEOUT)
+        
+        def send():
+            # 对冲请求发出得更晚，超时按发送时的剩余时间重新裁剪
+            connect_timeout, read_timeout, _ = deadline.clip_timeout(config.CONNECT_TIMEOUT, config.READ_TIMEOUT)
+            return requests.post(
+                backend.url,
+                headers=headers,
+                data=json.dumps(payload),
+                timeout=(connect_timeout, read_timeout)
+            )
+        
+        def reserve_hedge():
+            # 对冲请求同样消耗token，发送前按与主请求相同的估算单独预留
+            reservation = self.budget.reserve(TokenBudget.estimate(prompt, payload["max_tokens"]))
+            if reservation is None:
+                BUDGET_REJECTIONS_TOTAL.inc(**labels)
+            return reservation
+        
+        def settle_hedge(reservation, response):
+            # 失败或未发出的请求不计费，成功的请求按usage结算
+            used = 0
+            if response is not None and response.status_code == 200:
+                try:
+                    used = (response.json().get("usage") or {}).get("total_tokens")
+                except ValueError:
+                    used = None
+            self.budget.settle(reservation, used)
+        
+        backend.acquire()
+        start_time = time.perf_counter()
+        try:
+            request_logger.info("发送查询(%s): %s...", backend.name, prompt[:50])
+            with phase("network"):
+                response = self.hedger.call(send, labels, reserve=reserve_hedge, settle=settle_hedge)
+            
+            if response.status_code == 200:
+                result = response.json()
+                request_logger.info("查询成功")
+                backend.breaker.record_success()
+                self.router.record(backend, time.perf_counter() - start_time, ok=True)
+                BACKEND_REQUESTS_TOTAL.inc(backend=backend.name, outcome="success")
+                return result
+            
+            logger.warning(f"查询失败({backend.name})，状态码: {response.status_code}, 响应: {response.text}")
+            ERRORS_TOTAL.inc(code=str(response.status_code), **labels)
+            error_result = {"error": f"API请求失败: {response.status_code}", "details": response.text}
+        
+        except requests.Timeout as e:
+            ERRORS_TOTAL.inc(code=type(e).__name__, **labels)
+            if clipped:
+                # 超时是截止时间裁剪造成的，不计入熔断器
+                logger.warning("截止时间已到，查询超时")
+                return {"error": f"查询超时: {str(e)}", "deadline_exceeded": True}
+            logger.error(f"查询超时({backend.name}): {str(e)}")
+            error_result = {"error": f"查询超时: {str(e)}"}
+        
+        except Exception as e:
+            logger.error(f"查询异常({backend.name}): {str(e)}")
+            ERRORS_TOTAL.inc(code=type(e).__name__, **labels)
+            error_result = {"error": f"查询异常: {str(e)}"}
+        
+        finally:
+            backend.release()
+        
+        backend.breaker.record_failure()
+        self.router.record(backend, time.perf_counter() - start_time, ok=False)
+        BACKEND_REQUESTS_TOTAL.inc(backend=backend.name, outcome="error")
+        return error_result
+    
+    def _record_metrics(self, result, elapsed, labels):
+        """
+        记录单次查询的耗时、结果和token用量
+        
+        Args:
+            result (dict): API响应结果
+            elapsed (float): 查询耗时（秒）
+            labels (dict): 指标标签
+        """
+        if result.get("circuit_open"):
+            outcome = "circuit_open"
+        elif result.get("deadline_exceeded"):
+            outcome = "deadline_exceeded"
+        elif "error" in result:
+            outcome = "error"
+        else:
+            outcome = "success"
+        REQUEST_LATENCY.observe(elapsed, **labels)
+        REQUESTS_TOTAL.inc(outcome=outcome, **labels)
+        
+        usage = result.get("usage") or {}
+        for token_type in ("prompt_tokens", "completion_tokens", "total_tokens"):
+            if usage.get(token_type):
+                TOKENS_TOTAL.inc(usage[token_type], type=token_type, **labels)
     
     def extract_text_from_response(self, response):
         """
@@ -132,16 +453,16 @@ class BaseScraper:
         Returns:
             dict: 模拟的API响应结果
         """
-        logger.info(f"模拟查询: {prompt[:50]}...")
+        request_logger.debug("模拟查询: %s...", prompt[:50])
         
         # 根据学校名称生成模拟数据
         school_name_match = re.search(r'(\d+)年(.*?)(录取分数|升学率)', prompt)
         if school_name_match:
             year = school_name_match.group(1)
-            school = school_name_match.group(2).strip()
+            school = school_index.canonical(school_name_match.group(2))
             
             # 为特定学校提供固定数据
-            if "华东师大二附中紫竹校区" in school:
+            if school == "华东师大二附中紫竹校区":
                 if "录取分数" in prompt:
                     return {
                         "choices": [{
@@ -150,7 +471,7 @@ class BaseScraper:
                             }
                         }]
                     }
-            elif "上海中学" in school:
+            elif school == "上海中学":
                 if "录取分数" in prompt:
                     return {
                         "choices": [{
@@ -172,12 +493,19 @@ class BaseScraper:
                         }
                     }]
                 }
-        elif "升学率" in prompt:
+        elif "升学率" in prompt or "入线率" in prompt:
+            # 为每所学校每个年份生成不同的随机数据
+            rate_match = re.search(r'(\d+)年(?:上海)?(.*?)(?:C9|升学率)', prompt)
+            year = rate_match.group(1) if rate_match else ""
+            school = school_index.canonical(rate_match.group(2)) if rate_match else ""
+            c9_rate = random.randint(5, 50)
+            rate_985 = min(c9_rate + random.randint(10, 30), 100)
+            rate_211 = min(rate_985 + random.randint(5, 25), 100)
             return {
                 "choices": [
                     {
                         "message": {
-                            "content": "2023年上海中学升学率情况：\nC9入线率：45%\n985入线率：68%\n211入线率：92%"
+                            "content": f"{year}年{school}升学率情况：\nC9入线率：{c9_rate}%\n985入线率：{rate_985}%\n211入线率：{rate_211}%"
                         }
                     }
                 ]
@@ -0,0 +1,544 @@
+"""
+批量任务
+把整批查询写入作业文件（JSONL），提交到批量推理接口（兼容 /files + /batches 协议）或本地替代执行器，
+轮询完成后把结果逐条交给原有的解析器并分块写入数据存储；
+任务状态持久化在任务目录中，中断后重新运行可从已完成的部分继续，失败的条目会重新提交
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+
+# 添加项目根目录到系统路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import config
+from scrapers.deadline import Deadline
+from scrapers.token_budget import TokenBudget
+from utils.metrics import BATCH_ITEMS_TOTAL
+
+logger = logging.getLogger('batch_jobs')
+
+STATE_FILE = "state.json"
+# 批次的终止状态，到达后读取输出文件
+TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+# 重新提交也无法成功的错误，本次运行不再重新提交（下次运行时仍会重试）
+NON_RETRYABLE_ERRORS = ("API密钥未设置",)
+
+def _custom_id(mode, school_name, year):
+    return f"{mode}|{school_name}|{int(year)}"
+
+class BatchClient:
+    """批量推理接口客户端（上传作业文件、创建批次、查询状态、下载结果）"""
+    
+    def __init__(self, base_url, api_key, endpoint=None, completion_window=None):
+        """
+        初始化客户端
+        
+        Args:
+            base_url (str): 接口根地址（其下有 /files 和 /batches）
+            api_key (str): API密钥
+            endpoint (str, optional): 作业中每条请求调用的接口，默认使用config.BATCH_ENDPOINT
+            completion_window (str, optional): 完成时限，默认使用config.BATCH_COMPLETION_WINDOW
+        """
+        self.base_url = base_url.rstrip("/")
+        self.endpoint = endpoint or config.BATCH_ENDPOINT
+        self.completion_window = completion_window or config.BATCH_COMPLETION_WINDOW
+        self.headers = {"Authorization": f"Bearer {api_key}"}
+    
+    def _timeout(self):
+        return (config.CONNECT_TIMEOUT, config.READ_TIMEOUT)
+    
+    def submit(self, input_file):
+        """
+        上传作业文件并创建批次
+        
+        Returns:
+            str: 批次ID
+        """
+        with open(input_file, "rb") as f:
+            response = requests.post(
+                f"{self.base_url}/files", headers=self.headers,
+                files={"file": (os.path.basename(input_file), f)}, data={"purpose": "batch"},
+                timeout=self._timeout()
+            )
+        response.raise_for_status()
+        
+        response = requests.post(
+            f"{self.base_url}/batches", headers=self.headers,
+            json={"input_file_id": response.json()["id"], "endpoint": self.endpoint,
+                  "completion_window": self.completion_window},
+            timeout=self._timeout()
+        )
+        response.raise_for_status()
+        return response.json()["id"]
+    
+    def status(self, batch_id):
+        """
+        查询批次状态
+        
+        Returns:
+            dict: 至少包含status，结束时包含output_file_id和error_file_id
+        """
+        response = requests.get(f"{self.base_url}/batches/{batch_id}", headers=self.headers, timeout=self._timeout())
+        response.raise_for_status()
+        return response.json()
+    
+    def wait(self, batch_id, timeout):
+        """等待下一次查询批次状态（远程批次只能按轮询间隔等待）"""
+        time.sleep(timeout)
+    
+    def iter_output(self, file_id):
+        """
+        逐行读取结果文件（流式下载，不整体载入内存）
+        
+        Yields:
+            dict: 每条请求的结果 {"custom_id", "response": {"status_code", "body"}, "error"}
+        """
+        with requests.get(f"{self.base_url}/files/{file_id}/content", headers=self.headers,
+                          timeout=self._timeout(), stream=True) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if line:
+                    yield json.loads(line)
+
+class LocalBatchClient:
+    """
+    本地替代执行器
+    
+    没有配置批量推理接口时使用：在后台线程中用爬虫的普通查询执行作业文件，
+    结果逐条追加到作业文件旁的输出文件，格式与批量接口一致。
+    进程中断后批次状态丢失，已写出的部分结果按expired批次读取，其余条目重新提交。
+    """
+    
+    def __init__(self, scraper, workers=None):
+        """
+        初始化本地执行器
+        
+        Args:
+            scraper (BaseScraper): 执行查询的爬虫
+            workers (int, optional): 并发查询数，默认使用config.BATCH_LOCAL_WORKERS
+        """
+        self.scraper = scraper
+        self.workers = workers or config.BATCH_LOCAL_WORKERS
+        self._batches = {}
+        self._threads = {}
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def _output_file(batch_id):
+        return f"{batch_id}.output.jsonl"
+    
+    def submit(self, input_file):
+        """在后台开始执行作业文件，返回批次ID（即输入文件路径去掉扩展名）"""
+        batch_id = os.path.splitext(input_file)[0]
+        with self._lock:
+            self._batches[batch_id] = {"id": batch_id, "status": "in_progress"}
+            thread = self._threads[batch_id] = threading.Thread(target=self._run, args=(batch_id, input_file), daemon=True)
+        thread.start()
+        return batch_id
+    
+    def _run_item(self, request):
+        mode, school_name, _ = request["custom_id"].split("|")
+        response = self.scraper.query(
+            request["body"]["messages"][0]["content"], mode=mode,
+            category=self.scraper.get_school_category(school_name)
+        )
+        if "error" in response:
+            return {"custom_id": request["custom_id"], "response": None, "error": {"message": response["error"]}}
+        return {"custom_id": request["custom_id"], "response": {"status_code": 200, "body": response}, "error": None}
+    
+    def _run(self, batch_id, input_file):
+        output_file = self._output_file(batch_id)
+        status = "completed"
+        try:
+            with open(input_file, "r", encoding="utf-8") as f:
+                batch = [json.loads(line) for line in f if line.strip()]
+            with open(output_file, "a", encoding="utf-8") as out, ThreadPoolExecutor(max_workers=self.workers) as executor:
+                for result in executor.map(self._run_item, batch):
+                    out.write(json.dumps(result, ensure_ascii=False) + "\n")
+                    out.flush()
+        except Exception as e:
+            logger.error(f"本地批次 {batch_id} 执行异常: {str(e)}")
+            status = "failed"
+        with self._lock:
+            self._batches[batch_id] = {"id": batch_id, "status": status, "output_file_id": output_file}
+    
+    def status(self, batch_id):
+        """查询批次状态，本进程没有该批次时按expired处理，读取已写出的部分结果"""
+        with self._lock:
+            if batch_id in self._batches:
+                return dict(self._batches[batch_id])
+        output_file = self._output_file(batch_id)
+        return {"id": batch_id, "status": "expired",
+                "output_file_id": output_file if os.path.exists(output_file) else None}
+    
+    def wait(self, batch_id, timeout):
+        """等待批次执行结束或超时（本地批次结束后立即返回，不必等满轮询间隔）"""
+        with self._lock:
+            thread = self._threads.get(batch_id)
+        if thread is not None:
+            thread.join(timeout)
+    
+    def iter_output(self, file_id):
+        """逐行读取输出文件"""
+        with open(file_id, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+def default_client(scraper):
+    """
+    按配置选择批量接口客户端
+    
+    Args:
+        scraper (BaseScraper): 爬虫（提供密钥；使用本地执行器时用于查询）
+    
+    Returns:
+        BatchClient | LocalBatchClient: 客户端
+    """
+    if config.BATCH_API_BASE:
+        return BatchClient(config.BATCH_API_BASE, scraper.api_key)
+    return LocalBatchClient(scraper)
+
+class BatchJob:
+    """
+    持久化的批量任务
+    
+    任务目录中保存状态文件和每次提交的作业文件。状态文件记录每个条目的状态
+    （pending/submitted/done/failed）和每次提交的批次，中断后重新打开即可继续轮询或重新提交。
+    """
+    
+    def __init__(self, job_dir, state):
+        """
+        初始化任务（请使用create或open）
+        
+        Args:
+            job_dir (str): 任务目录
+            state (dict): 任务状态
+        """
+        self.job_dir = job_dir
+        self.state = state
+        self._reservations = {}  # 本次运行提交的条目在token预算中的预留
+    
+    @staticmethod
+    def default_dir(mode, school_names, years):
+        """同一组查询对应固定的任务目录，重新运行同一收集命令即可恢复"""
+        digest = hashlib.sha1(
+            json.dumps([mode, sorted(school_names), sorted(int(year) for year in years)], ensure_ascii=False).encode("utf-8")
+        ).hexdigest()[:12]
+        return os.path.join(config.BATCH_JOB_DIR, f"{mode}-{digest}")
+    
+    @classmethod
+    def create(cls, job_dir, mode, items):
+        """
+        创建新任务（覆盖同一目录中的旧任务）
+        
+        Args:
+            job_dir (str): 任务目录
+            mode (str): 查询模式（录取分数/升学率）
+            items (list): [(学校, 年份, 提示词)]
+        
+        Returns:
+            BatchJob: 任务
+        """
+        shutil.rmtree(job_dir, ignore_errors=True)
+        os.makedirs(job_dir)
+        state = {
+            "mode": mode,
+            "created": time.time(),
+            "submissions": [],
+            "items": {
+                _custom_id(mode, school_name, year): {
+                    "school_name": school_name, "year": int(year), "prompt": prompt,
+                    "status": "pending", "attempts": 0, "error": None,
+                }
+                for school_name, year, prompt in items
+            },
+        }
+        job = cls(job_dir, state)
+        job.save()
+        return job
+    
+    @classmethod
+    def open(cls, job_dir):
+        """
+        打开已有任务
+        
+        Returns:
+            BatchJob: 任务，不存在或状态文件损坏时返回None
+        """
+        try:
+            with open(os.path.join(job_dir, STATE_FILE), "r", encoding="utf-8") as f:
+                return cls(job_dir, json.load(f))
+        except (OSError, ValueError):
+            return None
+    
+    def save(self):
+        """原子写入状态文件"""
+        state_file = os.path.join(self.job_dir, STATE_FILE)
+        with open(f"{state_file}.tmp", "w", encoding="utf-8") as f:
+            json.dump(self.state, f, ensure_ascii=False)
+        os.replace(f"{state_file}.tmp", state_file)
+    
+    @property
+    def items(self):
+        return self.state["items"]
+    
+    def finished(self):
+        """所有条目都已完成"""
+        return all(item["status"] == "done" for item in self.items.values())
+    
+    def unfinished(self):
+        """未完成的(学校, 年份)"""
+        return [(item["school_name"], item["year"]) for item in self.items.values() if item["status"] != "done"]
+    
+    def _active_submission(self):
+        submissions = self.state["submissions"]
+        if submissions and not submissions[-1]["consumed"]:
+            return submissions[-1]
+        return None
+    
+    def _settle(self, budget, custom_id, used=None):
+        """结算一个条目的预留（之前的运行提交的条目没有预留，不再计费）"""
+        reservation = self._reservations.pop(custom_id, None)
+        if budget is not None and reservation is not None:
+            budget.settle(reservation, used)
+    
+    def _submit(self, client, model, max_submissions, skip=(), budget=None):
+        """
+        把待提交和失败的条目写入新的作业文件并提交
+        
+        Args:
+            client (BatchClient | LocalBatchClient): 批量接口客户端
+            model (str): 作业中使用的模型
+            max_submissions (int): 每个条目最多提交的次数
+            skip (set): 不再提交的条目
+            budget (TokenBudget, optional): token预算，每个条目写入作业文件前按估算预留，超出预算的条目不提交
+        
+        Returns:
+            bool: 是否提交了新批次（没有可提交的条目时返回False）
+        """
+        todo = [
+            custom_id for custom_id, item in self.items.items()
+            if item["status"] in ("pending", "failed", "submitted") and item["attempts"] < max_submissions
+            and custom_id not in skip
+        ]
+        if not todo:
+            return False
+        
+        from scrapers.base_scraper import BaseScraper
+        mode = self.state["mode"]
+        payloads = {}
+        for custom_id in todo:
+            payload = BaseScraper.build_payload(self.items[custom_id]["prompt"], model, mode)
+            if budget is not None:
+                reservation = budget.reserve(TokenBudget.estimate(self.items[custom_id]["prompt"], payload["max_tokens"]))
+                if reservation is None:
+                    BATCH_ITEMS_TOTAL.inc(mode=mode, outcome="budget_exhausted")
+                    continue
+                self._reservations[custom_id] = reservation
+            payloads[custom_id] = payload
+        todo = list(payloads)
+        if not todo:
+            logger.warning("token预算已用完，剩余条目不再提交")
+            return False
+        
+        input_file = os.path.join(self.job_dir, f"batch-{len(self.state['submissions']) + 1}.jsonl")
+        try:
+            with open(input_file, "w", encoding="utf-8") as f:
+                for custom_id in todo:
+                    f.write(json.dumps({
+                        "custom_id": custom_id, "method": "POST", "url": config.BATCH_ENDPOINT,
+                        "body": payloads[custom_id],
+                    }, ensure_ascii=False) + "\n")
+            batch_id = client.submit(input_file)
+        except Exception:
+            # 没有提交成功的条目不计费
+            for custom_id in todo:
+                self._settle(budget, custom_id, 0)
+            raise
+        for custom_id in todo:
+            self.items[custom_id]["status"] = "submitted"
+            self.items[custom_id]["attempts"] += 1
+        self.state["submissions"].append({
+            "batch_id": batch_id, "input_file": input_file, "count": len(todo),
+            "submitted": time.time(), "status": "in_progress", "consumed": False,
+        })
+        self.save()
+        logger.info(f"已提交批次 {batch_id}: {len(todo)} 条查询")
+        return True
+    
+    def _consume(self, client, info, handle_results, budget=None):
+        """
+        读取已结束批次的结果文件，成功的条目分块交给handle_results，随后保存状态
+        
+        结果处理完成后才把条目标记为done并保存；中途中断时重新读取同一批次，
+        已完成的条目会被跳过。每个条目的预留按结果中的usage结算，失败的条目不计费。
+        """
+        mode = self.state["mode"]
+        chunk = []
+        
+        def flush():
+            if chunk:
+                handle_results([(self.items[custom_id], body) for custom_id, body in chunk])
+                for custom_id, _ in chunk:
+                    self.items[custom_id].update(status="done", error=None)
+                chunk.clear()
+            self.save()
+        
+        for file_id in (info.get("output_file_id"), info.get("error_file_id")):
+            if not file_id:
+                continue
+            for line in client.iter_output(file_id):
+                item = self.items.get(line.get("custom_id"))
+                if item is None or item["status"] == "done":
+                    continue
+                response = line.get("response") or {}
+                body = response.get("body") or {}
+                if response.get("status_code") == 200 and "error" not in body:
+                    self._settle(budget, line["custom_id"], (body.get("usage") or {}).get("total_tokens"))
+                    chunk.append((line["custom_id"], body))
+                    BATCH_ITEMS_TOTAL.inc(mode=mode, outcome="success")
+                    if len(chunk) >= config.BATCH_UPSERT_ROWS:
+                        flush()
+                else:
+                    error = line.get("error") or body.get("error") or {"status_code": response.get("status_code")}
+                    item.update(status="failed", error=str(error.get("message", error) if isinstance(error, dict) else error))
+                    self._settle(budget, line["custom_id"], 0)
+                    BATCH_ITEMS_TOTAL.inc(mode=mode, outcome="error")
+        flush()
+        
+        # 批次结束但没有返回结果的条目视为失败，等待重新提交
+        for custom_id, item in self.items.items():
+            if item["status"] == "submitted":
+                item.update(status="failed", error=f"批次{info.get('status')}，未返回结果")
+                self._settle(budget, custom_id, 0)
+                BATCH_ITEMS_TOTAL.inc(mode=mode, outcome="missing")
+        active = self._active_submission()
+        active.update(status=info.get("status"), consumed=True)
+        self.save()
+    
+    def run(self, client, handle_results, model, deadline=None, poll_interval=None, max_submissions=None, budget=None):
+        """
+        提交、轮询并处理结果，直到所有条目完成、失败条目达到提交次数上限或到达截止时间
+        
+        Args:
+            client (BatchClient | LocalBatchClient): 批量接口客户端
+            handle_results (callable): 处理一块成功结果，参数为[(条目, API响应)]
+            model (str): 作业中使用的模型
+            deadline (float | Deadline, optional): 截止时间，到时未结束的批次保留在状态中，下次运行继续轮询
+            poll_interval (float, optional): 轮询间隔（秒），默认使用config.BATCH_POLL_INTERVAL
+            max_submissions (int, optional): 每个条目最多提交的次数，默认使用config.BATCH_MAX_SUBMISSIONS
+            budget (TokenBudget, optional): token预算，提交前为每个条目预留，读取结果时按usage结算；
+                到时未结束的批次按预留数计入本次运行
+        
+        Returns:
+            bool: 所有条目是否都已完成
+        """
+        deadline = Deadline.from_value(deadline)
+        poll_interval = poll_interval or config.BATCH_POLL_INTERVAL
+        max_submissions = max_submissions or config.BATCH_MAX_SUBMISSIONS
+        failures = 0
+        skip = set()
+        
+        while True:
+            active = self._active_submission()
+            try:
+                if active is None:
+                    if not self._submit(client, model, max_submissions, skip, budget):
+                        break
+                    failures = 0
+                    continue
+                
+                info = client.status(active["batch_id"])
+                if info.get("status") in TERMINAL_STATUSES:
+                    logger.info(f"批次 {active['batch_id']} 已结束: {info.get('status')}")
+                    self._consume(client, info, handle_results, budget)
+                    skip.update(
+                        custom_id for custom_id, item in self.items.items()
+                        if item["status"] == "failed" and item["error"] in NON_RETRYABLE_ERRORS
+                    )
+                    failures = 0
+                    continue
+            except requests.RequestException as e:
+                # 接口暂时不可用时稍后重试，连续失败过多则停止，状态保留在任务目录中
+                failures += 1
+                logger.error(f"批量接口请求失败（第 {failures} 次）: {str(e)}")
+                if failures >= config.BATCH_MAX_API_ERRORS:
+                    break
+            
+            if deadline.expired():
+                logger.warning("到达截止时间，批量任务尚未结束，重新运行即可继续")
+                break
+            remaining = deadline.remaining()
+            timeout = poll_interval if remaining is None else min(poll_interval, remaining)
+            active = self._active_submission()
+            if active is None:
+                time.sleep(timeout)
+            else:
+                client.wait(active["batch_id"], timeout)
+        
+        # 仍在执行的批次同样会消耗token，用量未知时按预留数计费
+        for custom_id in list(self._reservations):
+            self._settle(budget, custom_id)
+        return self.finished()
+
+def run_bulk_collection(scraper, mode, school_names, years, parse, store, deadline=None, job_dir=None, client=None):
+    """
+    以批量任务方式收集数据
+    
+    同一组(学校, 年份)的未完成任务会被恢复，已完成的任务会重新开始。
+    
+    Args:
+        scraper (BaseScraper): 爬虫（提供提示词、密钥和模型）
+        mode (str): 查询模式（录取分数/升学率）
+        school_names (list): 学校名称列表
+        years (list): 年份列表
+        parse (callable): 解析函数，参数为(文本, 学校, 年份)
+        store (callable): 写入数据存储的函数，参数为解析结果列表，每处理一块结果调用一次
+        deadline (float | Deadline, optional): 整体截止时间
+        job_dir (str, optional): 任务目录，默认按查询内容确定
+        client (optional): 批量接口客户端，默认按配置选择
+    
+    Returns:
+        tuple: (本次运行解析出的结果列表, 未完成的(学校, 年份)列表)
+    """
+    if not scraper.router.ranked(scraper.api_key):
+        # 没有可用的密钥时所有条目都会失败，不创建也不提交任务
+        logger.error("API密钥未设置，无法提交批量任务，请在config.py中设置DOUBAN_API_KEY（或LLM_BACKENDS中的api_key）")
+        return [], [(school, year) for school in school_names for year in years]
+    
+    job_dir = job_dir or BatchJob.default_dir(mode, school_names, years)
+    job = BatchJob.open(job_dir)
+    if job is not None and not job.finished():
+        logger.info(f"恢复批量任务 {job_dir}: 已完成 {len(job.items) - len(job.unfinished())}/{len(job.items)} 条")
+    else:
+        items = [(school, year, scraper.build_prompt(school, year)) for school in school_names for year in years]
+        job = BatchJob.create(job_dir, mode, items)
+    
+    results = []
+    
+    def handle_results(chunk):
+        parsed = []
+        for item, body in chunk:
+            # 批量结果同样写入响应缓存，之后的交互查询可以直接使用
+            scraper.cache.set(item["prompt"], body)
+            parsed.append(parse(scraper.extract_text_from_response(body), item["school_name"], item["year"]))
+        store(parsed)
+        results.extend(parsed)
+    
+    client = client or default_client(scraper)
+    # 本地执行器通过爬虫的普通查询执行，已逐条预留和结算token预算
+    budget = None if isinstance(client, LocalBatchClient) else scraper.budget
+    job.run(client, handle_results, scraper.router.backends[0].model, deadline=deadline, budget=budget)
+    
+    skipped = job.unfinished()
+    if skipped:
+        logger.warning(f"批量任务 {job_dir} 还有 {len(skipped)} 条未完成，重新运行同一收集命令即可继续")
+    return results, skipped
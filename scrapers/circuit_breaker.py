@@ -0,0 +1,117 @@
+"""
+熔断器
+API连续失败后快速失败，避免每次查询都耗尽超时和重试
+"""
+import logging
+import os
+import sys
+import threading
+import time
+
+# 添加项目根目录到系统路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import config
+
+logger = logging.getLogger('circuit_breaker')
+
+class CircuitBreaker:
+    """
+    熔断器
+    
+    关闭（closed）状态下正常放行请求；连续失败达到阈值后打开（open），
+    打开期间直接拒绝请求；经过恢复时间后进入半开（half_open）状态，
+    放行少量探测请求，探测成功则关闭，失败则重新打开。
+    """
+    
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+    
+    def __init__(self, failure_threshold=5, recovery_timeout=60, half_open_max_calls=1):
+        """
+        初始化熔断器
+        
+        Args:
+            failure_threshold (int): 打开熔断器所需的连续失败次数
+            recovery_timeout (float): 打开后进入半开状态前的等待时间（秒）
+            half_open_max_calls (int): 半开状态下允许同时进行的探测请求数
+        """
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+        
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._half_open_calls = 0
+        self._half_open_at = 0.0
+        self._lock = threading.Lock()
+    
+    @property
+    def state(self):
+        """当前状态"""
+        with self._lock:
+            return self._state
+    
+    def allow_request(self):
+        """
+        判断是否放行本次请求
+        
+        Returns:
+            bool: 是否放行
+        """
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            
+            if self._state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.recovery_timeout:
+                    return False
+                logger.info("熔断器进入半开状态，发送探测请求")
+                self._state = self.HALF_OPEN
+                self._half_open_calls = 0
+                self._half_open_at = time.monotonic()
+            
+            # 探测请求长时间没有结果（如被截止时间中断）时，允许发起新的探测
+            if time.monotonic() - self._half_open_at >= self.recovery_timeout:
+                self._half_open_calls = 0
+                self._half_open_at = time.monotonic()
+            
+            if self._half_open_calls < self.half_open_max_calls:
+                self._half_open_calls += 1
+                return True
+            return False
+    
+    def record_success(self):
+        """记录一次成功请求"""
+        with self._lock:
+            if self._state != self.CLOSED:
+                logger.info("探测请求成功，熔断器关闭")
+            self._state = self.CLOSED
+            self._failures = 0
+            self._half_open_calls = 0
+    
+    def record_failure(self):
+        """记录一次失败请求"""
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    logger.warning(f"连续失败 {self._failures} 次，熔断器打开 {self.recovery_timeout} 秒")
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._half_open_calls = 0
+    
+    def reset(self):
+        """重置为关闭状态"""
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._half_open_calls = 0
+
+# 所有爬虫共享的熔断器
+shared_breaker = CircuitBreaker(
+    failure_threshold=config.CIRCUIT_FAILURE_THRESHOLD,
+    recovery_timeout=config.CIRCUIT_RECOVERY_TIMEOUT,
+    half_open_max_calls=config.CIRCUIT_HALF_OPEN_MAX_CALLS
+)
\ No newline at end of file
@@ -0,0 +1,77 @@
+"""
+截止时间
+为批量查询设置整体截止时间，并传递到每一次请求
+"""
+import time
+
+class Deadline:
+    """整体截止时间"""
+    
+    def __init__(self, seconds=None):
+        """
+        初始化截止时间
+        
+        Args:
+            seconds (float, optional): 从现在起的可用时间（秒），None表示不限时
+        """
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds if seconds is not None else None
+    
+    @classmethod
+    def from_value(cls, value):
+        """
+        从秒数或Deadline对象创建截止时间
+        
+        Args:
+            value (float | Deadline | None): 秒数、已有的截止时间或None
+        
+        Returns:
+            Deadline: 截止时间对象
+        """
+        if isinstance(value, Deadline):
+            return value
+        return cls(value)
+    
+    def remaining(self):
+        """
+        剩余时间
+        
+        Returns:
+            float: 剩余秒数，不限时返回None
+        """
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+    
+    def expired(self):
+        """是否已到达截止时间"""
+        return self.expires_at is not None and time.monotonic() >= self.expires_at
+    
+    def has_time_for(self, seconds):
+        """
+        剩余时间是否足够完成指定时长的操作
+        
+        Args:
+            seconds (float): 操作所需时间（秒）
+        
+        Returns:
+            bool: 是否足够
+        """
+        remaining = self.remaining()
+        return remaining is None or remaining >= seconds
+    
+    def clip_timeout(self, connect_timeout, read_timeout):
+        """
+        根据剩余时间裁剪连接超时和读取超时
+        
+        Args:
+            connect_timeout (float): 连接超时（秒）
+            read_timeout (float): 读取超时（秒）
+        
+        Returns:
+            tuple: (连接超时, 读取超时, 是否被裁剪)
+        """
+        remaining = self.remaining()
+        if remaining is None or remaining >= connect_timeout + read_timeout:
+            return connect_timeout, read_timeout, False
+        return min(connect_timeout, remaining), remaining, True
\ No newline at end of file
@@ -0,0 +1,194 @@
+"""
+对冲请求
+请求在近期延迟的某个百分位内仍未返回时，再发送一份相同的请求，先得到的成功结果胜出，
+用少量额外调用削减长尾延迟
+"""
+import logging
+import os
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError, FIRST_COMPLETED, wait
+import numpy as np
+
+# 添加项目根目录到系统路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import config
+from utils.metrics import HEDGES_TOTAL
+
+logger = logging.getLogger('hedging')
+
+class Hedger:
+    """
+    对冲请求控制器
+    
+    记录最近成功请求的延迟，以其百分位作为对冲等待时间；
+    对冲请求数不超过主请求数的一定比例。
+    """
+    
+    def __init__(self, enabled=False, percentile=95, budget_ratio=0.1, window=200, min_samples=20, max_workers=16):
+        """
+        初始化对冲控制器
+        
+        Args:
+            enabled (bool): 是否启用对冲
+            percentile (float): 对冲等待时间取近期延迟的百分位（0-100）
+            budget_ratio (float): 对冲请求数占主请求数的最大比例
+            window (int): 参与统计的最近成功请求数
+            min_samples (int): 样本少于该数量时不对冲
+            max_workers (int): 发送请求的线程数
+        """
+        self.enabled = enabled
+        self.percentile = percentile
+        self.budget_ratio = budget_ratio
+        self.min_samples = min_samples
+        self.max_workers = max_workers
+        
+        self._latencies = deque(maxlen=window)
+        self._primaries = 0
+        self._hedges = 0
+        self._executor = None
+        self._lock = threading.Lock()
+    
+    def enable(self, enabled=True):
+        """开启或关闭对冲"""
+        self.enabled = enabled
+    
+    def observe(self, seconds):
+        """记录一次成功请求的延迟"""
+        with self._lock:
+            self._latencies.append(seconds)
+    
+    def delay(self):
+        """
+        当前的对冲等待时间
+        
+        Returns:
+            float: 等待秒数，样本不足时返回None
+        """
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return None
+            return float(np.percentile(self._latencies, self.percentile))
+    
+    def _take_budget(self):
+        """预算内时占用一次对冲额度"""
+        with self._lock:
+            if self._hedges + 1 > self.budget_ratio * self._primaries:
+                return False
+            self._hedges += 1
+            return True
+    
+    def _return_budget(self):
+        """归还一次未使用的对冲额度"""
+        with self._lock:
+            self._hedges -= 1
+    
+    @staticmethod
+    def _response_of(future):
+        """已结束的请求的响应，被取消或抛出异常时返回None"""
+        if future.cancelled() or future.exception() is not None:
+            return None
+        return future.result()
+    
+    def _timed(self, send):
+        """执行一次发送并记录成功请求的延迟"""
+        start = time.perf_counter()
+        response = send()
+        if response.status_code == 200:
+            self.observe(time.perf_counter() - start)
+        return response
+    
+    def call(self, send, labels=None, reserve=None, settle=None):
+        """
+        发送请求，必要时对冲
+        
+        Args:
+            send (callable): 发送一次请求并返回requests.Response的函数，可在任意线程中重复调用
+            labels (dict, optional): 指标标签
+            reserve (callable, optional): 发送对冲请求前调用，返回该请求的预留（如token预算），返回None时不对冲
+            settle (callable, optional): 结算对冲请求的预留，参数为(预留, 未被返回的那份请求的响应)，
+                该请求被取消或抛出异常时响应为None；返回的响应由调用方自行结算
+        
+        Returns:
+            requests.Response: 先返回的成功响应；都失败时返回最后一个失败响应
+        
+        Raises:
+            Exception: 所有请求都抛出异常时，抛出最后一个异常
+        """
+        if not self.enabled:
+            return self._timed(send)
+        
+        labels = labels or {}
+        with self._lock:
+            self._primaries += 1
+        
+        delay = self.delay()
+        if delay is None:
+            return self._timed(send)
+        
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="hedge")
+        
+        primary = self._executor.submit(self._timed, send)
+        try:
+            return primary.result(timeout=delay)
+        except TimeoutError:
+            pass
+        
+        if not self._take_budget():
+            HEDGES_TOTAL.inc(outcome="budget_exhausted", **labels)
+            return primary.result()
+        
+        reservation = reserve() if reserve is not None else None
+        if reserve is not None and reservation is None:
+            self._return_budget()
+            HEDGES_TOTAL.inc(outcome="reserve_rejected", **labels)
+            return primary.result()
+        
+        logger.debug(f"请求 {delay:.2f} 秒未返回，发送对冲请求")
+        HEDGES_TOTAL.inc(outcome="sent", **labels)
+        hedge = self._executor.submit(self._timed, send)
+        
+        def charge(other):
+            # 两份请求各自计费：未被返回的那份请求结束后按自己的响应结算对冲请求的预留
+            if settle is not None:
+                other.add_done_callback(lambda future: settle(reservation, self._response_of(future)))
+        
+        pending = {primary, hedge}
+        last_response = None
+        last_error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    response = future.result()
+                except Exception as e:
+                    last_error = e
+                    continue
+                if response.status_code == 200:
+                    # 另一份请求不再等待（requests无法中断已发出的请求，完成后连接自动释放）
+                    for other in pending:
+                        other.cancel()
+                    if future is hedge:
+                        HEDGES_TOTAL.inc(outcome="won", **labels)
+                    charge(primary if future is hedge else hedge)
+                    return response
+                last_response = response
+        
+        charge(hedge)
+        if last_response is not None:
+            return last_response
+        raise last_error
+
+# 所有爬虫共享的对冲控制器（默认关闭）
+shared_hedger = Hedger(
+    enabled=config.HEDGE_ENABLED,
+    percentile=config.HEDGE_PERCENTILE,
+    budget_ratio=config.HEDGE_BUDGET_RATIO,
+    window=config.HEDGE_WINDOW,
+    min_samples=config.HEDGE_MIN_SAMPLES,
+    max_workers=config.HEDGE_MAX_WORKERS
+)
@@ -5,41 +5,126 @@
 import re
 import sys
 import os
+import logging
 from tqdm import tqdm
 
 # 添加项目根目录到系统路径
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from scrapers.base_scraper import BaseScraper
-from models.data_model import AdmissionRate
+from scrapers.batch_jobs import run_bulk_collection
+from scrapers.deadline import Deadline
+from models.data_model import AdmissionRate, DataStorage
+from models.school_index import school_index
+from utils.refresh_scheduler import RefreshState, RATE_METRIC
+from utils.profiler import phase
 import config
 
+logger = logging.getLogger('rate_scraper')
+
 class RateScraper(BaseScraper):
     """升学率爬虫类"""
     
     def __init__(self, api_key=None):
         """初始化升学率爬虫"""
         super().__init__(api_key)
+        # 最近一次批量收集中未完成的(学校, 年份)
+        self.skipped_pairs = []
+    
+    @staticmethod
+    def _store_bulk_results(rates):
+        """把批量任务的一块结果写入数据存储并记录获取时间"""
+        DataStorage.upsert_admission_rates(rates)
+        RefreshState().mark(RATE_METRIC, [(rate.school_name, rate.year) for rate in rates])
+    
+    def _serve_stale(self, prompt, school_name, year):
+        """
+        返回缓存中的升学率，缓存过期时在后台刷新并更新数据存储
+        
+        Args:
+            prompt (str): 查询提示词
+            school_name (str): 学校名称
+            year (int): 年份
+            
+        Returns:
+            AdmissionRate: 升学率对象（cache_age为缓存时长），没有缓存时返回None
+        """
+        def on_refresh(response):
+            # 后台刷新完成后更新数据存储
+            refreshed = self._parse_rate_text(self.extract_text_from_response(response), school_name, year)
+            DataStorage.upsert_admission_rates([refreshed])
+            RefreshState().mark(RATE_METRIC, [(school_name, year)])
+        
+        response, age = self.query_stale_while_revalidate(
+            prompt, on_refresh, mode="升学率", category=self.get_school_category(school_name)
+        )
+        if response is None:
+            return None
+        
+        with phase("parse"):
+            rate = self._parse_rate_text(self.extract_text_from_response(response), school_name, year)
+        rate.cache_age = age
+        return rate
     
-    def get_admission_rate(self, school_name, year):
+    def build_prompt(self, school_name, year):
+        """
+        构建升学率查询提示词
+        
+        Args:
+            school_name (str): 学校名称
+            year (int): 年份
+            
+        Returns:
+            str: 查询提示词（同一学校的不同写法得到相同的提示词，共用同一条缓存）
+        """
+        return config.QUERY_MODES["升学率"].format(year=year, school=school_index.canonical(school_name))
+    
+    def get_admission_rate(self, school_name, year, deadline=None, use_cache=True, fallback=True, serve_stale=False):
         """
         获取指定学校和年份的升学率
         
         Args:
             school_name (str): 学校名称
             year (int): 年份
+            deadline (float | Deadline, optional): 截止时间
+            use_cache (bool): 是否使用未过期的缓存结果
+            fallback (bool): 查询失败时是否使用模拟数据
+            serve_stale (bool): 有缓存时立即返回（不论是否过期，cache_age属性为缓存时长），
+                过期的缓存在后台刷新并更新数据存储
             
         Returns:
-            AdmissionRate: 升学率对象
+            AdmissionRate: 升学率对象，未能完成查询（到达截止时间或不使用模拟数据时查询失败）时返回None
         """
-        # 构建查询提示词
-        prompt = config.QUERY_MODES["升学率"].format(year=year, school=school_name)
+        # 学校名称统一为学校ID，构建查询提示词
+        school_name = school_index.canonical(school_name)
+        prompt = self.build_prompt(school_name, year)
+        
+        if serve_stale:
+            cached = self._serve_stale(prompt, school_name, year)
+            if cached is not None:
+                return cached
         
         # 发送查询
-        response = self.query(prompt)
+        response = self.query(prompt, mode="升学率", category=self.get_school_category(school_name),
+                              deadline=deadline, use_cache=use_cache)
+        
+        # 到达截止时间或token预算已用完，未能完成查询
+        if response.get('deadline_exceeded') or response.get('budget_exhausted'):
+            return None
+        
+        # 查询失败且没有缓存时，使用模拟数据
+        is_mock = 'error' in response
+        if is_mock:
+            if not (fallback and config.FALLBACK_TO_MOCK):
+                return None
+            response = self.mock_query(prompt)
+        
         text = self.extract_text_from_response(response)
         
         # 解析结果
-        return self._parse_rate_text(text, school_name, year)
+        with phase("parse"):
+            rate = self._parse_rate_text(text, school_name, year)
+        rate.is_mock = is_mock
+        return rate
     
     def _parse_rate_text(self, text, school_name, year):
         """
@@ -80,25 +165,54 @@ class RateScraper(BaseScraper):
                 return default
         return default
     
-    def batch_collect_rates(self, school_names, years):
+    def batch_collect_rates(self, school_names, years, deadline=None, bulk=False, job_dir=None):
         """
         批量收集多个学校多年的升学率
         
+        到达截止时间后不再发起新的查询，未完成的(学校, 年份)记录在
+        self.skipped_pairs中，不会出现在返回结果里。
+        
+        bulk为True时以批量任务方式收集：所有查询写入作业文件一次提交，轮询完成后
+        结果分块解析并直接写入数据存储；中断或部分失败后重新运行同一收集即可继续。
+        
         Args:
             school_names (list): 学校名称列表
             years (list): 年份列表
+            deadline (float | Deadline, optional): 整体截止时间（秒数或Deadline对象）
+            bulk (bool): 是否以批量任务方式收集
+            job_dir (str, optional): 批量任务目录，默认按查询内容确定
             
         Returns:
-            list: AdmissionRate对象列表
+            list: AdmissionRate对象列表（批量方式下为本次运行取得的结果，已写入数据存储）
         """
+        # 同一学校的不同写法只查询一次
+        school_names = school_index.unique(school_names)
+        if bulk:
+            results, self.skipped_pairs = run_bulk_collection(
+                self, RATE_METRIC, school_names, years, self._parse_rate_text, self._store_bulk_results,
+                deadline=deadline, job_dir=job_dir
+            )
+            return results
+        
+        deadline = Deadline.from_value(deadline)
         results = []
+        self.skipped_pairs = []
         total = len(school_names) * len(years)
         
         with tqdm(total=total, desc="收集升学率") as pbar:
             for school in school_names:
                 for year in years:
-                    rate = self.get_admission_rate(school, year)
-                    results.append(rate)
+                    rate = None
+                    if not deadline.expired():
+                        rate = self.get_admission_rate(school, year, deadline=deadline)
+                    
+                    if rate is None:
+                        self.skipped_pairs.append((school, year))
+                    else:
+                        results.append(rate)
                     pbar.update(1)
         
+        if self.skipped_pairs:
+            logger.warning(f"{len(self.skipped_pairs)} 个(学校, 年份)组合未能完成查询（到达截止时间或查询失败）")
+        
         return results
\ No newline at end of file
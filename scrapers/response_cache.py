@@ -0,0 +1,121 @@
+"""
+响应缓存
+按查询键缓存API的成功响应，并以JSONL格式追加写入磁盘
+"""
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+# 添加项目根目录到系统路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import config
+
+logger = logging.getLogger('response_cache')
+
+class ResponseCache:
+    """API响应缓存"""
+    
+    def __init__(self, cache_file=None):
+        """
+        初始化响应缓存
+        
+        Args:
+            cache_file (str, optional): 缓存文件路径，默认使用config.RESPONSE_CACHE_FILE
+        """
+        self._cache_file = cache_file
+        self._entries = {}
+        self._loaded = False
+        self._lock = threading.Lock()
+    
+    @property
+    def cache_file(self):
+        """缓存文件路径"""
+        return self._cache_file or config.RESPONSE_CACHE_FILE
+    
+    def _load(self):
+        """从磁盘加载缓存（调用方需持有锁）"""
+        if self._loaded:
+            return
+        self._loaded = True
+        
+        if not os.path.exists(self.cache_file):
+            return
+        
+        line_count = 0
+        with open(self.cache_file, "r", encoding="utf-8") as f:
+            for line in f:
+                line_count += 1
+                try:
+                    entry = json.loads(line)
+                    self._entries[entry["key"]] = {"response": entry["response"], "timestamp": entry["timestamp"]}
+                except (ValueError, KeyError):
+                    continue
+        
+        # 重复写入的条目过多时压缩缓存文件
+        if line_count > 2 * len(self._entries) + 100:
+            try:
+                self._rewrite()
+            except OSError as e:
+                logger.error(f"压缩响应缓存失败: {str(e)}")
+    
+    def _rewrite(self):
+        """用内存中的条目重写缓存文件（调用方需持有锁）"""
+        tmp_file = f"{self.cache_file}.tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            for key, entry in self._entries.items():
+                f.write(json.dumps({"key": key, **entry}, ensure_ascii=False) + "\n")
+        os.replace(tmp_file, self.cache_file)
+    
+    def get(self, key, max_age=None):
+        """
+        获取缓存条目
+        
+        Args:
+            key (str): 查询键
+            max_age (float, optional): 最大允许的缓存时长（秒），None表示不限
+        
+        Returns:
+            dict: {"response": 响应, "timestamp": 写入时间}，未命中时返回None
+        """
+        with self._lock:
+            self._load()
+            entry = self._entries.get(key)
+        
+        if entry is None:
+            return None
+        if max_age is not None and time.time() - entry["timestamp"] > max_age:
+            return None
+        return entry
+    
+    def set(self, key, response):
+        """
+        写入缓存条目
+        
+        Args:
+            key (str): 查询键
+            response (dict): API响应
+        """
+        entry = {"response": response, "timestamp": time.time()}
+        with self._lock:
+            self._load()
+            self._entries[key] = entry
+            try:
+                os.makedirs(os.path.dirname(self.cache_file) or ".", exist_ok=True)
+                with open(self.cache_file, "a", encoding="utf-8") as f:
+                    f.write(json.dumps({"key": key, **entry}, ensure_ascii=False) + "\n")
+            except (OSError, TypeError) as e:
+                logger.error(f"写入响应缓存失败: {str(e)}")
+    
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._entries.clear()
+            self._loaded = True
+            if os.path.exists(self.cache_file):
+                os.remove(self.cache_file)
+
+# 所有爬虫共享的响应缓存
+response_cache = ResponseCache()
\ No newline at end of file
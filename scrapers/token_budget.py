@@ -0,0 +1,108 @@
+"""
+token预算
+按响应中的usage累计本次运行的token用量，达到上限后不再发送新的查询
+"""
+import logging
+import os
+import sys
+import threading
+
+# 添加项目根目录到系统路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import config
+
+logger = logging.getLogger('token_budget')
+
+class TokenBudget:
+    """
+    本次运行的token预算
+    
+    发送查询前按提示词长度和max_tokens预留额度，响应返回后按实际用量结算，
+    并发查询不会一起越过上限。
+    """
+    
+    def __init__(self, limit=None):
+        """
+        初始化预算
+        
+        Args:
+            limit (int, optional): token上限，None表示不限
+        """
+        self.limit = limit
+        self.spent = 0
+        self.reserved = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+    
+    def reset(self, limit=None):
+        """重新开始计算，并设置新的上限"""
+        with self._lock:
+            self.limit = limit
+            self.spent = 0
+            self.reserved = 0
+            self.rejected = 0
+    
+    @staticmethod
+    def estimate(prompt, max_tokens):
+        """
+        估算一次查询最多消耗的token数（中文大致每字一个token）
+        
+        Args:
+            prompt (str): 查询提示词
+            max_tokens (int): 生成的token上限
+        
+        Returns:
+            int: 估算的token数
+        """
+        return len(prompt) + max_tokens
+    
+    def reserve(self, tokens):
+        """
+        预留额度
+        
+        Args:
+            tokens (int): 预留的token数
+        
+        Returns:
+            int: 预留的token数，超出预算时返回None
+        """
+        with self._lock:
+            if self.limit is not None and self.spent + self.reserved + tokens > self.limit:
+                self.rejected += 1
+                if self.rejected == 1:
+                    logger.warning(f"token预算已用完（上限 {self.limit}，已用 {self.spent}），不再发送新的查询")
+                return None
+            self.reserved += tokens
+            return tokens
+    
+    def settle(self, reservation, used=None):
+        """
+        结算一次查询
+        
+        Args:
+            reservation (int): reserve返回的预留数
+            used (int, optional): 实际用量，响应中没有usage时按预留数计
+        """
+        with self._lock:
+            self.reserved -= reservation
+            self.spent += reservation if used is None else used
+    
+    def remaining(self):
+        """
+        剩余额度
+        
+        Returns:
+            int: 剩余token数，不限时返回None
+        """
+        with self._lock:
+            if self.limit is None:
+                return None
+            return max(0, self.limit - self.spent - self.reserved)
+    
+    def summary(self):
+        """预算使用情况"""
+        with self._lock:
+            return {"limit": self.limit, "spent": self.spent, "rejected": self.rejected}
+
+# 所有爬虫共享的token预算（默认不限，可用 --token-budget 设置）
+shared_budget = TokenBudget(config.TOKEN_BUDGET_PER_RUN)
@@ -0,0 +1,423 @@
+"""
+本地HTTP查询服务
+基于asyncio提供JSON接口，供多人同时查询已收集的数据、分类统计和分数预测。
+数据集常驻内存，数据文件变化时自动重新加载；响应按数据版本缓存，并支持ETag/304
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlsplit, parse_qs
+
+# 添加项目根目录到系统路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from models.data_model import DataStorage
+from models.school_index import school_index
+from models.storage_log import data_version
+from utils.data_processor import DataProcessor
+from utils.predictor import ScorePredictor
+from utils.metrics import metrics, HTTP_REQUESTS_TOTAL, HTTP_CACHE_TOTAL
+import config
+
+logger = logging.getLogger('http_service')
+
+STATUS_TEXT = {
+    200: "OK",
+    304: "Not Modified",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    500: "Internal Server Error",
+}
+
+class RequestError(Exception):
+    """请求参数错误，转换为对应状态码的JSON错误响应"""
+    
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+class DatasetSnapshot:
+    """常驻内存的数据集，数据文件变化（修改时间或大小）时重新加载"""
+    
+    def __init__(self, check_interval=None):
+        """
+        初始化数据集
+        
+        Args:
+            check_interval (float, optional): 检查数据文件的最小间隔（秒），默认使用config.HTTP_VERSION_CHECK_INTERVAL
+        """
+        self.check_interval = config.HTTP_VERSION_CHECK_INTERVAL if check_interval is None else check_interval
+        self.version = None
+        self.scores = []
+        self.rates = []
+        self._file_versions = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+    
+    def cached(self):
+        """
+        距上次检查未到检查间隔时返回当前数据集（不访问数据文件）
+        
+        Returns:
+            tuple: (数据版本, AdmissionScore列表, AdmissionRate列表)，需要检查数据文件时返回None
+        """
+        if self.version is not None and time.monotonic() - self._checked_at < self.check_interval:
+            return self.version, self.scores, self.rates
+        return None
+    
+    def current(self):
+        """
+        返回当前数据集，必要时重新加载（会读取数据文件，在事件循环中应放到线程池执行）
+        
+        Returns:
+            tuple: (数据版本, AdmissionScore列表, AdmissionRate列表)
+        """
+        dataset = self.cached()
+        if dataset is not None:
+            return dataset
+        
+        with self._lock:
+            now = time.monotonic()
+            if self.version is not None and now - self._checked_at < self.check_interval:
+                # 等待锁期间其他线程已完成检查
+                return self.version, self.scores, self.rates
+            self._checked_at = now
+            file_versions = (data_version(config.SCORE_DATA_FILE), data_version(config.RATE_DATA_FILE))
+            if file_versions != self._file_versions:
+                self.scores = DataStorage.load_admission_scores()
+                self.rates = DataStorage.load_admission_rates()
+                self._file_versions = file_versions
+                self.version = hashlib.sha1(repr(file_versions).encode("utf-8")).hexdigest()[:12]
+                logger.info(f"已加载数据集（版本 {self.version}）: 录取分数 {len(self.scores)} 条，升学率 {len(self.rates)} 条")
+            return self.version, self.scores, self.rates
+
+class HttpService:
+    """
+    本地HTTP查询服务
+    
+    只处理GET请求，支持HTTP/1.1长连接。缓存未命中的查询在线程池中计算，
+    同一查询同时只计算一次；命中缓存的请求直接在事件循环中返回。
+    """
+    
+    def __init__(self, host=None, port=None, cache_size=None):
+        """
+        初始化查询服务
+        
+        Args:
+            host (str, optional): 监听地址，默认使用config.HTTP_HOST
+            port (int, optional): 监听端口，默认使用config.HTTP_PORT
+            cache_size (int, optional): 响应缓存条数上限，默认使用config.HTTP_CACHE_MAX_ENTRIES
+        """
+        self.host = host or config.HTTP_HOST
+        self.port = config.HTTP_PORT if port is None else port
+        self.cache_size = cache_size or config.HTTP_CACHE_MAX_ENTRIES
+        self.dataset = DatasetSnapshot()
+        self.routes = {
+            "/api/schools": self._api_schools,
+            "/api/scores": self._api_scores,
+            "/api/rates": self._api_rates,
+            "/api/category/scores": self._api_category_scores,
+            "/api/category/rates": self._api_category_rates,
+            "/api/category/stats": self._api_category_stats,
+            "/api/predict": self._api_predict,
+        }
+        self._cache = OrderedDict()
+        self._cache_version = None
+        self._inflight = {}
+        self._server = None
+    
+    @staticmethod
+    def _param(params, name, required=True):
+        """读取单个查询参数"""
+        values = params.get(name)
+        if not values or not values[0]:
+            if required:
+                raise RequestError(f"缺少参数: {name}")
+            return None
+        return values[0]
+    
+    @staticmethod
+    def _int_param(params, name, required=True, default=None):
+        """读取整数查询参数"""
+        value = HttpService._param(params, name, required)
+        if value is None:
+            return default
+        try:
+            return int(value)
+        except ValueError:
+            raise RequestError(f"参数 {name} 必须是整数")
+    
+    @staticmethod
+    def _years_param(params):
+        """读取逗号分隔的年份列表参数"""
+        value = HttpService._param(params, "years", required=False)
+        if value is None:
+            return None
+        try:
+            return [int(year) for year in value.split(",") if year.strip()]
+        except ValueError:
+            raise RequestError("参数 years 必须是逗号分隔的年份")
+    
+    @staticmethod
+    def _category_param(params):
+        """读取学校分类参数"""
+        category = HttpService._param(params, "category")
+        if category not in config.SCHOOL_CATEGORIES:
+            raise RequestError(f"未知的学校分类: {category}", status=404)
+        return category
+    
+    def _api_schools(self, params, scores, rates):
+        """学校分类和学校列表"""
+        return {"categories": config.SCHOOL_CATEGORIES}
+    
+    def _api_scores(self, params, scores, rates):
+        """指定学校的录取分数"""
+        school_name = school_index.canonical(self._param(params, "school"))
+        records = DataProcessor.get_school_scores(school_name, self._years_param(params), scores=scores)
+        return {"school_name": school_name, "scores": [record.to_dict() for record in records]}
+    
+    def _api_rates(self, params, scores, rates):
+        """指定学校的升学率"""
+        school_name = school_index.canonical(self._param(params, "school"))
+        records = DataProcessor.get_school_rates(school_name, self._years_param(params), rates=rates)
+        return {"school_name": school_name, "rates": [record.to_dict() for record in records]}
+    
+    def _api_category_scores(self, params, scores, rates):
+        """指定分类在特定年份的录取分数"""
+        category = self._category_param(params)
+        year = self._int_param(params, "year")
+        records = DataProcessor.get_category_scores(category, year, scores=scores)
+        return {"category": category, "year": year,
+                "scores": {name: record.to_dict() for name, record in records.items()}}
+    
+    def _api_category_rates(self, params, scores, rates):
+        """指定分类在特定年份的升学率"""
+        category = self._category_param(params)
+        year = self._int_param(params, "year")
+        records = DataProcessor.get_category_rates(category, year, rates=rates)
+        return {"category": category, "year": year,
+                "rates": {name: record.to_dict() for name, record in records.items()}}
+    
+    def _api_category_stats(self, params, scores, rates):
+        """指定分类在特定年份的分数和升学率统计"""
+        category = self._category_param(params)
+        year = self._int_param(params, "year")
+        category_scores = list(DataProcessor.get_category_scores(category, year, scores=scores).values())
+        category_rates = list(DataProcessor.get_category_rates(category, year, rates=rates).values())
+        return {
+            "category": category,
+            "year": year,
+            "score_count": len(category_scores),
+            "rate_count": len(category_rates),
+            "scores": DataProcessor.calculate_score_statistics(category_scores),
+            "rates": DataProcessor.calculate_rate_statistics(category_rates),
+        }
+    
+    def _api_predict(self, params, scores, rates):
+        """指定学校的录取分数预测（只使用已存储的数据，不发起查询）"""
+        school_name = self._param(params, "school")
+        year = self._int_param(params, "year", required=False, default=2026)
+        return ScorePredictor.predict_scores(school_name, year, scores=scores)
+    
+    @staticmethod
+    def _json_default(value):
+        """numpy等标量类型转换为Python原生类型"""
+        if hasattr(value, "item"):
+            return value.item()
+        raise TypeError(f"无法序列化的类型: {type(value).__name__}")
+    
+    @staticmethod
+    def _encode(payload):
+        """序列化为JSON响应体并计算ETag"""
+        body = json.dumps(payload, ensure_ascii=False, default=HttpService._json_default).encode("utf-8")
+        etag = '"' + hashlib.sha1(body).hexdigest()[:20] + '"'
+        return body, etag
+    
+    @staticmethod
+    def _etag_matches(if_none_match, etag):
+        """判断If-None-Match请求头是否与ETag匹配"""
+        if not if_none_match:
+            return False
+        candidates = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in candidates or any((tag[2:] if tag.startswith("W/") else tag) == etag for tag in candidates)
+    
+    def _compute(self, handler, params, scores, rates):
+        """在线程池中执行接口函数并序列化结果"""
+        return self._encode(handler(params, scores, rates))
+    
+    async def _cached_response(self, path, handler, params):
+        """
+        返回接口的响应体和ETag，按(数据版本, 路径, 参数)缓存
+        
+        Returns:
+            tuple: (响应体, ETag, 数据版本)
+        """
+        dataset = self.dataset.cached()
+        if dataset is None:
+            # 检查数据文件、必要时重新加载都在线程池中进行，重新加载期间事件循环继续处理其他连接
+            dataset = await asyncio.get_running_loop().run_in_executor(None, self.dataset.current)
+        version, scores, rates = dataset
+        if version != self._cache_version:
+            # 数据已更新，旧版本的响应全部失效
+            self._cache.clear()
+            self._cache_version = version
+        
+        key = (path, tuple(sorted((name, tuple(values)) for name, values in params.items())))
+        cached = self._cache.get(key)
+        if cached is not None:
+            self._cache.move_to_end(key)
+            HTTP_CACHE_TOTAL.inc(result="hit")
+            return cached[0], cached[1], version
+        HTTP_CACHE_TOTAL.inc(result="miss")
+        
+        inflight_key = (version, key)
+        future = self._inflight.get(inflight_key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(None, self._compute, handler, params, scores, rates)
+            self._inflight[inflight_key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(inflight_key, None))
+        
+        body, etag = await asyncio.shield(future)
+        if version == self._cache_version:
+            self._cache[key] = (body, etag)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return body, etag, version
+    
+    async def _dispatch(self, method, target, headers):
+        """
+        处理单个请求
+        
+        Returns:
+            tuple: (状态码, 响应头字典, 响应体)
+        """
+        parts = urlsplit(target)
+        path = parts.path.rstrip("/") or "/"
+        
+        if method not in ("GET", "HEAD"):
+            return 405, {"Allow": "GET, HEAD"}, self._encode({"error": "只支持GET请求"})[0]
+        
+        if path == "/metrics":
+            return 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}, metrics.to_prometheus().encode("utf-8")
+        
+        handler = self.routes.get(path)
+        if handler is None:
+            return 404, {}, self._encode({"error": f"未知的接口: {path}", "endpoints": sorted(self.routes)})[0]
+        
+        params = parse_qs(parts.query)
+        try:
+            body, etag, version = await self._cached_response(path, handler, params)
+        except RequestError as e:
+            return e.status, {}, self._encode({"error": str(e)})[0]
+        
+        response_headers = {"ETag": etag, "Cache-Control": "no-cache", "X-Data-Version": version}
+        if self._etag_matches(headers.get("if-none-match"), etag):
+            return 304, response_headers, b""
+        return 200, response_headers, body
+    
+    async def _read_request(self, reader):
+        """
+        读取请求行和请求头（忽略请求体）
+        
+        Returns:
+            tuple: (方法, 目标, HTTP版本, 请求头字典)，连接关闭时返回None
+        """
+        request_line = await asyncio.wait_for(reader.readline(), config.HTTP_KEEPALIVE_TIMEOUT)
+        if not request_line.strip():
+            return None
+        
+        try:
+            method, target, http_version = request_line.decode("latin-1").split()
+        except ValueError:
+            raise RequestError("无法解析请求行")
+        
+        headers = {}
+        while True:
+            line = await asyncio.wait_for(reader.readline(), config.HTTP_KEEPALIVE_TIMEOUT)
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        
+        # 丢弃请求体
+        length = int(headers.get("content-length") or 0)
+        if length:
+            await reader.readexactly(length)
+        
+        return method.upper(), target, http_version, headers
+    
+    @staticmethod
+    def _write_response(writer, status, headers, body, keep_alive, head_only=False):
+        """写出HTTP响应"""
+        lines = [f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}"]
+        headers = dict(headers)
+        headers.setdefault("Content-Type", "application/json; charset=utf-8")
+        headers["Content-Length"] = str(len(body))
+        headers["Connection"] = "keep-alive" if keep_alive else "close"
+        lines.extend(f"{name}: {value}" for name, value in headers.items())
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("utf-8"))
+        if body and not head_only:
+            writer.write(body)
+    
+    async def _handle_connection(self, reader, writer):
+        """处理一个客户端连接上的所有请求"""
+        try:
+            while True:
+                try:
+                    request = await self._read_request(reader)
+                except RequestError as e:
+                    self._write_response(writer, 400, {}, self._encode({"error": str(e)})[0], keep_alive=False)
+                    break
+                if request is None:
+                    break
+                
+                method, target, http_version, headers = request
+                connection = headers.get("connection", "").lower()
+                keep_alive = connection != "close" if http_version == "HTTP/1.1" else connection == "keep-alive"
+                
+                try:
+                    status, response_headers, body = await self._dispatch(method, target, headers)
+                except Exception as e:
+                    logger.exception(f"处理请求失败: {target}")
+                    status, response_headers, body = 500, {}, self._encode({"error": str(e)})[0]
+                
+                endpoint = urlsplit(target).path.rstrip("/")
+                if endpoint not in self.routes and endpoint != "/metrics":
+                    endpoint = "其他"
+                HTTP_REQUESTS_TOTAL.inc(endpoint=endpoint, status=status)
+                self._write_response(writer, status, response_headers, body, keep_alive, head_only=method == "HEAD")
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+    
+    async def serve_forever(self):
+        """启动服务并一直运行"""
+        # 启动前加载数据集，避免第一个请求承担加载耗时
+        self.dataset.current()
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        logger.info(f"HTTP查询服务已启动: http://{self.host}:{self.port}")
+        print(f"HTTP查询服务已启动: http://{self.host}:{self.port}（Ctrl+C 停止）")
+        async with self._server:
+            await self._server.serve_forever()
+
+def run_service(host=None, port=None):
+    """
+    运行本地HTTP查询服务，直到被中断
+    
+    Args:
+        host (str, optional): 监听地址
+        port (int, optional): 监听端口
+    """
+    asyncio.run(HttpService(host, port).serve_forever())
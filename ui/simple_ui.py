@@ -10,8 +10,14 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from models.school import SchoolManager, SchoolCategory
 from scrapers.score_scraper import ScoreScraper
 from scrapers.rate_scraper import RateScraper
+from scrapers.deadline import Deadline
 from utils.data_processor import DataProcessor
 from utils.predictor import ScorePredictor
+from utils.metrics import metrics, format_summary
+from utils.profiler import profile_run
+from utils.refresh_scheduler import RefreshScheduler, RefreshState, SCORE_METRIC, RATE_METRIC
+from utils.data_quality import DataQualityChecker
+from utils.prefetcher import Prefetcher
 import config
 
 class SimpleUI:
@@ -22,6 +28,8 @@ class SimpleUI:
         self.school_manager = SchoolManager()
         self.score_scraper = ScoreScraper()
         self.rate_scraper = RateScraper()
+        # 选择分类后在后台预取数据，减少等待时间
+        self.prefetcher = Prefetcher(self.score_scraper, self.rate_scraper)
     
     def display_welcome(self):
         """显示欢迎信息"""
@@ -99,6 +107,37 @@ class SimpleUI:
         print("无效的选择，请重新选择")
         return self.display_years()
     
+    def _prefetch_category(self, metric, category):
+        """
+        后台预取指定分类下所有学校的数据
+        
+        Args:
+            metric (str): 指标名称（录取分数/升学率）
+            category (SchoolCategory): 学校分类
+        """
+        schools = self.school_manager.get_schools_by_category(category)
+        self.prefetcher.prefetch_category(metric, [school.name for school in schools])
+    
+    def _display_cache_age(self, cache_age):
+        """
+        显示缓存数据的时长
+        
+        Args:
+            cache_age (float): 缓存时长（秒），None表示实时查询的结果
+        """
+        if cache_age is None:
+            return
+        
+        if cache_age < 3600:
+            age_text = f"{int(cache_age // 60)}分钟"
+        elif cache_age < 86400:
+            age_text = f"{int(cache_age // 3600)}小时"
+        else:
+            age_text = f"{int(cache_age // 86400)}天"
+        
+        note = "，已在后台刷新" if cache_age > config.SWR_FRESH_SECONDS else ""
+        print(f"（缓存数据，{age_text}前获取{note}）")
+    
     def query_admission_score(self):
         """录取分数查询"""
         print("\n===== 录取分数查询 =====")
@@ -106,6 +145,9 @@ class SimpleUI:
         # 选择学校分类
         category = self.display_school_categories()
         
+        # 在用户选择学校和年份的同时，后台预取该分类的数据
+        self._prefetch_category(SCORE_METRIC, category)
+        
         # 选择学校
         school = self.display_schools_by_category(category)
         
@@ -114,8 +156,11 @@ class SimpleUI:
         
         print(f"\n正在查询 {year}年 {school.name} 的录取分数...")
         
-        # 获取录取分数
-        score = self.score_scraper.get_admission_score(school.name, year)
+        # 如果后台正在预取该查询，等待其完成后直接使用缓存
+        self.prefetcher.wait_for(SCORE_METRIC, school.name, year, timeout=config.CONNECT_TIMEOUT + config.READ_TIMEOUT)
+        
+        # 获取录取分数（有缓存时立即返回，过期的缓存在后台刷新）
+        score = self.score_scraper.get_admission_score(school.name, year, serve_stale=True)
         
         # 显示结果
         print("\n查询结果：")
@@ -124,6 +169,7 @@ class SimpleUI:
         print(f"最低分: {score.min_score}")
         print(f"最高分: {score.max_score}")
         print(f"平均分: {score.avg_score}")
+        self._display_cache_age(score.cache_age)
         
         if score.student_sources:
             print("\n学生来源分布:")
@@ -139,6 +185,9 @@ class SimpleUI:
         # 选择学校分类
         category = self.display_school_categories()
         
+        # 在用户选择学校和年份的同时，后台预取该分类的数据
+        self._prefetch_category(RATE_METRIC, category)
+        
         # 选择学校
         school = self.display_schools_by_category(category)
         
@@ -147,8 +196,11 @@ class SimpleUI:
         
         print(f"\n正在查询 {year}年 {school.name} 的升学率...")
         
-        # 获取升学率
-        rate = self.rate_scraper.get_admission_rate(school.name, year)
+        # 如果后台正在预取该查询，等待其完成后直接使用缓存
+        self.prefetcher.wait_for(RATE_METRIC, school.name, year, timeout=config.CONNECT_TIMEOUT + config.READ_TIMEOUT)
+        
+        # 获取升学率（有缓存时立即返回，过期的缓存在后台刷新）
+        rate = self.rate_scraper.get_admission_rate(school.name, year, serve_stale=True)
         
         # 显示结果
         print("\n查询结果：")
@@ -157,6 +209,7 @@ class SimpleUI:
         print(f"C9入线率: {rate.c9_rate}%")
         print(f"985入线率: {rate.rate_985}%")
         print(f"211入线率: {rate.rate_211}%")
+        self._display_cache_age(rate.cache_age)
         
         input("\n按回车键返回主菜单...")
     
@@ -172,8 +225,8 @@ class SimpleUI:
         
         print(f"\n正在预测 {school.name} 2026年的录取分数...")
         
-        # 预测分数
-        prediction = ScorePredictor.predict_scores(school.name)
+        # 预测分数（本地历史数据不足时只查询缺失的年份）
+        prediction = ScorePredictor.predict_scores(school.name, fetch_missing=True, scraper=self.score_scraper)
         
         # 显示结果
         print("\n预测结果：")
@@ -183,10 +236,17 @@ class SimpleUI:
         if prediction.get('error'):
             print(f"预测失败: {prediction['error']}")
         else:
-            print(f"预测最低分: {prediction['min_score']}")
-            print(f"预测最高分: {prediction['max_score']}")
-            print(f"预测平均分: {prediction['avg_score']}")
+            for key, label in (("min_score", "最低分"), ("max_score", "最高分"), ("avg_score", "平均分")):
+                if prediction.get(f"{key}_lower") is not None:
+                    print(f"预测{label}: {prediction[key]}（{prediction['interval_level']:.0%}区间 "
+                          f"{prediction[f'{key}_lower']} ~ {prediction[f'{key}_upper']}）")
+                else:
+                    print(f"预测{label}: {prediction[key]}")
             print(f"预测置信度: {prediction['confidence']}%")
+            if prediction.get('backtest_mae') is not None:
+                print(f"预测模型: {prediction['model']}（回测平均误差 {prediction['backtest_mae']} 分）")
+            else:
+                print(f"预测模型: {prediction['model']}")
         
         input("\n按回车键返回主菜单...")
     
@@ -197,28 +257,133 @@ class SimpleUI:
         # 选择学校分类
         category = self.display_school_categories()
         
+        self.collect_category_data(category, deadline=config.BATCH_DEADLINE_SECONDS)
+        
+        input("\n按回车键返回主菜单...")
+    
+    def collect_category_data(self, category, deadline=None, bulk=False):
+        """
+        为指定分类批量收集录取分数和升学率数据（无需交互，可用于定时任务）
+        
+        Args:
+            category (SchoolCategory): 学校分类
+            deadline (float, optional): 整体截止时间（秒），None表示不限时
+            bulk (bool): 是否以批量任务方式收集（结果边解析边写入数据存储，中断后再次运行可继续）
+        """
         print(f"\n正在为 {category.value} 批量收集数据...")
         
         # 获取该分类的所有学校
         schools = self.school_manager.get_schools_by_category(category)
         school_names = [school.name for school in schools]
         
-        # 批量收集录取分数
-        print("\n收集录取分数数据...")
-        scores = self.score_scraper.batch_collect_scores(school_names, config.DATA_YEARS)
+        # 录取分数和升学率共用同一个截止时间
+        deadline = Deadline.from_value(deadline)
         
-        # 批量收集升学率
-        print("\n收集升学率数据...")
-        rates = self.rate_scraper.batch_collect_rates(school_names, config.DATA_YEARS)
+        # 每次批量收集单独统计请求指标
+        metrics.reset()
         
-        # 保存数据
-        from models.data_model import DataStorage
-        DataStorage.save_admission_scores(scores)
-        DataStorage.save_admission_rates(rates)
+        with profile_run("batch_collect_data"):
+            # 批量收集录取分数
+            print("\n收集录取分数数据...")
+            scores = self.score_scraper.batch_collect_scores(school_names, config.DATA_YEARS, deadline=deadline, bulk=bulk)
+            
+            # 批量收集升学率
+            print("\n收集升学率数据...")
+            rates = self.rate_scraper.batch_collect_rates(school_names, config.DATA_YEARS, deadline=deadline, bulk=bulk)
+            
+            # 批量任务方式下结果已在处理时写入
+            if not bulk:
+                # 保存数据（按学校和年份合并，不覆盖其他分类的数据）
+                from models.data_model import DataStorage
+                DataStorage.upsert_admission_scores(scores)
+                DataStorage.upsert_admission_rates(rates)
+                
+                # 记录获取时间，供增量刷新判断数据是否陈旧；模拟数据记为从未获取，增量刷新时优先重新查询
+                refresh_state = RefreshState()
+                for metric, records in ((SCORE_METRIC, scores), (RATE_METRIC, rates)):
+                    refresh_state.mark(metric, [(record.school_name, record.year) for record in records if not record.is_mock])
+                    refresh_state.mark(metric, [(record.school_name, record.year) for record in records if record.is_mock],
+                                       timestamp=0)
         
         print(f"\n数据收集完成，共收集了 {len(scores)} 条录取分数数据和 {len(rates)} 条升学率数据")
         
-        input("\n按回车键返回主菜单...")
+        # 报告未完成的组合
+        skipped_scores = self.score_scraper.skipped_pairs
+        skipped_rates = self.rate_scraper.skipped_pairs
+        if skipped_scores or skipped_rates:
+            print(f"\n有 {len(skipped_scores)} 条录取分数和 {len(skipped_rates)} 条升学率查询未完成（到达截止时间或查询失败）：")
+            for school, year in skipped_scores:
+                print(f"  录取分数 - {school} {year}年")
+            for school, year in skipped_rates:
+                print(f"  升学率 - {school} {year}年")
+        
+        # 输出请求指标汇总并导出
+        print("\n请求指标汇总：")
+        print(format_summary())
+        prom_file, json_file = metrics.export()
+        print(f"\n指标已导出到 {prom_file} 和 {json_file}")
+    
+    def refresh_data(self, budget=None, deadline=None):
+        """
+        按优先级增量刷新数据（无需交互，可用于定时任务）
+        
+        只刷新缺失、异常或陈旧的记录，优先最新年份，调用次数不超过预算。
+        
+        Args:
+            budget (int, optional): 调用预算，默认为config.REFRESH_CALL_BUDGET
+            deadline (float, optional): 整体截止时间（秒）
+        """
+        scheduler = RefreshScheduler(self.score_scraper, self.rate_scraper)
+        
+        metrics.reset()
+        result = scheduler.run(budget=budget, deadline=deadline)
+        
+        print(f"\n计划刷新 {len(result['planned'])} 项，成功 {len(result['refreshed'])} 项，失败 {len(result['failed'])} 项")
+        for item in result["planned"]:
+            status = "失败" if item in result["failed"] else "成功"
+            print(f"  [{status}] {item['metric']} - {item['school_name']} {item['year']}年 "
+                  f"(优先级 {item['priority']}，原因: {'、'.join(item['reasons'])})")
+        
+        print("\n请求指标汇总：")
+        print(format_summary())
+    
+    def check_data_quality(self, repair=False, deadline=None):
+        """
+        检查已存储数据的质量，可选地只重新查询有问题的记录
+        
+        Args:
+            repair (bool): 是否重新查询有问题的记录
+            deadline (float, optional): 重新查询的整体截止时间（秒）
+        """
+        from models.data_model import DataStorage
+        mismatches = DataStorage.verify_aggregates()
+        if mismatches:
+            print(f"\n汇总表有 {len(mismatches)} 项与原始数据不一致，已重建：")
+            for mismatch in mismatches[:10]:
+                print(f"  {mismatch}")
+            DataStorage.rebuild_aggregates()
+        
+        issues = DataQualityChecker.scan()
+        plan = DataQualityChecker.build_requery_plan(issues)
+        
+        if not plan:
+            print("\n数据检查完成，没有发现问题")
+            return
+        
+        print(f"\n发现 {len(issues)} 个问题，涉及 {len(plan)} 条记录：")
+        for item in plan:
+            print(f"  {item['metric']} - {item['school_name']} {item['year']}年: {'、'.join(item['reasons'])}")
+        
+        if not repair:
+            return
+        
+        print(f"\n正在重新查询 {len(plan)} 条记录...")
+        metrics.reset()
+        result = RefreshScheduler(self.score_scraper, self.rate_scraper).execute(plan, deadline=deadline)
+        print(f"修复完成，成功 {len(result['refreshed'])} 条，失败 {len(result['failed'])} 条")
+        
+        remaining = DataQualityChecker.build_requery_plan(DataQualityChecker.scan())
+        print(f"重新检查后仍有 {len(remaining)} 条记录存在问题")
     
     def run(self):
         """运行用户界面"""
@@ -237,10 +402,13 @@ class SimpleUI:
                 self.batch_collect_data()
             elif choice == '0':
                 print("\n感谢使用上海高中数据收集系统，再见！")
+                self.prefetcher.shutdown()
                 break
             else:
                 print("\n无效的选择，请重新选择")
 
 if __name__ == "__main__":
+    from utils.logger import setup_logging
+    setup_logging()
     ui = SimpleUI()
     ui.run()
\ No newline at end of file
@@ -10,29 +10,34 @@ import sys
 # 添加项目根目录到系统路径
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from models.data_model import AdmissionScore, AdmissionRate, DataStorage
+from models.school_index import school_index
+from models.storage_log import open_log
 import config
 
 class DataProcessor:
     """数据处理类"""
     
     @staticmethod
-    def get_school_scores(school_name, years=None):
+    def get_school_scores(school_name, years=None, scores=None):
         """
         获取指定学校的录取分数数据
         
         Args:
             school_name (str): 学校名称
             years (list, optional): 年份列表，如果不提供则获取所有年份
+            scores (list, optional): 已加载的AdmissionScore对象列表，如果不提供则从存储加载
             
         Returns:
             list: AdmissionScore对象列表
         """
-        scores = DataStorage.load_admission_scores()
+        if scores is None:
+            scores = DataStorage.load_admission_scores()
         
         if not scores:
             return []
         
-        # 过滤指定学校
+        # 过滤指定学校（按学校ID匹配，任意写法都能查到）
+        school_name = school_index.canonical(school_name)
         school_scores = [score for score in scores if score.school_name == school_name]
         
         # 如果指定了年份，进一步过滤
@@ -42,23 +47,26 @@ class DataProcessor:
         return school_scores
     
     @staticmethod
-    def get_school_rates(school_name, years=None):
+    def get_school_rates(school_name, years=None, rates=None):
         """
         获取指定学校的升学率数据
         
         Args:
             school_name (str): 学校名称
             years (list, optional): 年份列表，如果不提供则获取所有年份
+            rates (list, optional): 已加载的AdmissionRate对象列表，如果不提供则从存储加载
             
         Returns:
             list: AdmissionRate对象列表
         """
-        rates = DataStorage.load_admission_rates()
+        if rates is None:
+            rates = DataStorage.load_admission_rates()
         
         if not rates:
             return []
         
         # 过滤指定学校
+        school_name = school_index.canonical(school_name)
         school_rates = [rate for rate in rates if rate.school_name == school_name]
         
         # 如果指定了年份，进一步过滤
@@ -68,18 +76,20 @@ class DataProcessor:
         return school_rates
     
     @staticmethod
-    def get_category_scores(category, year):
+    def get_category_scores(category, year, scores=None):
         """
         获取指定分类学校在特定年份的录取分数
         
         Args:
             category (str): 学校分类
             year (int): 年份
+            scores (list, optional): 已加载的AdmissionScore对象列表，如果不提供则从存储加载
             
         Returns:
             dict: {学校名: AdmissionScore对象}
         """
-        scores = DataStorage.load_admission_scores()
+        if scores is None:
+            scores = DataStorage.load_admission_scores()
         
         if not scores:
             return {}
@@ -96,18 +106,20 @@ class DataProcessor:
         return category_scores
     
     @staticmethod
-    def get_category_rates(category, year):
+    def get_category_rates(category, year, rates=None):
         """
         获取指定分类学校在特定年份的升学率
         
         Args:
             category (str): 学校分类
             year (int): 年份
+            rates (list, optional): 已加载的AdmissionRate对象列表，如果不提供则从存储加载
             
         Returns:
             dict: {学校名: AdmissionRate对象}
         """
-        rates = DataStorage.load_admission_rates()
+        if rates is None:
+            rates = DataStorage.load_admission_rates()
         
         if not rates:
             return {}
@@ -191,4 +203,140 @@ class DataProcessor:
                 "max": max(rates_211),
                 "avg": sum(rates_211) / len(rates_211)
             }
-        }
\ No newline at end of file
+        }
+    
+    @staticmethod
+    def _category_membership():
+        """
+        学校与分类的对应关系（一所学校可以属于多个分类）
+        
+        Returns:
+            pd.DataFrame: 列为school_name、category
+        """
+        pairs = [(school, category) for category, schools in config.SCHOOL_CATEGORIES.items() for school in schools]
+        return pd.DataFrame(pairs, columns=["school_name", "category"])
+    
+    @staticmethod
+    def _records_frame(records, data_file, columns, snapshot=None, table=None):
+        """
+        将对象列表转换为列式数据，未提供对象列表时使用快照或直接读取数据文件
+        
+        Args:
+            records (list): AdmissionScore或AdmissionRate对象列表，None表示从快照或数据文件读取
+            data_file (str): 数据文件路径
+            columns (list): 需要的列
+            snapshot (HistorySnapshot, optional): 内存映射的历史数据快照
+            table (str, optional): 快照中的数据集（scores/rates）
+        
+        Returns:
+            pd.DataFrame: 列式数据
+        """
+        if records is None and snapshot is not None:
+            df = snapshot.frame(table, [column for column in columns if column not in ("school_name", "year")])
+            df["school_name"] = df["school_name"].astype(object)
+            df["year"] = df["year"].astype(np.int64)
+            return df
+        
+        if records is None:
+            log = open_log(data_file)
+            if not log.exists():
+                return pd.DataFrame(columns=columns)
+            # 包含预写日志中尚未合并的记录
+            df = log.read_frame(usecols=columns)
+            # 与DataStorage的加载一致：学校名称统一为学校ID，重复的(学校, 年份)保留最后一行
+            df["school_name"] = df["school_name"].map(school_index.canonical)
+            df = df.drop_duplicates(["school_name", "year"], keep="last")
+        else:
+            df = pd.DataFrame([record.to_dict() for record in records], columns=columns)
+        
+        value_columns = [column for column in columns if column not in ("school_name", "year")]
+        df[value_columns] = df[value_columns].apply(pd.to_numeric, errors="coerce")
+        return df
+    
+    @staticmethod
+    def _describe_groups(grouped, percentiles):
+        """
+        一次性计算分组的统计量
+        
+        标准差为总体标准差，与np.std一致；百分位数使用线性插值，与np.percentile一致。
+        
+        Args:
+            grouped: pandas分组对象
+            percentiles (tuple): 需要计算的百分位数（0-100）
+        
+        Returns:
+            pd.DataFrame: 每组一行，列为min、max、avg、median、std、count及pXX
+        """
+        stats = {
+            "min": grouped.min(),
+            "max": grouped.max(),
+            "avg": grouped.mean(),
+            "median": grouped.median(),
+            "std": grouped.std(ddof=0),
+            "count": grouped.count(),
+        }
+        for percentile in percentiles:
+            stats[f"p{percentile:g}"] = grouped.quantile(percentile / 100)
+        return pd.concat(stats, axis=1)
+    
+    @staticmethod
+    def _bulk_statistics(df, value_columns, percentiles):
+        """
+        按(分类, 年份)和学校分组计算统计量
+        
+        Returns:
+            dict: {"category_year": 按(category, year)索引的统计表, "school": 按school_name索引的统计表}
+        """
+        values = value_columns[0] if len(value_columns) == 1 else value_columns
+        by_category = df.merge(DataProcessor._category_membership(), on="school_name", how="inner")
+        
+        result = {
+            "category_year": DataProcessor._describe_groups(by_category.groupby(["category", "year"])[values], percentiles),
+            "school": DataProcessor._describe_groups(df.groupby("school_name")[values], percentiles),
+        }
+        if len(value_columns) > 1:
+            # 多个字段时列为(字段, 统计量)
+            for name, table in result.items():
+                table = table.swaplevel(axis=1)
+                result[name] = table.reindex(columns=pd.MultiIndex.from_product(
+                    [value_columns, table.columns.get_level_values(1).unique()]
+                ))
+        return result
+    
+    @staticmethod
+    def bulk_score_statistics(scores=None, percentiles=(25, 75), snapshot=None):
+        """
+        一次计算所有(分类, 年份)和所有学校的平均分统计
+        
+        与calculate_score_statistics使用相同的口径（基于avg_score），
+        属于多个分类的学校在每个分类中都会被统计。
+        
+        Args:
+            scores (list, optional): AdmissionScore对象列表，如果不提供则使用快照或直接读取数据文件
+            percentiles (tuple): 额外计算的百分位数
+            snapshot (HistorySnapshot, optional): 内存映射的历史数据快照
+        
+        Returns:
+            dict: {"category_year": 按(category, year)索引的统计表, "school": 按school_name索引的统计表}
+        """
+        df = DataProcessor._records_frame(scores, config.SCORE_DATA_FILE, ["school_name", "year", "avg_score"],
+                                          snapshot, "scores")
+        return DataProcessor._bulk_statistics(df, ["avg_score"], percentiles)
+    
+    @staticmethod
+    def bulk_rate_statistics(rates=None, percentiles=(25, 75), snapshot=None):
+        """
+        一次计算所有(分类, 年份)和所有学校的升学率统计
+        
+        Args:
+            rates (list, optional): AdmissionRate对象列表，如果不提供则使用快照或直接读取数据文件
+            percentiles (tuple): 额外计算的百分位数
+            snapshot (HistorySnapshot, optional): 内存映射的历史数据快照
+        
+        Returns:
+            dict: {"category_year": ..., "school": ...}，统计表的列为(c9/985/211, 统计量)
+        """
+        df = DataProcessor._records_frame(rates, config.RATE_DATA_FILE, ["school_name", "year", "c9_rate", "rate_985", "rate_211"],
+                                          snapshot, "rates")
+        df = df.rename(columns={"c9_rate": "c9", "rate_985": "985", "rate_211": "211"})
+        return DataProcessor._bulk_statistics(df, ["c9", "985", "211"], percentiles)
\ No newline at end of file
@@ -0,0 +1,175 @@
+"""
+数据质量检查
+对已存储的数据集进行向量化校验，找出解析失败或明显异常的记录，
+并生成只针对这些记录的重新查询计划
+"""
+import ast
+import os
+import sys
+import pandas as pd
+
+# 添加项目根目录到系统路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from models.storage_log import open_log
+from utils.refresh_scheduler import SCORE_METRIC, RATE_METRIC
+import config
+
+ISSUE_COLUMNS = ["metric", "school_name", "year", "issue"]
+
+class DataQualityChecker:
+    """数据质量检查类"""
+    
+    @staticmethod
+    def _parse_sources(value):
+        """将student_sources字符串解析为字典"""
+        if isinstance(value, dict):
+            return value
+        try:
+            parsed = ast.literal_eval(value)
+            return parsed if isinstance(parsed, dict) else {}
+        except (ValueError, SyntaxError):
+            return {}
+    
+    @staticmethod
+    def _issues(df, mask, metric, issue):
+        """把布尔掩码选中的行转换为问题记录"""
+        selected = df.loc[mask, ["school_name", "year"]].copy()
+        selected.insert(0, "metric", metric)
+        selected["issue"] = issue
+        return selected
+    
+    @staticmethod
+    def _jump_mask(df, columns, threshold, flagged):
+        """
+        按学校计算相邻年份的变化，返回变化超过阈值的行
+        
+        已被其他检查标记的行不参与比较，避免一条错误记录连带标记相邻年份。
+        """
+        ordered = df.loc[~flagged].sort_values(["school_name", "year"])
+        diffs = ordered.groupby("school_name")[columns].diff().abs()
+        year_gap = ordered.groupby("school_name")["year"].diff()
+        jump = (diffs > threshold).any(axis=1) & (year_gap == 1)
+        return jump.reindex(df.index, fill_value=False)
+    
+    @staticmethod
+    def check_scores(df):
+        """
+        校验录取分数数据
+        
+        Args:
+            df (pd.DataFrame): 录取分数数据（DataStorage保存的CSV格式）
+        
+        Returns:
+            pd.DataFrame: 问题记录，列为metric、school_name、year、issue
+        """
+        if df.empty:
+            return pd.DataFrame(columns=ISSUE_COLUMNS)
+        
+        score_columns = ["min_score", "max_score", "avg_score"]
+        scores = df[score_columns].apply(pd.to_numeric, errors="coerce").fillna(0)
+        
+        issues = [
+            DataQualityChecker._issues(df, (scores == 0).any(axis=1), SCORE_METRIC, "分数为0"),
+            DataQualityChecker._issues(df, scores["min_score"] > scores["max_score"], SCORE_METRIC, "最低分高于最高分"),
+            DataQualityChecker._issues(
+                df,
+                (scores > 0).all(axis=1) & ((scores["avg_score"] < scores["min_score"]) | (scores["avg_score"] > scores["max_score"])),
+                SCORE_METRIC,
+                "平均分不在最低分和最高分之间"
+            ),
+        ]
+        
+        if "student_sources" in df.columns:
+            totals = df["student_sources"].map(DataQualityChecker._parse_sources).map(lambda sources: sum(sources.values()))
+            bad_sources = (totals > 0) & ((totals - 100).abs() > config.QUALITY_SOURCE_TOLERANCE)
+            issues.append(DataQualityChecker._issues(df, bad_sources, SCORE_METRIC, "学生来源比例之和偏离100%"))
+        
+        flagged = df.index.isin(pd.concat(issues).index)
+        with_scores = df.assign(**{column: scores[column] for column in score_columns})
+        jumps = DataQualityChecker._jump_mask(with_scores, score_columns, config.QUALITY_MAX_SCORE_JUMP, flagged)
+        issues.append(DataQualityChecker._issues(df, jumps, SCORE_METRIC, "分数同比变化过大"))
+        
+        return pd.concat(issues, ignore_index=True)
+    
+    @staticmethod
+    def check_rates(df):
+        """
+        校验升学率数据
+        
+        Args:
+            df (pd.DataFrame): 升学率数据（DataStorage保存的CSV格式）
+        
+        Returns:
+            pd.DataFrame: 问题记录，列为metric、school_name、year、issue
+        """
+        if df.empty:
+            return pd.DataFrame(columns=ISSUE_COLUMNS)
+        
+        rate_columns = ["c9_rate", "rate_985", "rate_211"]
+        rates = df[rate_columns].apply(pd.to_numeric, errors="coerce").fillna(0)
+        
+        issues = [
+            DataQualityChecker._issues(df, (rates == 0).any(axis=1), RATE_METRIC, "升学率为0"),
+            DataQualityChecker._issues(df, ((rates < 0) | (rates > 100)).any(axis=1), RATE_METRIC, "升学率超出0-100%"),
+            DataQualityChecker._issues(
+                df,
+                (rates["c9_rate"] > rates["rate_985"]) | (rates["rate_985"] > rates["rate_211"]),
+                RATE_METRIC,
+                "升学率不满足C9≤985≤211"
+            ),
+        ]
+        
+        flagged = df.index.isin(pd.concat(issues).index)
+        with_rates = df.assign(**{column: rates[column] for column in rate_columns})
+        jumps = DataQualityChecker._jump_mask(with_rates, rate_columns, config.QUALITY_MAX_RATE_JUMP, flagged)
+        issues.append(DataQualityChecker._issues(df, jumps, RATE_METRIC, "升学率同比变化过大"))
+        
+        return pd.concat(issues, ignore_index=True)
+    
+    @staticmethod
+    def scan():
+        """
+        扫描已存储的录取分数和升学率数据
+        
+        Returns:
+            pd.DataFrame: 所有问题记录
+        """
+        frames = []
+        for data_file, check in ((config.SCORE_DATA_FILE, DataQualityChecker.check_scores),
+                                 (config.RATE_DATA_FILE, DataQualityChecker.check_rates)):
+            log = open_log(data_file)
+            if log.exists():
+                # 预写日志中尚未合并的记录排在后面，同一(学校, 年份)只检查最新的一行
+                frames.append(check(log.read_frame().drop_duplicates(["school_name", "year"], keep="last")))
+        
+        if not frames:
+            return pd.DataFrame(columns=ISSUE_COLUMNS)
+        return pd.concat(frames, ignore_index=True)
+    
+    @staticmethod
+    def build_requery_plan(issues):
+        """
+        根据问题记录生成最小的重新查询计划（每个(指标, 学校, 年份)只查询一次）
+        
+        Args:
+            issues (pd.DataFrame): scan返回的问题记录
+        
+        Returns:
+            list: 刷新项列表，可直接交给RefreshScheduler.execute执行
+        """
+        if issues.empty:
+            return []
+        
+        grouped = issues.groupby(["metric", "school_name", "year"], sort=False)["issue"].agg(list)
+        plan = [
+            {
+                "metric": metric,
+                "school_name": school_name,
+                "year": int(year),
+                "priority": len(reasons),
+                "reasons": reasons
+            }
+            for (metric, school_name, year), reasons in grouped.items()
+        ]
+        plan.sort(key=lambda item: (-item["priority"], -item["year"]))
+        return plan
\ No newline at end of file
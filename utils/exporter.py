@@ -0,0 +1,286 @@
+"""
+流式导出工具
+按固定行数分块读取数据文件并逐块写出，导出大数据集时内存占用保持不变
+"""
+import ast
+import bz2
+import gzip
+import logging
+import lzma
+import os
+import sys
+import pandas as pd
+
+# 添加项目根目录到系统路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import config
+from models.storage_log import open_log
+
+logger = logging.getLogger('exporter')
+
+# 可导出的数据集: 名称 -> (数据文件配置项, 说明)
+DATASETS = {
+    "scores": ("SCORE_DATA_FILE", "录取分数"),
+    "rates": ("RATE_DATA_FILE", "升学率"),
+    "predictions": ("PREDICTION_FILE", "预测结果"),
+    "sources": ("SCORE_DATA_FILE", "学生来源（按区县展开）"),
+}
+FORMATS = ("csv", "jsonl", "parquet")
+SOURCE_COLUMNS = ["school_name", "year", "district", "count"]
+
+# 文本格式的压缩方式: 名称 -> (打开函数, 文件扩展名)
+TEXT_COMPRESSIONS = {
+    "gzip": (gzip.open, ".gz"),
+    "bz2": (bz2.open, ".bz2"),
+    "xz": (lzma.open, ".xz"),
+}
+
+class _TextWriter:
+    """CSV/JSONL分块写出"""
+    
+    def __init__(self, output_file, fmt, compression):
+        opener = TEXT_COMPRESSIONS[compression][0] if compression else open
+        self.file = opener(output_file, "wt", encoding="utf-8", newline="")
+        self.fmt = fmt
+        self.header = True
+    
+    def write(self, chunk):
+        if self.fmt == "csv":
+            chunk.to_csv(self.file, index=False, header=self.header)
+        else:
+            text = chunk.to_json(orient="records", lines=True, force_ascii=False)
+            self.file.write(text if text.endswith("\n") else text + "\n")
+        self.header = False
+    
+    def close(self):
+        self.file.close()
+
+class _ParquetWriter:
+    """Parquet分块写出，每块一个row group（需要安装pyarrow）"""
+    
+    def __init__(self, output_file, compression):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise RuntimeError("导出Parquet需要安装pyarrow: pip install pyarrow")
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.output_file = output_file
+        self.compression = compression or "snappy"
+        self.writer = None
+    
+    def write(self, chunk):
+        if self.writer is None:
+            table = self.pa.Table.from_pandas(chunk, preserve_index=False)
+            self.writer = self.pq.ParquetWriter(self.output_file, table.schema, compression=self.compression)
+        else:
+            # 后续分块按第一块的结构写入，避免某块全为空值时类型推断不一致
+            table = self.pa.Table.from_pandas(chunk, schema=self.writer.schema, preserve_index=False)
+        self.writer.write_table(table)
+    
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+class DataExporter:
+    """流式导出类"""
+    
+    @staticmethod
+    def _parse_sources(value):
+        """将student_sources字符串解析为字典"""
+        try:
+            parsed = ast.literal_eval(value) if isinstance(value, str) else value
+        except (ValueError, SyntaxError):
+            return {}
+        return parsed if isinstance(parsed, dict) else {}
+    
+    @staticmethod
+    def _flatten_sources(chunk):
+        """
+        把录取分数分块中的student_sources展开为每个区县一行
+        
+        Returns:
+            pd.DataFrame: 列为school_name、year、district、count
+        """
+        rows = [
+            (school_name, year, district, count)
+            for school_name, year, sources in zip(chunk["school_name"], chunk["year"], chunk["student_sources"])
+            for district, count in DataExporter._parse_sources(sources).items()
+        ]
+        return pd.DataFrame(rows, columns=SOURCE_COLUMNS)
+    
+    @staticmethod
+    def _data_file(dataset):
+        """数据集对应的数据文件，数据集未知或文件不存在时抛出异常"""
+        if dataset not in DATASETS:
+            raise ValueError(f"未知的数据集: {dataset}，可选 {', '.join(DATASETS)}")
+        
+        data_file = getattr(config, DATASETS[dataset][0])
+        log = open_log(data_file)
+        if log.pending_bytes():
+            # 流式导出只读取数据文件，先把预写日志中尚未合并的记录合并进去
+            log.compact()
+        if not os.path.exists(data_file):
+            raise FileNotFoundError(f"{DATASETS[dataset][1]}数据文件不存在: {data_file}")
+        return data_file
+    
+    @staticmethod
+    def iter_chunks(dataset, chunk_rows=None, columns=None):
+        """
+        分块读取数据集
+        
+        Args:
+            dataset (str): 数据集名称（scores/rates/predictions/sources）
+            chunk_rows (int, optional): 每块的行数，默认使用config.EXPORT_CHUNK_ROWS
+            columns (list, optional): 只保留的列
+        
+        Yields:
+            pd.DataFrame: 数据块
+        """
+        data_file = DataExporter._data_file(dataset)
+        chunk_rows = chunk_rows or config.EXPORT_CHUNK_ROWS
+        usecols = ["school_name", "year", "student_sources"] if dataset == "sources" else None
+        for chunk in pd.read_csv(data_file, chunksize=chunk_rows, usecols=usecols):
+            if dataset == "sources":
+                chunk = DataExporter._flatten_sources(chunk)
+            if columns:
+                missing = [column for column in columns if column not in chunk.columns]
+                if missing:
+                    raise ValueError(f"{DATASETS[dataset][1]}没有这些列: {', '.join(missing)}")
+                chunk = chunk[columns]
+            yield chunk
+    
+    @staticmethod
+    def default_output_file(dataset, fmt="csv", compression=None):
+        """默认的导出文件路径"""
+        suffix = f".{fmt}"
+        if compression and fmt != "parquet":
+            suffix += TEXT_COMPRESSIONS[compression][1]
+        return os.path.join(config.EXPORT_DIR, f"{dataset}{suffix}")
+    
+    @staticmethod
+    def _check_format(fmt, compression):
+        """检查导出格式和压缩方式"""
+        if fmt not in FORMATS:
+            raise ValueError(f"未知的导出格式: {fmt}，可选 {', '.join(FORMATS)}")
+        if compression and fmt != "parquet" and compression not in TEXT_COMPRESSIONS:
+            raise ValueError(f"{fmt}不支持的压缩方式: {compression}，可选 {', '.join(TEXT_COMPRESSIONS)}")
+    
+    @staticmethod
+    def _open_writer(output_file, fmt, compression):
+        """按格式创建分块写出器"""
+        if fmt == "parquet":
+            return _ParquetWriter(output_file, compression)
+        return _TextWriter(output_file, fmt, compression)
+    
+    @staticmethod
+    def write_chunks(chunks, output_file, fmt="csv", compression=None, columns=None):
+        """
+        逐块写出DataFrame分块，内存中只保留当前一块
+        
+        Args:
+            chunks (iterable): DataFrame分块
+            output_file (str): 输出文件路径
+            fmt (str): 导出格式（csv/jsonl/parquet）
+            compression (str, optional): 压缩方式，同export
+            columns (list, optional): 输出的列，默认使用第一块的列；各块按其对齐，缺少的列为空值
+        
+        Returns:
+            dict: {"output_file": 输出文件路径, "rows": 行数, "chunks": 块数}
+        """
+        DataExporter._check_format(fmt, compression)
+        os.makedirs(os.path.dirname(output_file) or ".", exist_ok=True)
+        writer = DataExporter._open_writer(output_file, fmt, compression)
+        rows = 0
+        count = 0
+        try:
+            for chunk in chunks:
+                if columns is None:
+                    columns = list(chunk.columns)
+                writer.write(chunk.reindex(columns=columns))
+                rows += len(chunk)
+                count += 1
+            if count == 0 and columns is not None:
+                writer.write(pd.DataFrame(columns=columns))
+        except Exception:
+            # 不保留写了一半的文件
+            writer.close()
+            if os.path.exists(output_file):
+                os.remove(output_file)
+            raise
+        writer.close()
+        return {"output_file": output_file, "rows": rows, "chunks": count}
+    
+    @staticmethod
+    def write_records(records, output_file, fmt="csv", compression=None, columns=None, chunk_rows=None):
+        """
+        把记录字典分块写出（如逐个生成的预测结果），不先合并为一个DataFrame
+        
+        Args:
+            records (iterable): 记录字典
+            output_file (str): 输出文件路径
+            fmt (str): 导出格式（csv/jsonl/parquet）
+            compression (str, optional): 压缩方式，同export
+            columns (list, optional): 输出的列，记录中缺少的列为空值
+            chunk_rows (int, optional): 每块的行数，默认使用config.EXPORT_CHUNK_ROWS
+        
+        Returns:
+            dict: {"output_file": 输出文件路径, "rows": 行数, "chunks": 块数}
+        """
+        chunk_rows = chunk_rows or config.EXPORT_CHUNK_ROWS
+        
+        def chunks():
+            batch = []
+            for record in records:
+                batch.append(record)
+                if len(batch) >= chunk_rows:
+                    yield pd.DataFrame(batch, columns=columns)
+                    batch = []
+            if batch:
+                yield pd.DataFrame(batch, columns=columns)
+        
+        return DataExporter.write_chunks(chunks(), output_file, fmt, compression, columns)
+    
+    @staticmethod
+    def write_frame(frame, output_file, fmt="csv", compression=None):
+        """
+        把内存中已计算好的DataFrame（如预测矩阵）写出为导出格式
+        
+        Args:
+            frame (pd.DataFrame): 数据
+            output_file (str): 输出文件路径
+            fmt (str): 导出格式（csv/jsonl/parquet）
+            compression (str, optional): 压缩方式，同export
+        
+        Returns:
+            str: 输出文件路径
+        """
+        return DataExporter.write_chunks([frame], output_file, fmt, compression)["output_file"]
+    
+    @staticmethod
+    def export(dataset, output_file=None, fmt="csv", compression=None, columns=None, chunk_rows=None):
+        """
+        流式导出数据集
+        
+        Args:
+            dataset (str): 数据集名称（scores/rates/predictions/sources）
+            output_file (str, optional): 输出文件路径，默认写入config.EXPORT_DIR
+            fmt (str): 导出格式（csv/jsonl/parquet）
+            compression (str, optional): 压缩方式，CSV/JSONL可选gzip、bz2、xz，
+                Parquet为列压缩编码（如snappy、gzip、zstd）
+            columns (list, optional): 只导出的列
+            chunk_rows (int, optional): 每块的行数
+        
+        Returns:
+            dict: {"output_file": 输出文件路径, "rows": 行数, "chunks": 块数}
+        """
+        DataExporter._check_format(fmt, compression)
+        DataExporter._data_file(dataset)
+        
+        output_file = output_file or DataExporter.default_output_file(dataset, fmt, compression)
+        result = DataExporter.write_chunks(DataExporter.iter_chunks(dataset, chunk_rows, columns), output_file, fmt,
+                                           compression)
+        
+        logger.info(f"已导出{DATASETS[dataset][1]} {result['rows']} 行到 {output_file}")
+        return result
@@ -0,0 +1,349 @@
+"""
+预测模型
+注册可选的分数预测模型（线性、稳健回归、阻尼趋势、二次多项式和集成），
+用留出最后一年的回测为每所学校自动选择误差最小的模型；多所学校时用进程池并行评估
+"""
+import logging
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+# 添加项目根目录到系统路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import config
+
+logger = logging.getLogger('forecast_models')
+
+# 预测的分数序列
+SERIES = ("min_score", "max_score", "avg_score")
+
+# 一次合并拟合的最多学校数
+GROUP_CHUNK_SCHOOLS = 250
+
+# 模型注册表: 名称 -> (拟合并预测的函数, 所需的最少数据点)
+MODELS = {}
+
+def register(name, min_points):
+    """
+    注册预测模型
+    
+    被注册的函数签名为 f(years, values, target_years) -> 预测值，其中years为按升序排列的一维数组，
+    values的形状为(序列数, 年数)，多个分数序列一次拟合，返回形状为(序列数, 预测年数)。
+    
+    Args:
+        name (str): 模型名称
+        min_points (int): 拟合所需的最少数据点
+    """
+    def decorator(func):
+        MODELS[name] = (func, min_points)
+        return func
+    return decorator
+
+def _line(years, values, weights=None):
+    """
+    （加权）最小二乘直线的闭式解，逐行拟合
+    
+    Returns:
+        tuple: (斜率, 加权平均值, 加权平均年份)，形状均为(序列数, 1)，直线为 平均值 + 斜率 * (年份 - 平均年份)
+    """
+    if weights is None:
+        weights = np.ones_like(values)
+    total = weights.sum(axis=-1, keepdims=True)
+    mean_x = (weights * years).sum(axis=-1, keepdims=True) / total
+    mean_y = (weights * values).sum(axis=-1, keepdims=True) / total
+    dx = years - mean_x
+    sxx = (weights * dx * dx).sum(axis=-1, keepdims=True)
+    sxy = (weights * dx * (values - mean_y)).sum(axis=-1, keepdims=True)
+    slope = np.divide(sxy, sxx, out=np.zeros_like(sxy), where=sxx > 0)
+    return slope, mean_y, mean_x
+
+@register("linear", min_points=2)
+def linear(years, values, target_years):
+    """最小二乘直线"""
+    slope, mean_y, mean_x = _line(years, values)
+    return mean_y + slope * (target_years - mean_x)
+
+@register("huber", min_points=3)
+def huber(years, values, target_years, epsilon=1.35, iterations=20, tolerance=1e-3):
+    """Huber稳健回归（迭代重加权最小二乘），个别异常年份对趋势的影响较小"""
+    weights = np.ones_like(values)
+    slope, mean_y, mean_x = _line(years, values)
+    # 只对权重变化仍超过tolerance的行继续迭代
+    active = np.arange(len(values))
+    for _ in range(iterations):
+        residuals = values[active] - (mean_y[active] + slope[active] * (years - mean_x[active]))
+        scale = np.median(np.abs(residuals), axis=-1, keepdims=True) / 0.6745
+        ratio = np.abs(residuals) / np.maximum(epsilon * scale, 1e-9)
+        new_weights = np.where(ratio <= 1, 1.0, 1.0 / np.maximum(ratio, 1e-12))
+        changed = (np.abs(new_weights - weights[active]) > tolerance).any(axis=-1)
+        active = active[changed]
+        if not len(active):
+            break
+        weights[active] = new_weights[changed]
+        slope[active], mean_y[active], mean_x[active] = _line(years, values[active], weights[active])
+    return mean_y + slope * (target_years - mean_x)
+
+@register("damped", min_points=2)
+def damped(years, values, target_years):
+    """阻尼趋势：从最后一年的拟合值出发，斜率每年按config.PREDICTION_DAMPING衰减"""
+    slope, mean_y, mean_x = _line(years, values)
+    last_year = years[-1]
+    phi = config.PREDICTION_DAMPING
+    horizons = np.maximum(target_years - last_year, 0)
+    # phi + phi^2 + ... + phi^h，即逐年衰减后的累计斜率倍数
+    steps = phi * (1 - phi ** horizons) / (1 - phi) if phi < 1 else horizons
+    return mean_y + slope * (last_year - mean_x) + slope * steps
+
+@register("poly2", min_points=4)
+def poly2(years, values, target_years):
+    """二次多项式"""
+    center = years.mean()
+    coefficients = np.linalg.lstsq(np.vander(years - center, 3), values.T, rcond=None)[0]
+    return (np.vander(target_years - center, 3) @ coefficients).T
+
+@register("ensemble", min_points=2)
+def ensemble(years, values, target_years):
+    """数据点足够的其他模型的平均值"""
+    predictions = [
+        func(years, values, target_years)
+        for name, (func, min_points) in MODELS.items()
+        if name != "ensemble" and len(years) >= min_points
+    ]
+    return np.mean(predictions, axis=0)
+
+def backtest(name, years, values):
+    """
+    留出最后一年的回测：用之前的年份拟合，预测最后一年
+    
+    Args:
+        name (str): 模型名称
+        years (array): 年份（升序）
+        values (array): 形状为(序列数, 年数)的数值
+    
+    Returns:
+        array: 每个序列的绝对误差，数据点不足时返回None
+    """
+    func, min_points = MODELS[name]
+    if len(years) - 1 < min_points:
+        return None
+    predicted = func(years[:-1], values[:, :-1], years[-1:])[:, 0]
+    return np.abs(predicted - values[:, -1])
+
+def _r2(fitted, values):
+    """每个序列在训练数据上的R²"""
+    total = ((values - values.mean(axis=-1, keepdims=True)) ** 2).sum(axis=-1)
+    residual = ((values - fitted) ** 2).sum(axis=-1)
+    return np.where(total > 0, 1.0 - residual / np.where(total > 0, total, 1.0), 1.0)
+
+def bootstrap_intervals(func, years, values, target_years, resamples, level, rng, max_elements=4_000_000):
+    """
+    残差自助法（bootstrap）预测区间
+    
+    以模型在历史年份上的拟合值为中心，对残差有放回地重抽样，生成resamples条模拟历史序列，对所有序列的所有重抽样
+    一次调用模型重新拟合，再加上一个重抽样残差作为预测年份本身的波动，取分位数作为区间。
+    为控制内存，按max_elements分块处理序列。
+    
+    Args:
+        func (callable): 已注册的模型函数
+        years (array): 年份（升序）
+        values (array): 形状为(序列数, 年数)的数值
+        target_years (array): 预测年份
+        resamples (int): 每个序列的重抽样次数
+        level (float): 区间的覆盖概率，如0.8表示10%到90%分位数
+        rng (numpy.random.Generator): 随机数生成器
+        max_elements (int): 每块模拟数据的元素数上限
+    
+    Returns:
+        tuple: (下限, 上限)，形状均为(序列数, 预测年数)
+    """
+    rows, n = values.shape
+    fitted = func(years, values, years)
+    # 残差取自最简单的直线模型并按其自由度放大：按回测误差选出的较灵活模型在历史年份上拟合得过紧，
+    # 用它自己的残差会使区间明显偏窄
+    residuals = (values - linear(years, values, years)) * np.sqrt(n / max(n - 2, 1))
+    quantiles = [(1 - level) / 2 * 100, (1 + level) / 2 * 100]
+    
+    lower = np.empty((rows, len(target_years)))
+    upper = np.empty((rows, len(target_years)))
+    block = max(1, max_elements // (resamples * n))
+    for start in range(0, rows, block):
+        part = slice(start, min(start + block, rows))
+        size = part.stop - part.start
+        row_index = np.arange(size)[:, None, None]
+        picks = rng.integers(0, n, size=(size, resamples, n))
+        simulated = fitted[part][:, None, :] + residuals[part][row_index, picks]
+        predicted = func(years, simulated.reshape(size * resamples, n), target_years)
+        predicted = predicted.reshape(size, resamples, len(target_years))
+        noise = residuals[part][row_index, rng.integers(0, n, size=(size, resamples, len(target_years)))]
+        lower[part], upper[part] = np.percentile(predicted + noise, quantiles, axis=1)
+    return lower, upper
+
+def _forecast_group(years, names, values, target_year, model=None, resamples=0):
+    """
+    预测年份相同的一组学校
+    
+    把所有学校的所有分数序列堆叠成一个矩阵，每个模型对整组只拟合一次，避免逐校调用numpy的开销。
+    
+    Args:
+        years (array): 共同的年份（升序）
+        names (list): 序列名
+        values (array): 形状为(学校数, 序列数, 年数)的数值
+        target_year (int or list): 预测年份，或多个预测年份
+        model (str, optional): 指定模型名称
+        resamples (int): 预测区间的重抽样次数，0表示不计算区间
+    
+    Returns:
+        list: 每所学校一个forecast结果
+    """
+    schools, series_count, _ = values.shape
+    rows = values.reshape(schools * series_count, len(years))
+    candidate_names = [model] if model else list(MODELS)
+    
+    # 每个候选模型在每所学校上的回测误差（各序列平均），形状为(模型数, 学校数)
+    backtested = []
+    for name in candidate_names:
+        errors = backtest(name, years, rows)
+        if errors is not None:
+            backtested.append((name, errors.reshape(schools, series_count).mean(axis=1)))
+    
+    if model:
+        chosen = np.zeros(schools, dtype=int)
+        choices = [model]
+    elif backtested:
+        # argmin在误差相同时取第一个，即注册顺序靠前、更简单的模型
+        chosen = np.argmin(np.array([errors for _, errors in backtested]), axis=0)
+        choices = [name for name, _ in backtested]
+    else:
+        chosen = np.zeros(schools, dtype=int)
+        choices = ["linear"]
+    
+    targets = np.atleast_1d(np.asarray(target_year, dtype=float))
+    # 单个预测年份时结果为标量，多个时为与预测年份对齐的数组
+    pick = (lambda array: float(array[0])) if np.ndim(target_year) == 0 else (lambda array: array)
+    predictions = {}
+    r2 = {}
+    intervals = {}
+    with_intervals = resamples > 0 and len(years) >= config.PREDICTION_INTERVAL_MIN_YEARS
+    rng = np.random.default_rng(config.PREDICTION_BOOTSTRAP_SEED)
+    for index in np.unique(chosen):
+        name = choices[index]
+        func, min_points = MODELS[name]
+        if len(years) < min_points:
+            raise ValueError(f"模型 {name} 至少需要 {min_points} 年数据")
+        predictions[name] = func(years, rows, targets).reshape(schools, series_count, len(targets))
+        r2[name] = _r2(func(years, rows, years), rows).reshape(schools, series_count).mean(axis=1)
+        if with_intervals:
+            # 只对选用该模型的学校计算区间
+            selected = np.repeat(chosen == index, series_count)
+            lower, upper = bootstrap_intervals(func, years, rows[selected], targets, resamples,
+                                               config.PREDICTION_INTERVAL_LEVEL, rng)
+            shape = (-1, series_count, len(targets))
+            intervals[name] = dict(zip(np.flatnonzero(chosen == index), zip(lower.reshape(shape), upper.reshape(shape))))
+    
+    results = []
+    for school in range(schools):
+        name = choices[chosen[school]]
+        candidates = {candidate: float(errors[school]) for candidate, errors in backtested}
+        result = {
+            "model": name,
+            "predictions": {series: pick(value) for series, value in zip(names, predictions[name][school])},
+            "backtest_mae": candidates.get(name),
+            "candidates": candidates,
+            "r2": float(r2[name][school]),
+            "intervals": None,
+        }
+        if with_intervals:
+            lower, upper = intervals[name][school]
+            result["intervals"] = {series: (pick(low), pick(high)) for series, low, high in zip(names, lower, upper)}
+        results.append(result)
+    return results
+
+def _check_model(model):
+    """检查指定的模型名称"""
+    if model and model not in MODELS:
+        raise ValueError(f"未知的预测模型: {model}，可选 {', '.join(MODELS)}")
+
+def forecast(years, series, target_year, model=None, resamples=0):
+    """
+    为一所学校选择模型并预测
+    
+    model为None时，对每个候选模型做留出最后一年的回测，取各分数序列平均绝对误差最小的模型
+    （误差相同时取注册顺序靠前、更简单的模型）；数据不足以回测时使用线性模型。
+    
+    Args:
+        years (array): 年份（升序）
+        series (dict): {序列名: 数值数组}，与years对齐
+        target_year (int or list): 预测年份；传入多个年份时预测值和区间为与之对齐的数组
+        model (str, optional): 指定模型名称
+        resamples (int): 预测区间的重抽样次数，0表示不计算区间
+    
+    Returns:
+        dict: {"model", "predictions": {序列名: 预测值}, "backtest_mae": 所选模型的回测误差或None,
+               "candidates": {模型: 回测误差}, "r2": 训练数据上的平均R²,
+               "intervals": {序列名: (下限, 上限)}，未计算或年份少于config.PREDICTION_INTERVAL_MIN_YEARS时为None}
+    """
+    _check_model(model)
+    names = list(series)
+    values = np.array([[series[name] for name in names]], dtype=float)
+    return _forecast_group(np.asarray(years, dtype=float), names, values, target_year, model, resamples)[0]
+
+def _forecast_chunk(groups, target_year, model, resamples=0):
+    """进程池中执行：预测若干组学校，一组出错不影响其他组"""
+    results = []
+    for years, names, keys, values in groups:
+        try:
+            results.extend(zip(keys, _forecast_group(years, names, values, target_year, model, resamples)))
+        except Exception as e:
+            results.extend((key, {"error": str(e)}) for key in keys)
+    return results
+
+def forecast_many(tasks, target_year, model=None, workers=None, resamples=0):
+    """
+    批量预测多所学校
+    
+    年份和序列相同的学校合并为一组一次拟合；任务数达到config.PREDICTION_PARALLEL_MIN_TASKS时
+    把各组分块提交到进程池，否则在当前进程中计算（少量学校时进程启动的开销大于计算本身）。
+    
+    Args:
+        tasks (list): [(键, 年份数组, {序列名: 数值数组})]
+        target_year (int or list): 预测年份，或多个预测年份
+        model (str, optional): 指定模型，None表示自动选择
+        workers (int, optional): 进程数，默认使用config.PREDICTION_WORKERS（None表示CPU核数）
+        resamples (int): 预测区间的重抽样次数，0表示不计算区间
+    
+    Returns:
+        dict: {键: forecast的结果，出错时为{"error": 说明}}
+    """
+    _check_model(model)
+    results = {}
+    grouped = {}
+    for key, years, series in tasks:
+        years = np.asarray(years, dtype=float)
+        names = tuple(series)
+        if any(len(series[name]) != len(years) for name in names):
+            results[key] = {"error": "分数序列与年份数量不一致"}
+            continue
+        group = grouped.setdefault((tuple(years), names), ([], []))
+        group[0].append(key)
+        group[1].append([series[name] for name in names])
+    
+    # 组太大时按固定学校数拆开，使进程池能分到多块；块的划分与进程数无关，串行和并行的区间完全一致
+    groups = []
+    for (years, names), (keys, values) in grouped.items():
+        values = np.array(values, dtype=float)
+        for i in range(0, len(keys), GROUP_CHUNK_SCHOOLS):
+            groups.append((np.array(years), list(names), keys[i:i + GROUP_CHUNK_SCHOOLS], values[i:i + GROUP_CHUNK_SCHOOLS]))
+    
+    workers = workers or config.PREDICTION_WORKERS or os.cpu_count() or 1
+    
+    if workers <= 1 or len(tasks) < config.PREDICTION_PARALLEL_MIN_TASKS:
+        results.update(_forecast_chunk(groups, target_year, model, resamples))
+        return results
+    
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for chunk_results in executor.map(_forecast_chunk, [[group] for group in groups],
+                                          [target_year] * len(groups), [model] * len(groups),
+                                          [resamples] * len(groups)):
+            results.update(chunk_results)
+    return results
@@ -0,0 +1,119 @@
+"""
+日志工具
+提供基于队列的非阻塞日志配置，日志文件按大小或时间轮转
+"""
+import atexit
+import logging
+import logging.handlers
+import queue
+import random
+import os
+import sys
+
+# 添加项目根目录到系统路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import config
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# 全局队列监听器，整个进程只启动一次
+_listener = None
+
+class SamplingFilter(logging.Filter):
+    """按比例采样日志记录的过滤器，用于高频的单请求日志"""
+    
+    def __init__(self, sample_rate, max_level=logging.INFO):
+        """
+        初始化采样过滤器
+        
+        Args:
+            sample_rate (float): 采样比例（0-1），1表示全部保留
+            max_level (int): 参与采样的最高日志级别，高于该级别的日志总是保留
+        """
+        super().__init__()
+        self.sample_rate = sample_rate
+        self.max_level = max_level
+    
+    def filter(self, record):
+        """判断是否保留该条日志"""
+        if record.levelno > self.max_level:
+            return True
+        if self.sample_rate >= 1:
+            return True
+        return random.random() < self.sample_rate
+
+def _create_file_handler(log_file):
+    """
+    根据配置创建带轮转功能的文件处理器
+    
+    Args:
+        log_file (str): 日志文件路径
+    
+    Returns:
+        logging.Handler: 文件处理器
+    """
+    if config.LOG_ROTATION == "time":
+        handler = logging.handlers.TimedRotatingFileHandler(
+            log_file,
+            when=config.LOG_ROTATION_WHEN,
+            backupCount=config.LOG_BACKUP_COUNT,
+            encoding='utf-8'
+        )
+    else:
+        handler = logging.handlers.RotatingFileHandler(
+            log_file,
+            maxBytes=config.LOG_MAX_BYTES,
+            backupCount=config.LOG_BACKUP_COUNT,
+            encoding='utf-8'
+        )
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    return handler
+
+def setup_logging(level=None, log_file=None):
+    """
+    配置全局日志（应在程序入口处调用一次）
+    
+    业务线程只把日志记录放入内存队列，由后台监听线程负责写文件，
+    避免并发采集时各线程阻塞在文件I/O上。
+    
+    Args:
+        level (str, optional): 日志级别，默认使用config.LOG_LEVEL
+        log_file (str, optional): 日志文件路径，默认使用config.LOG_FILE
+    
+    Returns:
+        logging.handlers.QueueListener: 队列监听器
+    """
+    global _listener
+    
+    if _listener is not None:
+        return _listener
+    
+    level = level or config.LOG_LEVEL
+    log_file = log_file or config.LOG_FILE
+    
+    log_queue = queue.SimpleQueue()
+    file_handler = _create_file_handler(log_file)
+    
+    root_logger = logging.getLogger()
+    root_logger.setLevel(getattr(logging, level))
+    root_logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    
+    # 对单请求日志进行采样，降低热点路径的日志开销
+    for logger_name in config.LOG_SAMPLED_LOGGERS:
+        logging.getLogger(logger_name).addFilter(SamplingFilter(config.LOG_REQUEST_SAMPLE_RATE))
+    
+    _listener = logging.handlers.QueueListener(log_queue, file_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+    
+    return _listener
+
+def shutdown_logging():
+    """停止队列监听器并刷新剩余日志"""
+    global _listener
+    
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
\ No newline at end of file
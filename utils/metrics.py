@@ -0,0 +1,340 @@
+"""
+指标统计工具
+提供计数器和直方图，用于记录爬虫请求的耗时和结果，
+支持导出为Prometheus文本格式或JSON快照
+"""
+import json
+import os
+import sys
+import threading
+import time
+
+# 添加项目根目录到系统路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import config
+
+def _label_key(labels):
+    """将标签字典转换为可哈希的有序元组"""
+    return tuple(sorted((labels or {}).items()))
+
+def _format_labels(key, extra=None):
+    """将标签元组格式化为Prometheus标签字符串"""
+    items = list(key) + list(extra or [])
+    if not items:
+        return ""
+    parts = []
+    for name, value in items:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{name}="{value}"')
+    return "{" + ",".join(parts) + "}"
+
+class Counter:
+    """按标签分组的计数器"""
+    
+    def __init__(self, name, description):
+        """
+        初始化计数器
+        
+        Args:
+            name (str): 指标名称
+            description (str): 指标说明
+        """
+        self.name = name
+        self.description = description
+        self._values = {}
+        self._lock = threading.Lock()
+    
+    def inc(self, amount=1, **labels):
+        """增加计数"""
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+    
+    def get(self, **labels):
+        """获取指定标签的计数值"""
+        with self._lock:
+            return self._values.get(_label_key(labels), 0)
+    
+    def total(self, **labels):
+        """获取包含指定标签的所有分组的计数之和"""
+        wanted = set(labels.items())
+        with self._lock:
+            return sum(value for key, value in self._values.items() if wanted <= set(key))
+    
+    def reset(self):
+        """清空计数"""
+        with self._lock:
+            self._values.clear()
+    
+    def to_prometheus(self):
+        """导出为Prometheus文本格式"""
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+    
+    def to_dict(self):
+        """导出为字典"""
+        with self._lock:
+            return [{"labels": dict(key), "value": value} for key, value in sorted(self._values.items())]
+
+class Histogram:
+    """按标签分组的直方图"""
+    
+    def __init__(self, name, description, buckets):
+        """
+        初始化直方图
+        
+        Args:
+            name (str): 指标名称
+            description (str): 指标说明
+            buckets (list): 桶的上界列表（升序）
+        """
+        self.name = name
+        self.description = description
+        self.buckets = sorted(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+    
+    def observe(self, value, **labels):
+        """记录一个观测值"""
+        key = _label_key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+                self._series[key] = series
+            
+            index = len(self.buckets)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    index = i
+                    break
+            
+            series["counts"][index] += 1
+            series["sum"] += value
+            series["count"] += 1
+    
+    def _merged(self, labels):
+        """合并包含指定标签的所有分组"""
+        wanted = set(labels.items())
+        counts = [0] * (len(self.buckets) + 1)
+        total_sum = 0.0
+        total_count = 0
+        with self._lock:
+            for key, series in self._series.items():
+                if wanted <= set(key):
+                    counts = [a + b for a, b in zip(counts, series["counts"])]
+                    total_sum += series["sum"]
+                    total_count += series["count"]
+        return counts, total_sum, total_count
+    
+    def quantile(self, q, **labels):
+        """
+        根据桶分布估算分位数（桶内线性插值）
+        
+        Args:
+            q (float): 分位点（0-1）
+        
+        Returns:
+            float: 估算的分位数，没有观测值时返回None
+        """
+        counts, _, total_count = self._merged(labels)
+        if total_count == 0:
+            return None
+        
+        rank = q * total_count
+        cumulative = 0
+        lower = 0.0
+        for i, count in enumerate(counts):
+            upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+            if count and cumulative + count >= rank:
+                return lower + (upper - lower) * (rank - cumulative) / count
+            cumulative += count
+            lower = upper
+        return self.buckets[-1]
+    
+    def count(self, **labels):
+        """获取观测次数"""
+        return self._merged(labels)[2]
+    
+    def mean(self, **labels):
+        """获取观测值的平均值"""
+        _, total_sum, total_count = self._merged(labels)
+        return total_sum / total_count if total_count else None
+    
+    def reset(self):
+        """清空观测值"""
+        with self._lock:
+            self._series.clear()
+    
+    def to_prometheus(self):
+        """导出为Prometheus文本格式"""
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, series["counts"]):
+                    cumulative += count
+                    lines.append(f"{self.name}_bucket{_format_labels(key, [('le', bound)])} {cumulative}")
+                lines.append(f"{self.name}_bucket{_format_labels(key, [('le', '+Inf')])} {series['count']}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {series['sum']}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {series['count']}")
+        return lines
+    
+    def to_dict(self):
+        """导出为字典"""
+        with self._lock:
+            return [
+                {
+                    "labels": dict(key),
+                    "buckets": dict(zip([str(b) for b in self.buckets] + ["+Inf"], series["counts"])),
+                    "sum": series["sum"],
+                    "count": series["count"]
+                }
+                for key, series in sorted(self._series.items())
+            ]
+
+class MetricsRegistry:
+    """指标注册表，集中管理所有计数器和直方图"""
+    
+    def __init__(self):
+        """初始化指标注册表"""
+        self._metrics = {}
+        self._lock = threading.Lock()
+    
+    def counter(self, name, description):
+        """获取或创建计数器"""
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = Counter(name, description)
+            return self._metrics[name]
+    
+    def histogram(self, name, description, buckets):
+        """获取或创建直方图"""
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = Histogram(name, description, buckets)
+            return self._metrics[name]
+    
+    def reset(self):
+        """清空所有指标的数据"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            metric.reset()
+    
+    def to_prometheus(self):
+        """
+        导出所有指标为Prometheus文本格式
+        
+        Returns:
+            str: Prometheus文本格式的指标
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.to_prometheus())
+        return "\n".join(lines) + "\n"
+    
+    def to_json(self):
+        """
+        导出所有指标为JSON快照
+        
+        Returns:
+            str: JSON字符串
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        snapshot = {
+            "timestamp": time.time(),
+            "metrics": {metric.name: metric.to_dict() for metric in metrics}
+        }
+        return json.dumps(snapshot, ensure_ascii=False, indent=2)
+    
+    def export(self, output_dir=None):
+        """
+        将指标写入文件（Prometheus文本和JSON快照各一份）
+        
+        Args:
+            output_dir (str, optional): 输出目录，默认使用config.METRICS_OUTPUT_DIR
+        
+        Returns:
+            tuple: (Prometheus文件路径, JSON文件路径)
+        """
+        output_dir = output_dir or config.METRICS_OUTPUT_DIR
+        os.makedirs(output_dir, exist_ok=True)
+        
+        prom_file = os.path.join(output_dir, "metrics.prom")
+        json_file = os.path.join(output_dir, "metrics.json")
+        
+        with open(prom_file, "w", encoding="utf-8") as f:
+            f.write(self.to_prometheus())
+        with open(json_file, "w", encoding="utf-8") as f:
+            f.write(self.to_json())
+        
+        return prom_file, json_file
+
+# 全局指标注册表
+metrics = MetricsRegistry()
+
+# 爬虫层的指标
+REQUEST_LATENCY = metrics.histogram(
+    "scraper_request_duration_seconds",
+    "单次查询的总耗时（含重试）",
+    config.METRICS_LATENCY_BUCKETS
+)
+REQUESTS_TOTAL = metrics.counter("scraper_requests_total", "查询次数（按结果分组）")
+RETRIES_TOTAL = metrics.counter("scraper_retries_total", "查询重试次数")
+ERRORS_TOTAL = metrics.counter("scraper_errors_total", "查询错误次数（按错误码分组）")
+TOKENS_TOTAL = metrics.counter("scraper_tokens_total", "响应usage中的token用量")
+CACHE_REQUESTS_TOTAL = metrics.counter("scraper_cache_requests_total", "响应缓存查找次数（hit/miss/stale）")
+CIRCUIT_REJECTIONS_TOTAL = metrics.counter("scraper_circuit_rejections_total", "熔断器打开期间被直接拒绝的查询次数")
+BACKEND_REQUESTS_TOTAL = metrics.counter("scraper_backend_requests_total", "各后端的请求次数（按结果分组）")
+BATCH_ITEMS_TOTAL = metrics.counter("scraper_batch_items_total", "批量任务中各条目的结果（success/error/missing/budget_exhausted）")
+BUDGET_REJECTIONS_TOTAL = metrics.counter("scraper_budget_rejections_total", "token预算用完后被拒绝的查询次数")
+HEDGES_TOTAL = metrics.counter("scraper_hedges_total", "对冲请求次数（sent/won/budget_exhausted/reserve_rejected）")
+
+# 本地HTTP查询服务的指标
+HTTP_REQUESTS_TOTAL = metrics.counter("http_requests_total", "HTTP查询服务的请求次数（按接口和状态码分组）")
+HTTP_CACHE_TOTAL = metrics.counter("http_response_cache_total", "HTTP响应缓存查找次数（hit/miss）")
+
+def format_summary():
+    """
+    生成爬虫请求指标的汇总表
+    
+    Returns:
+        str: 汇总表文本
+    """
+    groups = set()
+    for item in REQUESTS_TOTAL.to_dict() + CACHE_REQUESTS_TOTAL.to_dict():
+        labels = item["labels"]
+        groups.add((labels.get("mode", ""), labels.get("category", "")))
+    
+    if not groups:
+        return "本次运行没有发出查询请求"
+    
+    header = (f"{'查询模式':<8}{'学校分类':<10}{'请求':>6}{'成功':>6}{'重试':>6}{'错误':>6}{'缓存命中':>8}"
+              f"{'p50(s)':>9}{'p95(s)':>9}{'p99(s)':>9}{'tokens':>9}")
+    lines = [header, "-" * 90]
+    
+    for mode, category in sorted(groups):
+        labels = {"mode": mode, "category": category}
+        requests_count = REQUESTS_TOTAL.total(**labels)
+        success = REQUESTS_TOTAL.total(outcome="success", **labels)
+        quantiles = [REQUEST_LATENCY.quantile(q, **labels) for q in (0.5, 0.95, 0.99)]
+        quantile_text = "".join(f"{q:>9.2f}" if q is not None else f"{'-':>9}" for q in quantiles)
+        lines.append(
+            f"{mode:<8}{category:<10}{requests_count:>6}{success:>6}"
+            f"{RETRIES_TOTAL.total(**labels):>6}{ERRORS_TOTAL.total(**labels):>6}"
+            f"{CACHE_REQUESTS_TOTAL.total(result='hit', **labels):>8}"
+            f"{quantile_text}{TOKENS_TOTAL.total(type='total_tokens', **labels):>9}"
+        )
+    
+    rejected = BUDGET_REJECTIONS_TOTAL.total()
+    if rejected:
+        lines.append(f"token预算已用完，{rejected} 次查询未发送")
+    
+    return "\n".join(lines)
\ No newline at end of file
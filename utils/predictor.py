@@ -1,40 +1,247 @@
 """
 预测工具
-提供2026年录取分数线预测功能
+提供2026年录取分数线预测功能，以及多所学校、多个年份的预测矩阵
 """
 import numpy as np
-from sklearn.linear_model import LinearRegression
 import pandas as pd
+import logging
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
 
 # 添加项目根目录到系统路径
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from models.change_feed import change_feed
 from models.data_model import AdmissionScore, DataStorage
+from models.snapshot import HistorySnapshot
+from models.school_index import school_index
+from utils.exporter import DataExporter
+from utils.forecast_models import SERIES, forecast, forecast_many
+from utils.profiler import phase, profiled
 import config
 
+logger = logging.getLogger('predictor')
+
+# 预测结果文件的列（_build_prediction给出的字段，无法预测时只有基本字段和error）
+PREDICTION_COLUMNS = (
+    ["school_name", "year", "min_score", "max_score", "avg_score", "confidence", "r2_score", "model", "backtest_mae",
+     "interval_level"]
+    + [f"{name}_{bound}" for name in SERIES for bound in ("lower", "upper")]
+    + ["error"]
+)
+
+class PredictionMatrix:
+    """
+    学校 × 年份 × 指标的预测矩阵
+    
+    values、lower、upper的形状均为(学校数, 年份数, 指标数)，无法预测的学校为NaN。
+    """
+    
+    def __init__(self, schools, years, metrics, values, lower=None, upper=None, models=None, errors=None,
+                 interval_level=None):
+        """
+        初始化预测矩阵
+        
+        Args:
+            schools (list): 学校ID
+            years (list): 预测年份
+            metrics (list): 指标名称
+            values (np.ndarray): 预测值
+            lower (np.ndarray, optional): 预测区间下限
+            upper (np.ndarray, optional): 预测区间上限
+            models (list, optional): 每所学校选用的模型
+            errors (dict, optional): {学校ID: 无法预测的原因}
+            interval_level (float, optional): 区间的覆盖概率
+        """
+        self.schools = list(schools)
+        self.years = list(years)
+        self.metrics = list(metrics)
+        self.values = values
+        self.lower = lower
+        self.upper = upper
+        self.models = models or [None] * len(self.schools)
+        self.errors = errors or {}
+        self.interval_level = interval_level
+        self._school_positions = {school: i for i, school in enumerate(self.schools)}
+    
+    def get(self, school_name, year, metric="avg_score"):
+        """
+        查询一个预测值
+        
+        Args:
+            school_name (str): 学校名称
+            year (int): 预测年份
+            metric (str): 指标名称
+        
+        Returns:
+            float: 预测值，无法预测时为NaN
+        """
+        school = self._school_positions[school_index.canonical(school_name)]
+        return float(self.values[school, self.years.index(year), self.metrics.index(metric)])
+    
+    def to_frame(self):
+        """
+        宽表：每所学校一行，每个年份和指标一列（如 avg_score_2027，以及 avg_score_2027_lower / _upper）
+        
+        Returns:
+            pd.DataFrame: 预测矩阵
+        """
+        columns = {
+            "school_name": self.schools,
+            "model": self.models,
+            "error": [self.errors.get(school) for school in self.schools],
+        }
+        for y, year in enumerate(self.years):
+            for m, metric in enumerate(self.metrics):
+                columns[f"{metric}_{year}"] = np.round(self.values[:, y, m], 1)
+                if self.lower is not None:
+                    columns[f"{metric}_{year}_lower"] = np.round(self.lower[:, y, m], 1)
+                    columns[f"{metric}_{year}_upper"] = np.round(self.upper[:, y, m], 1)
+        return pd.DataFrame(columns)
+    
+    def save(self, output_file=None, fmt="csv", compression=None):
+        """
+        导出宽表
+        
+        Args:
+            output_file (str, optional): 输出文件路径，默认写入config.EXPORT_DIR
+            fmt (str): 导出格式（csv/jsonl/parquet，parquet需要安装pyarrow）
+            compression (str, optional): 压缩方式，同DataExporter.export
+        
+        Returns:
+            str: 输出文件路径
+        """
+        output_file = output_file or DataExporter.default_output_file("prediction_matrix", fmt, compression)
+        return DataExporter.write_frame(self.to_frame(), output_file, fmt, compression)
+
 class ScorePredictor:
     """分数预测类"""
     
     @staticmethod
-    def predict_scores(school_name, prediction_year=2026):
+    def _is_valid_score(score):
+        """分数字段均为非零值的记录才可用于训练（0表示解析失败）"""
+        return bool(score.min_score and score.max_score and score.avg_score)
+    
+    @staticmethod
+    def plan_missing_scores(school_name, school_scores, years=None):
         """
-        预测指定学校未来年份的录取分数
+        计算预测所需但本地缺失的(学校, 年份)
+        
+        优先补齐最近的年份，已有可用记录达到config.LAZY_FETCH_TARGET_YEARS条时不再补充。
         
         Args:
             school_name (str): 学校名称
-            prediction_year (int): 预测年份
+            school_scores (list): 该学校已存储的AdmissionScore对象列表
+            years (list, optional): 候选年份，默认为config.DATA_YEARS
             
         Returns:
-            dict: 预测结果
+            list: 需要查询的年份列表（从近到远）
+        """
+        years = years or config.DATA_YEARS
+        valid_years = {int(score.year) for score in school_scores if ScorePredictor._is_valid_score(score)}
+        needed = config.LAZY_FETCH_TARGET_YEARS - len(valid_years)
+        if needed <= 0:
+            return []
+        
+        missing = [year for year in sorted(years, reverse=True) if year not in valid_years]
+        return missing[:needed]
+    
+    @staticmethod
+    def fetch_missing_scores(school_name, years, scraper=None):
+        """
+        并发查询指定年份的录取分数（优先使用响应缓存），并合并写入数据存储
+        
+        查询失败时不使用模拟数据，只有真实的查询结果才会写入数据存储并记为最新。
+        
+        Args:
+            school_name (str): 学校名称
+            years (list): 需要查询的年份列表
+            scraper (ScoreScraper, optional): 录取分数爬虫
+            
+        Returns:
+            list: 查询成功的AdmissionScore对象列表
+        """
+        if not years:
+            return []
+        
+        if scraper is None:
+            from scrapers.score_scraper import ScoreScraper
+            scraper = ScoreScraper()
+        
+        logger.info(f"{school_name} 历史数据不足，按需查询 {years}")
+        with ThreadPoolExecutor(max_workers=min(config.LAZY_FETCH_WORKERS, len(years))) as executor:
+            fetched = list(executor.map(lambda year: scraper.get_admission_score(school_name, year, fallback=False), years))
+        
+        fetched = [score for score in fetched if score is not None]
+        if fetched:
+            from utils.refresh_scheduler import RefreshState, SCORE_METRIC
+            DataStorage.upsert_admission_scores(fetched)
+            RefreshState().mark(SCORE_METRIC, [(score.school_name, score.year) for score in fetched])
+        
+        return fetched
+    
+    @staticmethod
+    def _school_history(school_name, fetch_missing=False, scraper=None, scores=None):
+        """
+        获取一所学校可用于训练的历史录取分数
+        
+        Args:
+            school_name (str): 学校名称
+            fetch_missing (bool): 本地历史数据不足时，是否只查询预测所需的缺失年份
+            scraper (ScoreScraper, optional): 按需查询时使用的录取分数爬虫
+            scores (list, optional): 已加载的AdmissionScore对象列表，如果不提供则从存储加载
+            
+        Returns:
+            list: 分数有效的AdmissionScore对象列表
         """
         # 加载历史数据
-        scores = DataStorage.load_admission_scores()
+        if scores is None:
+            scores = DataStorage.load_admission_scores()
         
         # 过滤指定学校的数据
         school_scores = [score for score in scores if score.school_name == school_name]
         
-        if len(school_scores) < 2:
+        # 按需补齐缺失的年份，而不是批量收集整个分类
+        if fetch_missing:
+            missing_years = ScorePredictor.plan_missing_scores(school_name, school_scores)
+            fetched = ScorePredictor.fetch_missing_scores(school_name, missing_years, scraper)
+            fetched_years = {score.year for score in fetched}
+            school_scores = [score for score in school_scores if score.year not in fetched_years] + fetched
+        
+        # 分数为0的记录是解析失败的结果，不参与训练
+        return [score for score in school_scores if ScorePredictor._is_valid_score(score)]
+    
+    @staticmethod
+    def _history_arrays(school_name, fetch_missing=False, scraper=None, scores=None, snapshot=None):
+        """
+        一所学校可用于训练的历史分数（按年份升序）
+        
+        Returns:
+            tuple: (年份数组, {"min_score"/"max_score"/"avg_score": 数值数组})
+        """
+        if snapshot is not None and scores is None and not fetch_missing:
+            rows = snapshot.school_rows("scores", school_name)
+            # 分数为0的记录是解析失败的结果，不参与训练
+            valid = (rows["min_score"] > 0) & (rows["max_score"] > 0) & (rows["avg_score"] > 0)
+            years = np.asarray(rows["year"][valid], dtype=float)
+            series = {name: np.asarray(rows[name][valid], dtype=float) for name in SERIES}
+        else:
+            school_scores = ScorePredictor._school_history(school_name, fetch_missing, scraper, scores)
+            years = np.array([score.year for score in school_scores], dtype=float)
+            series = {name: np.array([getattr(score, name) for score in school_scores], dtype=float) for name in SERIES}
+        
+        order = np.argsort(years, kind="stable")
+        return years[order], {name: values[order] for name, values in series.items()}
+    
+    @staticmethod
+    def _build_prediction(school_name, prediction_year, years, result):
+        """
+        把模型结果整理为预测结果
+        
+        置信度由所选模型的回测误差决定：平均绝对误差为0时最高，达到config.PREDICTION_CONFIDENCE_MAE分时为0，
+        再按数据年数折减；数据不足以回测时按训练数据的拟合度估计。
+        """
+        if len(years) < 2 or "error" in result:
             return {
                 "school_name": school_name,
                 "year": prediction_year,
@@ -42,95 +249,266 @@ class ScorePredictor:
                 "max_score": None,
                 "avg_score": None,
                 "confidence": 0,
-                "error": "历史数据不足，无法进行预测"
+                "error": result.get("error", "历史数据不足，无法进行预测")
             }
         
-        # 准备训练数据
-        X = np.array([[score.year] for score in school_scores])
-        y_min = np.array([score.min_score for score in school_scores])
-        y_max = np.array([score.max_score for score in school_scores])
-        y_avg = np.array([score.avg_score for score in school_scores])
+        data_factor = min(len(years) / 5, 1)
+        if result["backtest_mae"] is None:
+            confidence = data_factor * 0.7 * (0.3 + 0.7 * result["r2"])
+        else:
+            confidence = data_factor * max(0.0, 1 - result["backtest_mae"] / config.PREDICTION_CONFIDENCE_MAE)
         
-        # 创建并训练线性回归模型
-        model_min = LinearRegression()
-        model_max = LinearRegression()
-        model_avg = LinearRegression()
+        predictions = result["predictions"]
+        prediction = {
+            "school_name": school_name,
+            "year": prediction_year,
+            "min_score": round(predictions["min_score"], 1),
+            "max_score": round(predictions["max_score"], 1),
+            "avg_score": round(predictions["avg_score"], 1),
+            "confidence": round(confidence * 100, 1),  # 转换为百分比
+            "r2_score": round(result["r2"], 3),
+            "model": result["model"],
+            "backtest_mae": None if result["backtest_mae"] is None else round(result["backtest_mae"], 2)
+        }
         
-        model_min.fit(X, y_min)
-        model_max.fit(X, y_max)
-        model_avg.fit(X, y_avg)
+        # 预测区间，如 min_score_lower / min_score_upper，数据不足时为None
+        intervals = result.get("intervals")
+        prediction["interval_level"] = config.PREDICTION_INTERVAL_LEVEL if intervals else None
+        for name in SERIES:
+            lower, upper = intervals[name] if intervals else (None, None)
+            prediction[f"{name}_lower"] = None if lower is None else round(lower, 1)
+            prediction[f"{name}_upper"] = None if upper is None else round(upper, 1)
+        return prediction
+    
+    @staticmethod
+    def _resamples(resamples):
+        """重抽样次数，None表示使用配置"""
+        return config.PREDICTION_BOOTSTRAP_RESAMPLES if resamples is None else resamples
+    
+    @staticmethod
+    def predict_scores(school_name, prediction_year=2026, fetch_missing=False, scraper=None, scores=None, snapshot=None,
+                       model=None, resamples=None):
+        """
+        预测指定学校未来年份的录取分数
         
-        # 预测未来年份的分数
-        future_year = np.array([[prediction_year]])
-        predicted_min = model_min.predict(future_year)[0]
-        predicted_max = model_max.predict(future_year)[0]
-        predicted_avg = model_avg.predict(future_year)[0]
+        Args:
+            school_name (str): 学校名称
+            prediction_year (int): 预测年份
+            fetch_missing (bool): 本地历史数据不足时，是否只查询预测所需的缺失年份
+            scraper (ScoreScraper, optional): 按需查询时使用的录取分数爬虫
+            scores (list, optional): 已加载的AdmissionScore对象列表，如果不提供则从存储加载
+            snapshot (HistorySnapshot, optional): 内存映射的历史数据快照，提供时直接使用其中的数组
+                （不与fetch_missing同时使用）
+            model (str, optional): 预测模型（见utils.forecast_models.MODELS），None表示按回测误差自动选择
+            resamples (int, optional): 预测区间的重抽样次数，默认使用config.PREDICTION_BOOTSTRAP_RESAMPLES，0表示不计算区间
+            
+        Returns:
+            dict: 预测结果
+        """
+        school_name = school_index.canonical(school_name)
+        years, series = ScorePredictor._history_arrays(school_name, fetch_missing, scraper, scores, snapshot)
+        if len(years) < 2:
+            return ScorePredictor._build_prediction(school_name, prediction_year, years, {})
         
-        # 计算预测置信度（基于历史数据的数量和拟合度）
-        confidence = min(len(school_scores) / 5, 1) * 0.7  # 数据量因子
+        with phase("fit"):
+            result = forecast(years, series, prediction_year, model, ScorePredictor._resamples(resamples))
+        return ScorePredictor._build_prediction(school_name, prediction_year, years, result)
+    
+    @staticmethod
+    def _load_histories(school_names, snapshot=None):
+        """
+        一次加载多所学校的历史分数
         
-        # 计算R²作为拟合度指标
-        r2_min = model_min.score(X, y_min)
-        r2_max = model_max.score(X, y_max)
-        r2_avg = model_avg.score(X, y_avg)
-        avg_r2 = (r2_min + r2_max + r2_avg) / 3
+        有与数据文件一致的快照时直接映射使用，否则只读取一次数据文件并按学校分组。
         
-        # 综合置信度
-        confidence = confidence * (0.3 + 0.7 * avg_r2)
+        Args:
+            school_names (list): 学校ID列表
+            snapshot (HistorySnapshot, optional): 内存映射的历史数据快照，默认使用已发布的快照
         
-        return {
-            "school_name": school_name,
-            "year": prediction_year,
-            "min_score": round(predicted_min, 1),
-            "max_score": round(predicted_max, 1),
-            "avg_score": round(predicted_avg, 1),
-            "confidence": round(confidence * 100, 1),  # 转换为百分比
-            "r2_score": round(avg_r2, 3)
-        }
+        Returns:
+            dict: {学校ID: (年份数组, {序列名: 数值数组})}
+        """
+        snapshot = snapshot or HistorySnapshot.open_current()
+        if snapshot is not None:
+            return {school: ScorePredictor._history_arrays(school, snapshot=snapshot) for school in school_names}
+        
+        by_school = {}
+        for score in DataStorage.load_admission_scores():
+            by_school.setdefault(score.school_name, []).append(score)
+        return {school: ScorePredictor._history_arrays(school, scores=by_school.get(school, [])) for school in school_names}
     
     @staticmethod
-    def batch_predict_scores(school_names, prediction_year=2026):
+    @profiled("batch_predict_scores")
+    def batch_predict_scores(school_names, prediction_year=2026, snapshot=None, model=None, workers=None, resamples=None):
         """
         批量预测多个学校的录取分数
         
+        年份相同的学校合并后一次完成候选模型的回测和预测，学校较多时在进程池中并行。
+        
         Args:
             school_names (list): 学校名称列表
             prediction_year (int): 预测年份
+            snapshot (HistorySnapshot, optional): 内存映射的历史数据快照，默认使用与数据文件一致的已发布快照
+            model (str, optional): 预测模型，None表示每所学校按回测误差自动选择
+            workers (int, optional): 进程数，默认使用config.PREDICTION_WORKERS
+            resamples (int, optional): 预测区间的重抽样次数，默认使用config.PREDICTION_BOOTSTRAP_RESAMPLES
             
         Returns:
             list: 预测结果列表
         """
-        predictions = []
+        school_names = [school_index.canonical(school) for school in school_names]
+        histories = ScorePredictor._load_histories(school_names, snapshot)
+        tasks = [(school, years, series) for school, (years, series) in histories.items() if len(years) >= 2]
         
-        for school in school_names:
-            prediction = ScorePredictor.predict_scores(school, prediction_year)
-            predictions.append(prediction)
+        with phase("fit"):
+            results = forecast_many(tasks, prediction_year, model, workers, ScorePredictor._resamples(resamples))
         
-        return predictions
+        return [
+            ScorePredictor._build_prediction(school, prediction_year, histories[school][0], results.get(school, {}))
+            for school in school_names
+        ]
+    
+    @staticmethod
+    @profiled("predict_matrix")
+    def predict_matrix(school_names=None, categories=None, target_years=None, snapshot=None, model=None, workers=None,
+                       resamples=None):
+        """
+        多所学校、多个年份的预测矩阵
+        
+        历史数据只加载一次，每所学校只选择一次模型，所有预测年份由同一次拟合给出。
+        
+        Args:
+            school_names (list, optional): 学校名称列表
+            categories (list, optional): 学校分类名称（如 上海四校），与school_names合并；两者都不提供时预测所有学校
+            target_years (list, optional): 预测年份，默认从config.PREDICTION_YEAR起的config.PREDICTION_MATRIX_YEARS年
+            snapshot (HistorySnapshot, optional): 内存映射的历史数据快照，默认使用已发布的快照
+            model (str, optional): 预测模型，None表示每所学校按回测误差自动选择
+            workers (int, optional): 进程数，默认使用config.PREDICTION_WORKERS
+            resamples (int, optional): 预测区间的重抽样次数，默认使用config.PREDICTION_BOOTSTRAP_RESAMPLES
+        
+        Returns:
+            PredictionMatrix: 预测矩阵
+        """
+        names = list(school_names or [])
+        for category in categories or []:
+            if category not in config.SCHOOL_CATEGORIES:
+                raise ValueError(f"未知的学校分类: {category}，可选 {', '.join(config.SCHOOL_CATEGORIES)}")
+            names.extend(config.SCHOOL_CATEGORIES[category])
+        if not school_names and not categories:
+            names = [school for schools in config.SCHOOL_CATEGORIES.values() for school in schools]
+        schools = school_index.unique(names)
+        
+        if target_years is None:
+            target_years = range(config.PREDICTION_YEAR, config.PREDICTION_YEAR + config.PREDICTION_MATRIX_YEARS)
+        target_years = sorted({int(year) for year in target_years})
+        if not target_years:
+            raise ValueError("至少需要一个预测年份")
+        
+        histories = ScorePredictor._load_histories(schools, snapshot)
+        tasks = [(school, years, series) for school, (years, series) in histories.items() if len(years) >= 2]
+        resamples = ScorePredictor._resamples(resamples)
+        with phase("fit"):
+            results = forecast_many(tasks, target_years, model, workers, resamples)
+        
+        shape = (len(schools), len(target_years), len(SERIES))
+        values = np.full(shape, np.nan)
+        lower = np.full(shape, np.nan) if resamples else None
+        upper = np.full(shape, np.nan) if resamples else None
+        models = [None] * len(schools)
+        errors = {}
+        for i, school in enumerate(schools):
+            result = results.get(school, {"error": "历史数据不足，无法进行预测"})
+            if "error" in result:
+                errors[school] = result["error"]
+                continue
+            models[i] = result["model"]
+            values[i] = np.stack([result["predictions"][name] for name in SERIES], axis=-1)
+            if lower is not None and result["intervals"]:
+                lower[i] = np.stack([result["intervals"][name][0] for name in SERIES], axis=-1)
+                upper[i] = np.stack([result["intervals"][name][1] for name in SERIES], axis=-1)
+        
+        return PredictionMatrix(schools, target_years, SERIES, values, lower, upper, models, errors,
+                                config.PREDICTION_INTERVAL_LEVEL if resamples else None)
     
     @staticmethod
     def save_predictions(predictions, output_file=None):
         """
         保存预测结果
         
+        按config.EXPORT_CHUNK_ROWS行分块写出，不先合并为一个DataFrame；写完后原子替换输出文件。
+        
         Args:
-            predictions (list): 预测结果列表
+            predictions (iterable): 预测结果（列表或逐个生成的预测结果）
             output_file (str, optional): 输出文件路径
             
         Returns:
             bool: 是否保存成功
         """
-        if not predictions:
-            return False
-        
         if output_file is None:
             output_file = config.PREDICTION_FILE
         
-        # 确保输出目录存在
-        os.makedirs(os.path.dirname(output_file), exist_ok=True)
+        # 分块写入临时文件，没有预测结果时不覆盖原文件
+        tmp_file = f"{output_file}.tmp"
+        result = DataExporter.write_records(predictions, tmp_file, columns=PREDICTION_COLUMNS)
+        if result["rows"] == 0:
+            os.remove(tmp_file)
+            return False
+        os.replace(tmp_file, output_file)
+        
+        return True
+    
+    @staticmethod
+    @profiled("update_predictions")
+    def update_predictions(prediction_year=None, output_file=None, consumer="predictions", model=None, workers=None,
+                           resamples=None):
+        """
+        按变更日志增量更新保存的预测结果
+        
+        只重新预测上次更新之后录取分数发生变化的学校，替换预测文件中这些学校的行；
+        首次运行、预测文件不存在或预测年份不同、变更日志被重置时预测所有分类中的学校。
+        
+        Args:
+            prediction_year (int, optional): 预测年份，默认使用config.PREDICTION_YEAR
+            output_file (str, optional): 预测文件路径，默认使用config.PREDICTION_FILE
+            consumer (str): 变更日志的订阅方名称，不同预测文件应使用不同的名称
+            model (str, optional): 预测模型，None表示每所学校按回测误差自动选择
+            workers (int, optional): 进程数，默认使用config.PREDICTION_WORKERS
+            resamples (int, optional): 预测区间的重抽样次数，默认使用config.PREDICTION_BOOTSTRAP_RESAMPLES
+        
+        Returns:
+            dict: {"schools": 重新预测的学校数, "full": 是否全量预测, "output_file": 预测文件路径}
+        """
+        prediction_year = config.PREDICTION_YEAR if prediction_year is None else prediction_year
+        output_file = output_file or config.PREDICTION_FILE
+        subscription = change_feed.subscribe(consumer, tables=["scores"])
+        # 先读取变更再加载数据：读取之后的写入会在下次更新时再处理一次
+        changes = subscription.poll()
         
-        # 转换为DataFrame并保存
-        df = pd.DataFrame(predictions)
-        df.to_csv(output_file, index=False)
+        # 只读取年份一列判断已有的预测文件能否增量更新
+        existing = False
+        if os.path.exists(output_file):
+            years = pd.read_csv(output_file, usecols=["year"])["year"]
+            existing = not years.empty and bool((years == prediction_year).all())
+        
+        if changes is None or not existing:
+            schools = school_index.unique(school for schools in config.SCHOOL_CATEGORIES.values() for school in schools)
+            existing = False
+        else:
+            schools = school_index.unique(change["key"][0] for change in changes)
+        
+        if schools:
+            predictions = ScorePredictor.batch_predict_scores(schools, prediction_year, model=model, workers=workers,
+                                                              resamples=resamples)
+            
+            def records():
+                # 已有文件中其他学校的行按块读出后原样写回
+                if existing:
+                    for chunk in pd.read_csv(output_file, chunksize=config.EXPORT_CHUNK_ROWS):
+                        yield from chunk[~chunk["school_name"].isin(schools)].to_dict("records")
+                yield from predictions
+            
+            ScorePredictor.save_predictions(records(), output_file)
         
-        return True
\ No newline at end of file
+        subscription.commit()
+        logger.info(f"已更新 {len(schools)} 所学校的预测: {output_file}")
+        return {"schools": len(schools), "full": not existing, "output_file": output_file}
@@ -0,0 +1,123 @@
+"""
+后台预取
+用户选择学校分类后，在后台低优先级地查询该分类各学校各年份的数据，
+提前写入响应缓存，用户选定年份时结果通常已经就绪
+"""
+import logging
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, CancelledError, TimeoutError
+
+# 添加项目根目录到系统路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.refresh_scheduler import SCORE_METRIC, RATE_METRIC
+import config
+
+logger = logging.getLogger('prefetcher')
+
+class Prefetcher:
+    """后台预取器"""
+    
+    def __init__(self, score_scraper, rate_scraper, workers=None, budget=None):
+        """
+        初始化预取器
+        
+        Args:
+            score_scraper (ScoreScraper): 录取分数爬虫
+            rate_scraper (RateScraper): 升学率爬虫
+            workers (int, optional): 后台线程数，默认使用config.PREFETCH_WORKERS
+            budget (int, optional): 每次选择分类后最多预取的查询数，默认使用config.PREFETCH_BUDGET
+        """
+        self.scrapers = {SCORE_METRIC: score_scraper, RATE_METRIC: rate_scraper}
+        self.budget = config.PREFETCH_BUDGET if budget is None else budget
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers or config.PREFETCH_WORKERS,
+            thread_name_prefix="prefetch"
+        )
+        self._futures = {}
+        self._lock = threading.Lock()
+    
+    def _fetch(self, metric, school_name, year):
+        """预取单个查询（只写入缓存，失败时不使用模拟数据）"""
+        scraper = self.scrapers[metric]
+        if metric == SCORE_METRIC:
+            scraper.get_admission_score(school_name, year, fallback=False)
+        else:
+            scraper.get_admission_rate(school_name, year, fallback=False)
+    
+    def prefetch_category(self, metric, school_names, years=None):
+        """
+        预取一个分类下各学校各年份的数据
+        
+        取消上一次尚未开始的预取任务；已有未过期缓存的查询不占用预算。
+        最近的年份优先。
+        
+        Args:
+            metric (str): 指标名称（录取分数/升学率）
+            school_names (list): 学校名称列表
+            years (list, optional): 年份列表，默认为config.DATA_YEARS
+        """
+        if self.budget <= 0:
+            return
+        
+        years = years or config.DATA_YEARS
+        scraper = self.scrapers[metric]
+        
+        with self._lock:
+            # 用户已切换分类，放弃之前排队中的任务
+            for future in self._futures.values():
+                future.cancel()
+            self._futures = {key: future for key, future in self._futures.items() if not future.done()}
+            
+            scheduled = 0
+            for year in sorted(years, reverse=True):
+                for school_name in school_names:
+                    if scheduled >= self.budget:
+                        break
+                    
+                    key = (metric, school_name, year)
+                    if key in self._futures:
+                        continue
+                    prompt = scraper.build_prompt(school_name, year)
+                    if scraper.cache.get(prompt, max_age=config.RESPONSE_CACHE_TTL) is not None:
+                        continue
+                    
+                    self._futures[key] = self._executor.submit(self._fetch, metric, school_name, year)
+                    scheduled += 1
+        
+        logger.debug(f"已安排 {scheduled} 个{metric}预取任务")
+    
+    def wait_for(self, metric, school_name, year, timeout=None):
+        """
+        如果该查询正在预取，等待其完成，避免前台重复发送同一查询
+        
+        Args:
+            metric (str): 指标名称
+            school_name (str): 学校名称
+            year (int): 年份
+            timeout (float, optional): 最长等待时间（秒）
+        """
+        with self._lock:
+            future = self._futures.get((metric, school_name, year))
+        
+        if future is None:
+            return
+        if not future.running() and future.cancel():
+            # 还没开始的任务直接取消，由前台查询
+            return
+        
+        try:
+            future.result(timeout=timeout)
+        except (CancelledError, TimeoutError):
+            pass
+        except Exception as e:
+            logger.warning(f"预取失败: {str(e)}")
+    
+    def shutdown(self):
+        """取消排队中的任务并关闭后台线程"""
+        with self._lock:
+            for future in self._futures.values():
+                future.cancel()
+            self._futures = {}
+        self._executor.shutdown(wait=False)
\ No newline at end of file
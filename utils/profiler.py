@@ -0,0 +1,229 @@
+"""
+性能分析工具
+提供可选的cProfile、tracemalloc和分阶段计时功能，
+通过环境变量SH_PROFILE或命令行参数--profile开启
+"""
+import cProfile
+import functools
+import io
+import json
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# 添加项目根目录到系统路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import config
+
+logger = logging.getLogger('profiler')
+
+PROFILE_MODES = ("cprofile", "tracemalloc", "timers")
+
+# 通过命令行设置的分析模式，优先于环境变量
+_enabled_modes = None
+
+# 当前正在进行的分析会话（同一时间只允许一个，嵌套调用不重复分析）
+_active_run = None
+_run_lock = threading.Lock()
+
+def parse_profile_modes(value):
+    """
+    解析分析模式字符串
+    
+    Args:
+        value (str): 逗号分隔的模式，如"cprofile,timers"，"all"表示全部
+    
+    Returns:
+        set: 分析模式集合
+    """
+    if not value:
+        return set()
+    
+    modes = set()
+    for item in value.split(","):
+        item = item.strip().lower()
+        if item == "all":
+            modes.update(PROFILE_MODES)
+        elif item in PROFILE_MODES:
+            modes.add(item)
+        elif item:
+            logger.warning(f"未知的性能分析模式: {item}")
+    return modes
+
+def enable_profiling(modes):
+    """
+    开启性能分析（通常由命令行参数调用）
+    
+    Args:
+        modes (str): 逗号分隔的分析模式
+    """
+    global _enabled_modes
+    _enabled_modes = parse_profile_modes(modes)
+
+def get_profile_modes():
+    """获取当前生效的分析模式"""
+    if _enabled_modes is not None:
+        return _enabled_modes
+    return parse_profile_modes(os.environ.get(config.PROFILE_ENV_VAR, ""))
+
+class _ProfileRun:
+    """一次分析会话，记录各阶段的墙钟时间和CPU时间"""
+    
+    def __init__(self, name, modes):
+        self.name = name
+        self.modes = modes
+        self.phases = {}
+        self.lock = threading.Lock()
+    
+    def add_phase(self, phase_name, wall, cpu):
+        with self.lock:
+            stats = self.phases.setdefault(phase_name, {"count": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0})
+            stats["count"] += 1
+            stats["wall_seconds"] += wall
+            stats["cpu_seconds"] += cpu
+
+@contextmanager
+def phase(phase_name):
+    """
+    分阶段计时（network、parse、storage、fit等）
+    
+    未开启timers模式时几乎没有额外开销。
+    
+    Args:
+        phase_name (str): 阶段名称
+    """
+    run = _active_run
+    if run is None or "timers" not in run.modes:
+        yield
+        return
+    
+    wall_start = time.perf_counter()
+    cpu_start = time.thread_time()
+    try:
+        yield
+    finally:
+        run.add_phase(phase_name, time.perf_counter() - wall_start, time.thread_time() - cpu_start)
+
+@contextmanager
+def profile_run(name):
+    """
+    对一次运行进行性能分析，结束后把结果写入分析目录
+    
+    嵌套调用时只有最外层生效。
+    
+    Args:
+        name (str): 运行名称，用于输出文件名
+    """
+    global _active_run
+    
+    modes = get_profile_modes()
+    with _run_lock:
+        if not modes or _active_run is not None:
+            nested = True
+        else:
+            nested = False
+            _active_run = _ProfileRun(name, modes)
+            run = _active_run
+    
+    if nested:
+        yield
+        return
+    
+    profiler = None
+    if "cprofile" in modes:
+        profiler = cProfile.Profile()
+    
+    # 只停止由本次会话启动的tracemalloc
+    started_tracemalloc = False
+    if "tracemalloc" in modes and not tracemalloc.is_tracing():
+        tracemalloc.start(config.PROFILE_TRACEMALLOC_FRAMES)
+        started_tracemalloc = True
+    
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    if profiler:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler:
+            profiler.disable()
+        wall = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+        
+        snapshot = None
+        if "tracemalloc" in modes and tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot()
+            if started_tracemalloc:
+                tracemalloc.stop()
+        
+        with _run_lock:
+            _active_run = None
+        
+        try:
+            _write_results(run, profiler, snapshot, wall, cpu)
+        except OSError as e:
+            logger.error(f"写入性能分析结果失败: {str(e)}")
+
+def profiled(name, phase_name=None):
+    """
+    装饰器：对函数调用进行性能分析
+    
+    Args:
+        name (str): 运行名称
+        phase_name (str, optional): 同时计入的阶段名称
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with profile_run(name):
+                if phase_name is None:
+                    return func(*args, **kwargs)
+                with phase(phase_name):
+                    return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def _write_results(run, profiler, snapshot, wall, cpu):
+    """
+    将分析结果写入分析目录
+    
+    Args:
+        run (_ProfileRun): 分析会话
+        profiler (cProfile.Profile): cProfile分析器
+        snapshot (tracemalloc.Snapshot): 内存快照
+        wall (float): 总墙钟时间（秒）
+        cpu (float): 总CPU时间（秒）
+    """
+    os.makedirs(config.PROFILE_DIR, exist_ok=True)
+    prefix = os.path.join(config.PROFILE_DIR, f"{run.name}_{time.strftime('%Y%m%d_%H%M%S')}")
+    
+    if profiler:
+        profiler.dump_stats(f"{prefix}.prof")
+        stream = io.StringIO()
+        stats = pstats.Stats(profiler, stream=stream)
+        stats.sort_stats("cumulative").print_stats(config.PROFILE_TOP_N)
+        with open(f"{prefix}_cprofile.txt", "w", encoding="utf-8") as f:
+            f.write(stream.getvalue())
+    
+    if snapshot:
+        with open(f"{prefix}_tracemalloc.txt", "w", encoding="utf-8") as f:
+            for stat in snapshot.statistics("lineno")[:config.PROFILE_TOP_N]:
+                f.write(f"{stat}\n")
+    
+    if "timers" in run.modes:
+        result = {
+            "name": run.name,
+            "wall_seconds": wall,
+            "cpu_seconds": cpu,
+            "phases": run.phases
+        }
+        with open(f"{prefix}_timers.json", "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    
+    logger.info(f"性能分析结果已写入 {prefix}*")
\ No newline at end of file
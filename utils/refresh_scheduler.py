@@ -0,0 +1,287 @@
+"""
+增量刷新调度
+按数据的陈旧程度、缺失/异常字段和年份远近为每个(学校, 年份, 指标)打分，
+在调用预算内按优先级刷新，避免每次都重新查询整个分类
+"""
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+# 添加项目根目录到系统路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from models.data_model import DataStorage
+from scrapers.deadline import Deadline
+import config
+
+logger = logging.getLogger('refresh_scheduler')
+
+SCORE_METRIC = "录取分数"
+RATE_METRIC = "升学率"
+
+class RefreshState:
+    """记录每个(指标, 学校, 年份)最近一次成功获取的时间"""
+    
+    def __init__(self, state_file=None):
+        """
+        初始化刷新状态
+        
+        Args:
+            state_file (str, optional): 状态文件路径，默认使用config.REFRESH_STATE_FILE
+        """
+        self.state_file = state_file or config.REFRESH_STATE_FILE
+        self._lock = threading.Lock()
+        self._timestamps = None
+    
+    @staticmethod
+    def _key(metric, school_name, year):
+        return f"{metric}|{school_name}|{int(year)}"
+    
+    def _load(self):
+        """加载状态文件（调用方需持有锁）"""
+        if self._timestamps is not None:
+            return
+        self._timestamps = {}
+        if os.path.exists(self.state_file):
+            try:
+                with open(self.state_file, "r", encoding="utf-8") as f:
+                    self._timestamps = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.error(f"读取刷新状态失败: {str(e)}")
+    
+    def get(self, metric, school_name, year):
+        """
+        获取最近一次成功获取的时间
+        
+        Returns:
+            float: 时间戳，没有记录时返回None
+        """
+        with self._lock:
+            self._load()
+            return self._timestamps.get(self._key(metric, school_name, year))
+    
+    def mark(self, metric, pairs, timestamp=None):
+        """
+        记录一批(学校, 年份)已成功获取
+        
+        Args:
+            metric (str): 指标名称（录取分数/升学率）
+            pairs (list): (学校名称, 年份)列表
+            timestamp (float, optional): 获取时间，默认为当前时间；0表示视为从未获取（下次刷新时最优先重新查询）
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        with self._lock:
+            self._load()
+            for school_name, year in pairs:
+                self._timestamps[self._key(metric, school_name, year)] = timestamp
+            
+            os.makedirs(os.path.dirname(self.state_file) or ".", exist_ok=True)
+            tmp_file = f"{self.state_file}.tmp"
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                json.dump(self._timestamps, f, ensure_ascii=False)
+            os.replace(tmp_file, self.state_file)
+
+class RefreshScheduler:
+    """按优先级刷新数据的调度器"""
+    
+    def __init__(self, score_scraper=None, rate_scraper=None, state=None):
+        """
+        初始化调度器
+        
+        Args:
+            score_scraper (ScoreScraper, optional): 录取分数爬虫
+            rate_scraper (RateScraper, optional): 升学率爬虫
+            state (RefreshState, optional): 刷新状态
+        """
+        # 延迟导入，避免只做规划时加载爬虫
+        if score_scraper is None:
+            from scrapers.score_scraper import ScoreScraper
+            score_scraper = ScoreScraper()
+        if rate_scraper is None:
+            from scrapers.rate_scraper import RateScraper
+            rate_scraper = RateScraper()
+        
+        self.score_scraper = score_scraper
+        self.rate_scraper = rate_scraper
+        self.state = state or RefreshState()
+    
+    @staticmethod
+    def _score_problems(score):
+        """检查录取分数记录的缺失和异常字段"""
+        problems = []
+        if not score.min_score or not score.max_score or not score.avg_score:
+            problems.append("分数为0")
+        elif score.min_score > score.max_score:
+            problems.append("最低分高于最高分")
+        return problems
+    
+    @staticmethod
+    def _rate_problems(rate):
+        """检查升学率记录的缺失和异常字段"""
+        problems = []
+        if not rate.c9_rate or not rate.rate_985 or not rate.rate_211:
+            problems.append("升学率为0")
+        return problems
+    
+    @staticmethod
+    def _file_mtime(path):
+        """数据文件的修改时间，作为没有刷新记录时的获取时间"""
+        return os.path.getmtime(path) if os.path.exists(path) else None
+    
+    def _priority(self, problems, exists, fetched_at, year, latest_year, now):
+        """
+        计算单个(学校, 年份, 指标)的刷新优先级
+        
+        Args:
+            problems (list): 记录中的异常字段
+            exists (bool): 是否已有记录
+            fetched_at (float): 最近一次获取时间
+            year (int): 数据年份
+            latest_year (int): 最新的数据年份
+            now (float): 当前时间戳
+        
+        Returns:
+            tuple: (优先级, 原因列表)
+        """
+        reasons = []
+        priority = 0.0
+        
+        if not exists:
+            priority += config.REFRESH_WEIGHT_MISSING
+            reasons.append("缺失")
+        elif problems:
+            priority += config.REFRESH_WEIGHT_BROKEN
+            reasons.extend(problems)
+        
+        # 越久没有获取越陈旧，越早的年份数据越稳定，陈旧分按年份衰减
+        if fetched_at is None:
+            staleness = 1.0
+        else:
+            staleness = min((now - fetched_at) / (config.REFRESH_STALE_DAYS * 86400), 1.0)
+        recency = config.REFRESH_YEAR_DECAY ** max(latest_year - year, 0)
+        stale_priority = staleness * recency
+        if stale_priority >= config.REFRESH_MIN_PRIORITY:
+            reasons.append("陈旧")
+        priority += stale_priority
+        
+        return priority, reasons
+    
+    def plan(self, school_names=None, years=None, budget=None):
+        """
+        生成刷新计划
+        
+        Args:
+            school_names (list, optional): 学校名称列表，默认为所有分类的学校
+            years (list, optional): 年份列表，默认为config.DATA_YEARS
+            budget (int, optional): 调用预算，默认为config.REFRESH_CALL_BUDGET
+        
+        Returns:
+            list: 按优先级从高到低排列的刷新项
+                [{"metric", "school_name", "year", "priority", "reasons"}]
+        """
+        if school_names is None:
+            school_names = list(dict.fromkeys(
+                school for schools in config.SCHOOL_CATEGORIES.values() for school in schools
+            ))
+        years = years or config.DATA_YEARS
+        budget = config.REFRESH_CALL_BUDGET if budget is None else budget
+        
+        latest_year = max(years)
+        now = time.time()
+        
+        sources = [
+            (SCORE_METRIC, DataStorage.load_admission_scores(), self._score_problems, config.SCORE_DATA_FILE),
+            (RATE_METRIC, DataStorage.load_admission_rates(), self._rate_problems, config.RATE_DATA_FILE),
+        ]
+        
+        items = []
+        for metric, records, check, data_file in sources:
+            stored = {(record.school_name, int(record.year)): record for record in records}
+            file_mtime = self._file_mtime(data_file)
+            
+            for school_name in school_names:
+                for year in years:
+                    record = stored.get((school_name, year))
+                    problems = check(record) if record is not None else []
+                    fetched_at = self.state.get(metric, school_name, year)
+                    if fetched_at is None and record is not None:
+                        fetched_at = file_mtime
+                    
+                    priority, reasons = self._priority(problems, record is not None, fetched_at, year, latest_year, now)
+                    if priority < config.REFRESH_MIN_PRIORITY:
+                        continue
+                    
+                    items.append({
+                        "metric": metric,
+                        "school_name": school_name,
+                        "year": year,
+                        "priority": round(priority, 3),
+                        "reasons": reasons
+                    })
+        
+        items.sort(key=lambda item: (-item["priority"], -item["year"]))
+        return items[:budget]
+    
+    def execute(self, items, deadline=None):
+        """
+        执行刷新计划，绕过响应缓存重新查询，并合并写入数据存储
+        
+        查询失败的项不会使用模拟数据，也不会覆盖已有记录。
+        
+        Args:
+            items (list): 刷新项（plan的返回值或相同结构的列表）
+            deadline (float | Deadline, optional): 整体截止时间
+        
+        Returns:
+            dict: {"refreshed": 成功项列表, "failed": 失败或未完成项列表}
+        """
+        deadline = Deadline.from_value(deadline)
+        fetchers = {
+            SCORE_METRIC: self.score_scraper.get_admission_score,
+            RATE_METRIC: self.rate_scraper.get_admission_rate,
+        }
+        results = {SCORE_METRIC: [], RATE_METRIC: []}
+        refreshed, failed = [], []
+        
+        for item in items:
+            record = None
+            if not deadline.expired():
+                record = fetchers[item["metric"]](
+                    item["school_name"], item["year"], deadline=deadline, use_cache=False, fallback=False
+                )
+            
+            if record is None:
+                failed.append(item)
+            else:
+                results[item["metric"]].append(record)
+                refreshed.append(item)
+        
+        if results[SCORE_METRIC]:
+            DataStorage.upsert_admission_scores(results[SCORE_METRIC])
+            self.state.mark(SCORE_METRIC, [(r.school_name, r.year) for r in results[SCORE_METRIC]])
+        if results[RATE_METRIC]:
+            DataStorage.upsert_admission_rates(results[RATE_METRIC])
+            self.state.mark(RATE_METRIC, [(r.school_name, r.year) for r in results[RATE_METRIC]])
+        
+        logger.info(f"刷新完成: 成功 {len(refreshed)} 项，失败 {len(failed)} 项")
+        return {"refreshed": refreshed, "failed": failed}
+    
+    def run(self, budget=None, school_names=None, years=None, deadline=None):
+        """
+        生成刷新计划并执行
+        
+        Args:
+            budget (int, optional): 调用预算
+            school_names (list, optional): 学校名称列表
+            years (list, optional): 年份列表
+            deadline (float | Deadline, optional): 整体截止时间
+        
+        Returns:
+            dict: {"planned": 计划项列表, "refreshed": 成功项列表, "failed": 失败项列表}
+        """
+        items = self.plan(school_names, years, budget)
+        result = self.execute(items, deadline)
+        result["planned"] = items
+        return result
\ No newline at end of file